@@ -0,0 +1,61 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder, DEFAULT_EXCLUDED_CONTENT_TYPES
+from starlette.types import ASGIApp, Receive, Scope, Send
+from typing import Dict
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# lualatex output is already deflate-compressed internally, and bundles are mostly
+# PDFs and images; recompressing them only costs CPU.
+EXCLUDED_CONTENT_TYPES = DEFAULT_EXCLUDED_CONTENT_TYPES + ("application/pdf", "application/x-tar")
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}; a coding with q=0 is explicitly refused."""
+    result = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding] = q
+    return result
+def accepts(encodings: Dict[str, float], coding: str) -> bool:
+    return encodings.get(coding, encodings.get("*", 0.0)) > 0
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int = 5):
+        super().__init__(app, minimum_size, exclude_content_types=EXCLUDED_CONTENT_TYPES)
+        self.quality = quality
+        self.compressor = None
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self.compressor is None:
+            self.compressor = brotli.Compressor(quality=self.quality)
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses responses above minimum_size: brotli when the client accepts
+    it and the optional 'brotli' package is installed, gzip otherwise.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, compresslevel: int = 6):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel, exclude_content_types=EXCLUDED_CONTENT_TYPES)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encodings = accepted_encodings(Headers(scope=scope).get("Accept-Encoding", ""))
+        if brotli is not None and accepts(encodings, "br"):
+            responder = BrotliResponder(self.app, self.minimum_size)
+        elif accepts(encodings, "gzip"):
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel, exclude_content_types=self.exclude_content_types)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size, exclude_content_types=self.exclude_content_types)
+        await responder(scope, receive, send)
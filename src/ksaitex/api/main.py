@@ -1,15 +1,75 @@
-from fastapi import FastAPI, HTTPException, Form, UploadFile, File
-from fastapi.responses import Response, FileResponse
+import os
+from fastapi import FastAPI, HTTPException, Form, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from pathlib import Path
+from typing import Optional, Tuple, List, Dict
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from ksaitex.parsing.markdown import parse
 from ksaitex.templating.engine import render_latex
-from ksaitex.compilation.compiler import compile_latex
-app = FastAPI()
+from ksaitex.compilation.farm import compile_with_farm
+from ksaitex.compilation.speculative import speculative_compiler, source_signature
+from ksaitex.config import DATA_DIR
+from ksaitex.storage.locks import file_lock, project_lock, projects_lock, build_lock, builds_lock
+from ksaitex.storage.cache import compile_cache
+from ksaitex.storage.files import atomic_write_json
+from ksaitex.storage.retention import touch_build, lease_project
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    import asyncio
+    import os
+    from ksaitex.templating.registry import get_registry
+    registry = get_registry()
+    interval = float(os.environ.get("KSAITEX_TEMPLATE_POLL_INTERVAL", "2"))
+    watcher = asyncio.create_task(registry.watch(interval))
+    from ksaitex.compilation.farm import compile_farm
+    reaper = asyncio.create_task(compile_farm.run_reaper())
+    collector = asyncio.create_task(collect_garbage(float(os.environ.get("KSAITEX_GC_INTERVAL", "3600"))))
+    indexer = asyncio.create_task(refresh_search_index())
+    speculative_compiler.builder = speculative_build
+    yield
+    watcher.cancel()
+    reaper.cancel()
+    collector.cancel()
+    indexer.cancel()
+    speculative_compiler.shutdown()
+async def collect_garbage(interval: float):
+    """Periodic build artifact eviction; builds of projects open in this process are kept."""
+    import asyncio
+    from ksaitex.api.sessions import session_manager
+    from ksaitex.storage.retention import retention_manager, format_bytes
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Legacy cleanup is never automatic: it touches files inside project directories.
+            report = await asyncio.to_thread(retention_manager.run, set(session_manager.sessions), legacy=False)
+            if report["evicted"]:
+                print(f"DEBUG: Build GC evicted {len(report['evicted'])} artifacts, freed {format_bytes(report['freed'])}")
+        except Exception as e:
+            print(f"DEBUG: Build GC failed: {e}")
+async def refresh_search_index():
+    """Builds the search index in the background at startup when it is missing or behind the data directory."""
+    import asyncio
+    from ksaitex.storage.search import search_index
+    try:
+        if await asyncio.to_thread(search_index.is_stale, DATA_DIR):
+            stats = await asyncio.to_thread(search_index.rebuild, DATA_DIR)
+            print(f"DEBUG: Search index refreshed: {stats}")
+    except Exception as e:
+        print(f"DEBUG: Search index refresh failed: {e}")
+app = FastAPI(lifespan=lifespan)
+from ksaitex.api.compression import CompressionMiddleware
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get("KSAITEX_COMPRESSION_MIN_SIZE", "1024")))
 from fastapi import Request
+REVALIDATED_PATHS = {"/api/templates"}
 @app.middleware("http")
 async def disable_cache(request: Request, call_next):
+    if request.url.path in REVALIDATED_PATHS:
+        return await call_next(request)
     new_headers = []
     for name, value in request.scope.get("headers", []):
         if name.lower() not in (b"if-none-match", b"if-modified-since"):
@@ -34,54 +94,390 @@ class SaveRequest(BaseModel):
 class RenameRequest(BaseModel):
     old_id: str
     new_title: str
-DATA_DIR = Path("data")
-DATA_DIR.mkdir(exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
 @app.get("/api/templates")
-async def list_templates():
-    """List available .tex templates and their variable defaults."""
-    from ksaitex.templating.engine import TEMPLATE_DIR, TemplateEngine
-    engine = TemplateEngine()
-    templates_data = {}
-    if TEMPLATE_DIR.exists():
-        for f in TEMPLATE_DIR.glob("*.tex"):
-             name = f.stem
-             metadata = engine.get_metadata(f.name)
-             templates_data[name] = metadata
-    return {"templates": templates_data}
+async def list_templates(request: Request):
+    """List available .tex templates and their variable defaults, served from the template registry."""
+    from ksaitex.templating.registry import get_registry
+    payload, etag = get_registry().payload()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
+@app.get("/api/metrics")
+async def metrics():
+    """Compile counters of this worker process (started, timed out, limit killed...)."""
+    from ksaitex.compilation.compiler import compile_metrics
+    from ksaitex.compilation.farm import compile_farm
+    from ksaitex.storage.retention import retention_manager
+    gc_report = retention_manager.last_report
+    gc = {k: gc_report[k] for k in ("freed", "total", "skipped_busy", "finished")} if gc_report else None
+    return {"pid": os.getpid(), "compile": dict(compile_metrics), "farm": compile_farm.status(), "gc": gc, "speculative": speculative_compiler.status()}
+class FarmRegisterRequest(BaseModel):
+    name: str
+    slots: int = 1
+class FarmWorkerRequest(BaseModel):
+    worker_id: str
+class FarmResultRequest(BaseModel):
+    worker_id: str
+    job_id: str
+    ok: bool = False
+    pdf: Optional[str] = None
+    synctex: Optional[str] = None
+    log: str = ""
+    retry: bool = False
+def check_farm_token(request: Request):
+    """
+    Farm endpoints hand out sources and accept PDFs, so they need the
+    KSAITEX_FARM_TOKEN secret; without one only workers on this host are let in.
+    Farm state lives in one process, so multi-worker servers turn workers away.
+    """
+    import hmac
+    import ipaddress
+    from ksaitex.compilation.farm import farm_supported
+    if not farm_supported():
+        raise HTTPException(status_code=503, detail="The compile farm needs a single-process server (serve --workers 1)")
+    token = os.environ.get("KSAITEX_FARM_TOKEN")
+    if token:
+        if not hmac.compare_digest(request.headers.get("x-farm-token", "").encode("utf-8"), token.encode("utf-8")):
+            raise HTTPException(status_code=403, detail="Invalid farm token")
+        return
+    host = request.client.host if request.client else ""
+    try:
+        loopback = host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise HTTPException(status_code=403, detail="Remote farm workers require KSAITEX_FARM_TOKEN on the server")
+@app.post("/api/farm/register")
+async def farm_register(payload: FarmRegisterRequest, request: Request):
+    """Adds a 'ksaitex worker' to this server's compile farm."""
+    from ksaitex.compilation.farm import compile_farm
+    check_farm_token(request)
+    worker = compile_farm.register(payload.name, payload.slots)
+    return {"worker_id": worker.id}
+@app.post("/api/farm/poll")
+async def farm_poll(payload: FarmWorkerRequest, request: Request):
+    """Long-poll for the next job. Returns null on timeout; 404 tells the worker to register again."""
+    from ksaitex.compilation.farm import compile_farm
+    check_farm_token(request)
+    try:
+        job = await compile_farm.poll(payload.worker_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown worker")
+    return job.payload() if job else None
+@app.post("/api/farm/heartbeat")
+async def farm_heartbeat(payload: FarmWorkerRequest, request: Request):
+    from ksaitex.compilation.farm import compile_farm
+    check_farm_token(request)
+    try:
+        worker = compile_farm.touch(payload.worker_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown worker")
+    return {"depth": worker.depth}
+@app.post("/api/farm/result")
+async def farm_result(payload: FarmResultRequest, request: Request):
+    from ksaitex.compilation.farm import compile_farm
+    check_farm_token(request)
+    try:
+        compile_farm.complete(payload.worker_id, payload.job_id, payload.model_dump())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown worker")
+    return {"status": "accepted"}
+@app.get("/api/farm/assets/{digest}")
+async def farm_asset(digest: str, request: Request):
+    """Serves a content-addressed image or font blob to a worker."""
+    import re
+    from ksaitex.storage.assets import asset_store
+    check_farm_token(request)
+    if not re.fullmatch(r"[0-9a-f]{64}", digest) or not asset_store.has(digest):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return FileResponse(asset_store.path(digest), media_type="application/octet-stream")
 class SyncRequest(BaseModel):
     project_id: str
     line: int
     column: int = 1
-@app.post("/api/compile")
-async def compile_endpoint(request: CompileRequest):
+def project_id_for(title: str) -> str:
     import re
-    import json
-    print(f"DEBUG: Endpoint received title: '{request.title}'")
-    safe_title = re.sub(r'[^\w\s-]', '', request.title).strip().replace(' ', '_')
-    if not safe_title: safe_title = "unnamed_project"
-    project_dir = DATA_DIR / safe_title
-    project_dir.mkdir(parents=True, exist_ok=True)
+    safe_title = re.sub(r'[^\w\s-]', '', title).strip().replace(' ', '_')
+    return safe_title or "unnamed_project"
+def build_dir_for(project_id: str, build: str) -> Path:
+    import re
+    from ksaitex.storage.retention import is_build_name, build_dir
+    if not is_build_name(build) or not re.fullmatch(r"[\w-]+", build):
+        raise HTTPException(status_code=400, detail=f"Unknown build '{build}'")
+    return build_dir(project_id, build)
+def prepare_build_dir(project_id: str, build: str) -> Path:
+    """Creates the build directory with an images link back to the project, repairing it after a rename."""
+    build_dir = build_dir_for(project_id, build)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    images_link = build_dir / "images"
+    target = Path(os.path.relpath(DATA_DIR / project_id / "images", build_dir))
+    if images_link.is_symlink() and Path(os.readlink(images_link)) != target:
+        images_link.unlink()
+    if (DATA_DIR / project_id / "images").exists() and not images_link.is_symlink():
+        images_link.symlink_to(target, target_is_directory=True)
+    return build_dir
+async def compile_project(safe_title: str, markdown: str, template: str, variables: dict, limits=None, signature: Optional[str] = None) -> Tuple[Optional[bytes], list, str]:
+    """
+    parse -> render_latex -> compile_latex for a project, under its build
+    lock and through the shared compile cache. Returns (pdf_bytes, diagnostics, log).
+    """
     try:
-        latex_fragment, source_map = parse(request.markdown)
+        latex_fragment, source_map = parse(markdown)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Parsing error: {str(e)}")
     try:
-        template_filename = f"{request.template}.tex"
-        config = request.variables.copy()
+        template_filename = f"{template}.tex"
+        config = variables.copy()
         full_latex, offset = render_latex(latex_fragment, config, template_name=template_filename)
         final_map = {}
         for md_line, tex_line in source_map.items():
              final_map[str(md_line)] = tex_line + offset
-        with open(project_dir / "source_map.json", "w") as f:
-            json.dump(final_map, f)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Templating error: {str(e)}")
-    pdf_bytes, log = await compile_latex(full_latex, working_dir=project_dir)
+    pdf_bytes, diagnostics, log, _ = await compile_in_build_dir(safe_title, "main", full_latex, final_map, limits, signature)
+    return pdf_bytes, diagnostics, log
+async def compile_in_build_dir(safe_title: str, build: str, full_latex: str, final_map: dict, limits=None, signature: Optional[str] = None) -> Tuple[Optional[bytes], list, str, str]:
+    """
+    Compiles rendered LaTeX in one of the project's build directories under
+    that build's lock and through the compile cache. Returns
+    (pdf_bytes, diagnostics, log, cache_key). A successful main build records
+    the source signature it was built from.
+    """
+    diagnostics, log = [], ""
+    async with build_lock(safe_title, build):
+        build_dir = prepare_build_dir(safe_title, build)
+        if build == "main":
+            speculative_compiler.signature_path(safe_title).unlink(missing_ok=True)
+        atomic_write_json(build_dir / "source_map.json", final_map, indent=None)
+        key = compile_cache.key(full_latex, DATA_DIR / safe_title)
+        async with file_lock(compile_cache.lock_path(key)):
+            pdf_bytes = compile_cache.restore(key, build_dir)
+            if pdf_bytes:
+                print(f"DEBUG: Compile cache hit {key[:12]} for '{safe_title}' ({build})")
+                # The same LaTeX can come from markdown with different line numbers: map the cached log again.
+                log = restored_log(build_dir)
+                diagnostics = write_diagnostics(build_dir, log, final_map)
+            else:
+                pdf_bytes, log = await compile_with_farm(full_latex, working_dir=build_dir, limits=limits)
+                diagnostics = write_diagnostics(build_dir, log, final_map)
+                if pdf_bytes:
+                    compile_cache.store(key, build_dir)
+        if pdf_bytes and build == "main" and signature:
+            speculative_compiler.mark_built(safe_title, signature)
+    return pdf_bytes, diagnostics, log, key
+async def compile_foreground(safe_title: str, markdown: str, template: str, variables: dict) -> Tuple[Optional[bytes], list, str]:
+    """An interactive compile: background builds yield to it, and a success counts as the project's warm build."""
+    signature = source_signature(markdown, template, variables)
+    async with speculative_compiler.foreground(safe_title, signature):
+        return await compile_project(safe_title, markdown, template, variables, signature=signature)
+async def speculative_build(job) -> bool:
+    """
+    Background build of the saved project.json at low CPU priority.
+    Returns False when the main build already matches it.
+    """
+    data = read_project(job.project_id)
+    markdown, template, variables = data.get("markdown") or "", data.get("template") or "base", data.get("variables") or {}
+    job.signature = source_signature(markdown, template, variables)
+    has_pdf = (build_dir_for(job.project_id, "main") / "main.pdf").exists()
+    if not markdown.strip() or (has_pdf and speculative_compiler.is_built(job.project_id, job.signature)):
+        return False
+    pdf_bytes, _, _ = await compile_project(job.project_id, markdown, template, variables, limits=speculative_compiler.limits, signature=job.signature)
+    return bool(pdf_bytes)
+@app.post("/api/compile")
+async def compile_endpoint(request: CompileRequest):
+    print(f"DEBUG: Endpoint received title: '{request.title}'")
+    safe_title = project_id_for(request.title)
+    pdf_bytes, diagnostics, log = await compile_foreground(safe_title, request.markdown, request.template, request.variables)
     if not pdf_bytes:
-        raise HTTPException(status_code=500, detail=f"Compilation failed:\n{log}")
+        raise compile_failure(diagnostics, log, f"/api/projects/{safe_title}/log")
     return Response(content=pdf_bytes, media_type="application/pdf")
+class TargetsRequest(BaseModel):
+    markdown: str
+    templates: List[str]
+    variables: dict = {}
+    target_variables: Dict[str, dict] = {}
+    title: str = "Untitled Project"
+@app.post("/api/compile/targets")
+async def compile_targets(request: TargetsRequest):
+    """
+    Builds the same markdown with several templates (e.g. a book and a
+    slide deck). The markdown is parsed once; each template is rendered
+    from the shared fragment and compiled concurrently in its own build
+    directory (target-<template>). Returns a PDF link or the failure per
+    target, so one failing target does not hide the others.
+    """
+    import asyncio
+    import re
+    from ksaitex.templating.registry import get_registry
+    from ksaitex.storage.retention import TARGET_PREFIX
+    templates = list(dict.fromkeys(request.templates))
+    if not templates:
+        raise HTTPException(status_code=400, detail="No templates given")
+    unknown = [t for t in templates if not re.fullmatch(r"[\w-]+", t) or get_registry().get(f"{t}.tex") is None]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown templates: {', '.join(unknown)}")
+    safe_title = project_id_for(request.title)
+    try:
+        latex_fragment, source_map = parse(request.markdown)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Parsing error: {str(e)}")
+    rendered, failed = {}, {}
+    for template in templates:
+        config = {**request.variables, **request.target_variables.get(template, {})}
+        try:
+            full_latex, offset = render_latex(latex_fragment, config, template_name=f"{template}.tex")
+        except Exception as e:
+            failed[template] = f"Templating error: {str(e)}"
+            continue
+        rendered[template] = (full_latex, {str(md_line): tex_line + offset for md_line, tex_line in source_map.items()})
+    async def build_target(template: str) -> dict:
+        if template in failed:
+            return {"template": template, "status": "failed", "detail": failed[template]}
+        build = f"{TARGET_PREFIX}{template}"
+        full_latex, final_map = rendered[template]
+        try:
+            pdf_bytes, diagnostics, log, key = await compile_in_build_dir(safe_title, build, full_latex, final_map)
+        except Exception as e:
+            print(f"DEBUG: Target '{template}' of '{safe_title}' failed: {e}")
+            return {"template": template, "status": "failed", "detail": f"Compilation error: {str(e)}"}
+        log_url = f"/api/projects/{safe_title}/log?build={build}"
+        if not pdf_bytes:
+            return {"template": template, "status": "failed", "detail": compile_failure(diagnostics, log, log_url).detail}
+        return {"template": template, "status": "success", "pdf_url": f"/api/projects/{safe_title}/pdf?build={build}&v={key[:12]}", "log_url": log_url, "diagnostics": diagnostics}
+    async with speculative_compiler.foreground():
+        results = await asyncio.gather(*(build_target(t) for t in templates))
+    return {"project_id": safe_title, "targets": list(results)}
+def restored_log(build_dir: Path) -> str:
+    log_file = build_dir / "main.log"
+    return log_file.read_text(encoding="utf-8", errors="replace") if log_file.exists() else ""
+def write_diagnostics(build_dir: Path, log: str, source_map: dict, md_offset: int = 0) -> list:
+    """
+    Analyzes this run's main.log (falling back to the captured output when
+    lualatex never wrote one) and stores the result next to the build.
+    """
+    from ksaitex.compilation.diagnostics import analyze_log
+    log_file = build_dir / "main.log"
+    tex_file = build_dir / "main.tex"
+    if log_file.exists() and tex_file.exists() and log_file.stat().st_mtime >= tex_file.stat().st_mtime:
+        log = log_file.read_text(encoding="utf-8", errors="replace")
+    diagnostics = analyze_log(log, source_map, md_offset)
+    atomic_write_json(build_dir / "diagnostics.json", diagnostics, indent=None)
+    return diagnostics
+def compile_failure(diagnostics: list, log: str, log_url: str) -> HTTPException:
+    errors = [d for d in diagnostics if d["severity"] == "error"]
+    if errors:
+        summary = errors[0]["message"]
+    else:
+        lines = [l for l in log.splitlines() if l.strip()]
+        summary = lines[-1] if lines else "unknown error"
+    return HTTPException(status_code=500, detail={
+        "message": f"Compilation failed: {summary}",
+        "diagnostics": diagnostics,
+        "log_url": log_url
+    })
+class FragmentRequest(BaseModel):
+    markdown: str
+    line: Optional[int] = None
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    template: str = "base"
+    variables: dict = {}
+    title: str = "Untitled Project"
+FRAGMENT_CACHE_SIZE = 32
+# PDF and diagnostics per fragment; diagnostics are relative to the fragment's first line.
+fragment_cache: "OrderedDict[Tuple[str, str], Tuple[bytes, list]]" = OrderedDict()
+def forget_fragments(project_id: str):
+    for cache_key in [k for k in fragment_cache if k[0] == project_id]:
+        del fragment_cache[cache_key]
+@app.post("/api/compile/fragment")
+async def compile_fragment(request: FragmentRequest):
+    """
+    Compiles only the block under the cursor (or an explicit line range) as a
+    standalone document using the project's template and variables.
+    Identical fragments are served from an in-memory PDF cache backed by the
+    shared compile cache. Cached diagnostics are kept relative to the
+    fragment and moved to its current position on every response.
+    """
+    from ksaitex.parsing.fragments import extract_fragment, slice_lines
+    from ksaitex.templating.registry import get_registry
+    from ksaitex.compilation.diagnostics import shift_diagnostics
+    safe_title = project_id_for(request.title)
+    template_filename = f"{request.template}.tex"
+    try:
+        if request.start_line is not None and request.end_line is not None:
+            start, end = request.start_line, request.end_line
+            fragment_md = slice_lines(request.markdown, start, end)
+        elif request.line is not None:
+            magic_commands = get_registry().get_metadata(template_filename)["magic_commands"]
+            start, end, fragment_md = extract_fragment(request.markdown, request.line, magic_commands)
+        else:
+            raise ValueError("Either 'line' or 'start_line' and 'end_line' must be given.")
+        latex_fragment, source_map = parse(fragment_md)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Parsing error: {str(e)}")
+    try:
+        full_latex, offset = render_latex(latex_fragment, request.variables.copy(), template_name=template_filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Templating error: {str(e)}")
+    headers = {"X-Fragment-Start": str(start), "X-Fragment-End": str(end)}
+    key = compile_cache.key(full_latex, DATA_DIR / safe_title)
+    if (safe_title, key) in fragment_cache:
+        fragment_cache.move_to_end((safe_title, key))
+        pdf_bytes, relative = fragment_cache[(safe_title, key)]
+        # Atomic write without the fragment lock: a hit must not wait for another fragment's compile.
+        atomic_write_json(prepare_build_dir(safe_title, "fragment") / "diagnostics.json", shift_diagnostics(relative, start - 1), indent=None)
+        return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+    log = ""
+    async with speculative_compiler.foreground(), build_lock(safe_title, "fragment"):
+        fragment_dir = prepare_build_dir(safe_title, "fragment")
+        fragment_map = {str(md_line): tex_line + offset for md_line, tex_line in source_map.items()}
+        pdf_bytes = compile_cache.restore(key, fragment_dir)
+        if pdf_bytes:
+            log = restored_log(fragment_dir)
+            relative = write_diagnostics(fragment_dir, log, fragment_map)
+        else:
+            pdf_bytes, log = await compile_with_farm(full_latex, working_dir=fragment_dir)
+            relative = write_diagnostics(fragment_dir, log, fragment_map)
+            if pdf_bytes:
+                compile_cache.store(key, fragment_dir)
+        diagnostics = shift_diagnostics(relative, start - 1)
+        atomic_write_json(fragment_dir / "diagnostics.json", diagnostics, indent=None)
+    if not pdf_bytes:
+        raise compile_failure(diagnostics, log, f"/api/projects/{safe_title}/log?build=fragment")
+    fragment_cache[(safe_title, key)] = (pdf_bytes, relative)
+    while len(fragment_cache) > FRAGMENT_CACHE_SIZE:
+        fragment_cache.popitem(last=False)
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+class OutlineRequest(BaseModel):
+    markdown: str
+    template: str = "base"
+    version: Optional[str] = None
+outline_builder = None
+@app.post("/api/outline")
+async def document_outline(request: OutlineRequest):
+    """
+    Headings and toc_level magic commands with markdown line numbers.
+    When the client sends the version it already has, only the splice
+    from that version to the current outline is returned.
+    """
+    global outline_builder
+    from ksaitex.parsing.outline import OutlineBuilder, diff_outline
+    from ksaitex.templating.registry import get_registry
+    if outline_builder is None:
+        outline_builder = OutlineBuilder()
+    template_filename = f"{request.template}.tex"
+    registry = get_registry()
+    magic_commands = registry.get_metadata(template_filename)["magic_commands"]
+    outline = outline_builder.build(request.markdown, f"{template_filename}:{registry.etag}", magic_commands)
+    previous = outline_builder.previous(request.version)
+    version = outline_builder.remember(outline)
+    if previous is not None:
+        return {"version": version, "base_version": request.version, "diff": diff_outline(previous, outline)}
+    return {"version": version, "outline": outline}
 @app.post("/api/sync")
 async def sync_position(request: SyncRequest):
     """
@@ -91,12 +487,13 @@ async def sync_position(request: SyncRequest):
     import json
     import subprocess
     import shutil
-    project_dir = DATA_DIR / request.project_id
-    if not project_dir.exists():
+    if not (DATA_DIR / request.project_id).exists():
         raise HTTPException(status_code=404, detail="Project not found")
-    map_file = project_dir / "source_map.json"
+    build_dir = build_dir_for(request.project_id, "main")
+    map_file = build_dir / "source_map.json"
     if not map_file.exists():
         return {"status": "no_map"}
+    touch_build(build_dir)
     try:
         with open(map_file, "r") as f:
             mapping = json.load(f)
@@ -122,7 +519,7 @@ async def sync_position(request: SyncRequest):
         return {"status": "error", "detail": "synctex tool not found"}
     try:
         cmd = ["synctex", "view", "-i", f"{target_tex_line}:1:main.tex", "-o", "main.pdf"]
-        result = subprocess.run(cmd, cwd=str(project_dir), capture_output=True, text=True)
+        result = subprocess.run(cmd, cwd=str(build_dir), capture_output=True, text=True)
         output = result.stdout
         page = None
         for line in output.splitlines():
@@ -147,12 +544,13 @@ async def reverse_sync_position(request: ReverseSyncRequest):
     import json
     import subprocess
     import shutil
-    project_dir = DATA_DIR / request.project_id
-    if not project_dir.exists():
+    if not (DATA_DIR / request.project_id).exists():
         raise HTTPException(status_code=404, detail="Project not found")
-    map_file = project_dir / "source_map.json"
+    build_dir = build_dir_for(request.project_id, "main")
+    map_file = build_dir / "source_map.json"
     if not map_file.exists():
         return {"status": "no_map"}
+    touch_build(build_dir)
     try:
         with open(map_file, "r") as f:
             mapping = json.load(f)
@@ -162,7 +560,7 @@ async def reverse_sync_position(request: ReverseSyncRequest):
         return {"status": "error", "detail": "synctex tool not found"}
     try:
         cmd = ["synctex", "edit", "-o", f"{request.page}:100:100:main.pdf"]
-        result = subprocess.run(cmd, cwd=str(project_dir), capture_output=True, text=True)
+        result = subprocess.run(cmd, cwd=str(build_dir), capture_output=True, text=True)
         output = result.stdout
         tex_line = None
         for line in output.splitlines():
@@ -199,68 +597,100 @@ async def reverse_sync_position(request: ReverseSyncRequest):
             return {"status": "no_map_match", "tex_line": tex_line}
     except Exception as e:
         return {"status": "error", "detail": str(e)}
+async def save_project_data(safe_title: str, data: dict) -> Path:
+    project_dir = DATA_DIR / safe_title
+    project_file = project_dir / "project.json"
+    async with project_lock(safe_title):
+        project_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(project_file, data)
+        await update_search_index(safe_title, data.get("markdown") or "")
+    return project_file
+async def update_search_index(project_id: str, markdown: str):
+    """Keeps the search index in step with a save; the save itself never fails because of it."""
+    import asyncio
+    from ksaitex.storage.search import search_index
+    try:
+        await asyncio.to_thread(search_index.index_project, project_id, markdown)
+    except Exception as e:
+        print(f"DEBUG: Search index update failed for '{project_id}': {e}")
 @app.post("/api/save")
 async def save_project(request: SaveRequest):
     """Save project data to data/{title}/project.json"""
-    import json
-    import re
-    safe_title = re.sub(r'[^\w\s-]', '', request.title).strip().replace(' ', '_')
-    if not safe_title:
-        safe_title = "unnamed_project"
-    project_dir = DATA_DIR / safe_title
-    project_dir.mkdir(parents=True, exist_ok=True)
-    project_file = project_dir / "project.json"
-    with open(project_file, "w") as f:
-        json.dump({
-            "title": request.title,
-            "markdown": request.markdown,
-            "html": request.html,
-            "template": request.template,
-            "variables": request.variables
-        }, f, indent=4)
+    project_file = await save_project_data(project_id_for(request.title), {
+        "title": request.title,
+        "markdown": request.markdown,
+        "html": request.html,
+        "template": request.template,
+        "variables": request.variables
+    })
     print(f"DEBUG: Saved project '{request.title}' to {project_file}")
+    speculative_compiler.schedule(project_id_for(request.title), speculative_compiler.idle_delay)
     return {"status": "success", "path": str(project_file)}
 @app.post("/api/rename")
 async def rename_project(request: RenameRequest):
-    """Rename a project by moving its directory."""
+    """Rename a project by moving its directory (and its build outputs)."""
+    import os
     import re
     import shutil
     import json
-    old_path = DATA_DIR / request.old_id
-    if not old_path.exists():
-        raise HTTPException(status_code=404, detail="Project not found")
     safe_new_title = re.sub(r'[^\w\s-]', '', request.new_title).strip().replace(' ', '_')
     if not safe_new_title:
         raise HTTPException(status_code=400, detail="Invalid title")
+    old_path = DATA_DIR / request.old_id
     new_path = DATA_DIR / safe_new_title
-    if new_path.exists() and new_path != old_path:
-         raise HTTPException(status_code=400, detail="Project with this name already exists")
-    if new_path != old_path:
-        shutil.move(str(old_path), str(new_path))
-    project_file = new_path / "project.json"
-    if project_file.exists():
-        with open(project_file, "r") as f:
-            data = json.load(f)
-        data["title"] = request.new_title
-        with open(project_file, "w") as f:
-            json.dump(data, f, indent=4)
+    async with projects_lock(request.old_id, safe_new_title), builds_lock(request.old_id, safe_new_title):
+        if not old_path.exists():
+            raise HTTPException(status_code=404, detail="Project not found")
+        if new_path.exists() and new_path != old_path:
+             raise HTTPException(status_code=400, detail="Project with this name already exists")
+        if new_path != old_path:
+            from ksaitex.storage.search import search_index
+            os.rename(old_path, new_path)
+            search_index.rename_project(request.old_id, safe_new_title)
+            speculative_compiler.forget(request.old_id)
+            old_builds = build_dir_for(request.old_id, "main").parent
+            if old_builds.exists():
+                new_builds = build_dir_for(safe_new_title, "main").parent
+                shutil.rmtree(new_builds, ignore_errors=True)
+                os.rename(old_builds, new_builds)
+        project_file = new_path / "project.json"
+        if project_file.exists():
+            with open(project_file, "r") as f:
+                data = json.load(f)
+            data["title"] = request.new_title
+            atomic_write_json(project_file, data)
     return {"status": "success", "new_id": safe_new_title}
 @app.delete("/api/projects/{project_id}")
 async def delete_project(project_id: str):
     """Delete a project directory."""
     import shutil
     project_dir = DATA_DIR / project_id
-    if not project_dir.exists():
-        raise HTTPException(status_code=404, detail="Project not found")
-    shutil.rmtree(project_dir)
+    async with project_lock(project_id), build_lock(project_id):
+        if not project_dir.exists():
+            raise HTTPException(status_code=404, detail="Project not found")
+        shutil.rmtree(project_dir)
+        shutil.rmtree(build_dir_for(project_id, "main").parent, ignore_errors=True)
+        forget_fragments(project_id)
+        from ksaitex.storage.search import search_index
+        search_index.remove_project(project_id)
+        speculative_compiler.forget(project_id)
     return {"status": "success"}
+@app.get("/api/search")
+async def search_projects(q: str, limit: int = 50):
+    """Full-text search over every project's markdown. Returns project id, markdown line and snippet per hit."""
+    import asyncio
+    from ksaitex.storage.search import search_index
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty query")
+    return await asyncio.to_thread(search_index.search, q, max(1, min(limit, 500)))
 @app.get("/api/projects")
 async def list_projects():
     """List all saved projects."""
     projects = []
     if DATA_DIR.exists():
         for d in DATA_DIR.iterdir():
-            if d.is_dir():
+            # Dot-directories are builds, the index and imports in progress.
+            if d.is_dir() and not d.name.startswith("."):
                 project_file = d / "project.json"
                 if project_file.exists():
                     import json
@@ -271,34 +701,295 @@ async def list_projects():
                     except:
                         pass
     return {"projects": projects}
-@app.get("/api/projects/{project_id}")
-async def get_project(project_id: str):
-    """Get content of a specific project."""
+PROJECT_FIELDS = ("title", "markdown", "html", "template", "variables")
+def read_project(project_id: str) -> dict:
     import json
     project_file = DATA_DIR / project_id / "project.json"
     if not project_file.exists():
         raise HTTPException(status_code=404, detail="Project not found")
     with open(project_file, "r") as f:
         return json.load(f)
+@app.get("/api/projects/{project_id}")
+async def get_project(project_id: str, fields: Optional[str] = None):
+    """
+    Get content of a specific project, optionally only the comma separated
+    fields. Opening a project queues a background build of its saved state.
+    """
+    data = read_project(project_id)
+    lease_project(project_id)
+    speculative_compiler.schedule(project_id)
+    if not fields:
+        return data
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in PROJECT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return {f: data.get(f) for f in requested}
+class ProjectPatch(BaseModel):
+    markdown: Optional[str] = None
+    html: Optional[str] = None
+    template: Optional[str] = None
+    variables: Optional[dict] = None
+@app.patch("/api/projects/{project_id}")
+async def patch_project(project_id: str, request: ProjectPatch):
+    """Update only the given fields of project.json instead of re-uploading the whole project."""
+    changes = request.model_dump(exclude_none=True)
+    async with project_lock(project_id):
+        data = read_project(project_id)
+        data.update(changes)
+        atomic_write_json(DATA_DIR / project_id / "project.json", data)
+        if "markdown" in changes:
+            await update_search_index(project_id, data["markdown"])
+    speculative_compiler.schedule(project_id, speculative_compiler.idle_delay)
+    return {"status": "success", "updated": sorted(changes)}
+@app.get("/api/projects/{project_id}/log")
+async def get_build_log(project_id: str, build: str = "main"):
+    """Full lualatex log of the last build, fetched on demand."""
+    log_file = build_dir_for(project_id, build) / "main.log"
+    if not log_file.exists():
+        raise HTTPException(status_code=404, detail="No build log")
+    return FileResponse(log_file, media_type="text/plain; charset=utf-8")
+@app.get("/api/projects/{project_id}/diagnostics")
+async def get_diagnostics(project_id: str, build: str = "main"):
+    """Structured diagnostics (errors, overfull boxes, missing glyphs) of the last build."""
+    import json
+    diagnostics_file = build_dir_for(project_id, build) / "diagnostics.json"
+    if not diagnostics_file.exists():
+        return {"diagnostics": []}
+    with open(diagnostics_file, "r") as f:
+        return {"diagnostics": json.load(f)}
+@app.get("/api/projects/{project_id}/pdf")
+async def get_build_pdf(project_id: str, build: str = "main"):
+    """PDF of the last build (used by WebSocket sessions, which do not stream the PDF)."""
+    pdf_file = build_dir_for(project_id, build) / "main.pdf"
+    if not pdf_file.exists():
+        raise HTTPException(status_code=404, detail="No PDF built yet")
+    return FileResponse(pdf_file, media_type="application/pdf")
+@app.get("/api/projects/{project_id}/export")
+async def export_project(project_id: str, build: bool = False):
+    """Streams the project as a tar bundle (project.json, images, optionally the last PDF and synctex)."""
+    from fastapi.responses import StreamingResponse
+    from ksaitex.storage.bundles import iter_bundle
+    project_dir = DATA_DIR / project_id
+    if not (project_dir / "project.json").exists():
+        raise HTTPException(status_code=404, detail="Project not found")
+    headers = {"Content-Disposition": f'attachment; filename="{project_id}.ksaitex.tar"'}
+    build_dir = build_dir_for(project_id, "main") if build else None
+    return StreamingResponse(iter_bundle(project_id, project_dir, build_dir=build_dir), media_type="application/x-tar", headers=headers)
+@app.get("/api/projects/{project_id}/speculative")
+async def get_speculative_status(project_id: str):
+    """
+    State of the background build; ready means the main PDF matches the
+    saved project. ready is read from the build directory, so any server
+    process can answer it; state (queued/running) is this process's view.
+    """
+    data = read_project(project_id)
+    signature = source_signature(data.get("markdown") or "", data.get("template") or "base", data.get("variables") or {})
+    ready = speculative_compiler.is_built(project_id, signature) and (build_dir_for(project_id, "main") / "main.pdf").exists()
+    return {"state": speculative_compiler.state(project_id), "ready": ready, "pdf_url": f"/api/projects/{project_id}/pdf?v={signature[:12]}" if ready else None}
+FIELD_MEDIA_TYPES = {"markdown": "text/markdown; charset=utf-8", "html": "text/html; charset=utf-8"}
+@app.get("/api/projects/{project_id}/{field}")
+async def get_project_field(project_id: str, field: str):
+    """Single project field as its own resource (markdown, html or variables)."""
+    if field not in ("markdown", "html", "variables"):
+        raise HTTPException(status_code=404, detail="Not found")
+    value = read_project(project_id).get(field)
+    if field == "variables":
+        return value or {}
+    return Response(content=value or "", media_type=FIELD_MEDIA_TYPES[field])
+# Projects are saved when the user asks; set this (seconds idle) to let edit sessions save on their own.
+AUTOSAVE_DELAY = float(os.environ.get("KSAITEX_AUTOSAVE_DELAY", "0"))
+async def save_session(session) -> int:
+    """
+    Writes the fields the session changed into project.json under the
+    project lock, so saves from other clients or workers are merged rather
+    than overwritten. Raises SaveConflict if both changed the same field.
+    """
+    version = session.version
+    async with project_lock(session.project_id):
+        current = read_project(session.project_id)
+        changes = session.changes(current)
+        data = {**current, **changes}
+        atomic_write_json(DATA_DIR / session.project_id / "project.json", data)
+        await update_search_index(session.project_id, data.get("markdown") or "")
+        session.mark_saved(version, changes)
+    lease_project(session.project_id)
+    return version
+def schedule_autosave(session):
+    import asyncio
+    from ksaitex.api.sessions import SaveConflict
+    if AUTOSAVE_DELAY <= 0:
+        return
+    async def autosave_later():
+        await asyncio.sleep(AUTOSAVE_DELAY)
+        if session.dirty:
+            try:
+                await save_session(session)
+            except (SaveConflict, HTTPException) as e:
+                print(f"Warning: autosave of '{session.project_id}' skipped: {getattr(e, 'detail', e)}")
+                return
+            # The editor has been idle for a while: warm the build of what was just saved.
+            speculative_compiler.schedule(session.project_id, speculative_compiler.idle_delay)
+    if session.autosave_task:
+        session.autosave_task.cancel()
+    session.autosave_task = asyncio.create_task(autosave_later())
+@app.websocket("/ws/projects/{project_id}")
+async def project_session(websocket: WebSocket, project_id: str):
+    """
+    Edit session for an open project. The client sends splices
+    ({"type": "edit", "base_version", "field", "ops": [{offset, delete, insert}]})
+    against the server-held document; save, compile and outline requests
+    then work from that state instead of re-uploading the whole project.
+    """
+    import asyncio
+    from ksaitex.api.sessions import session_manager, EditConflict, SaveConflict
+    async def compile_session(version: int, snapshot: dict):
+        # Runs beside the receive loop, so edits keep flowing while LaTeX works.
+        try:
+            pdf_bytes, diagnostics, log = await compile_foreground(project_id, snapshot["markdown"], snapshot["template"], snapshot["variables"])
+            if pdf_bytes:
+                await websocket.send_json({"type": "compiled", "version": version, "pdf_url": f"/api/projects/{project_id}/pdf?v={version}", "diagnostics": diagnostics})
+            else:
+                failure = compile_failure(diagnostics, log, f"/api/projects/{project_id}/log")
+                await websocket.send_json({"type": "compile_failed", "version": version, "detail": failure.detail})
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "detail": e.detail})
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+    try:
+        data = read_project(project_id)
+    except HTTPException:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    lease_project(project_id)
+    session = session_manager.open(project_id, data)
+    compiles = set()
+    await websocket.send_json({"type": "ready", "version": session.version, "dirty": session.dirty})
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                # Not JSON, or a binary frame.
+                await websocket.send_json({"type": "error", "detail": "Malformed message"})
+                continue
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "detail": "Malformed message"})
+                continue
+            kind = message.get("type")
+            try:
+                if kind == "edit":
+                    async with session.lock:
+                        version = session.apply(message.get("base_version"), message.get("field", "markdown"), message.get("ops", []))
+                    speculative_compiler.cancel(project_id)
+                    schedule_autosave(session)
+                    await websocket.send_json({"type": "ack", "version": version})
+                elif kind == "settings":
+                    async with session.lock:
+                        version = session.set_settings(message.get("template"), message.get("variables"))
+                    schedule_autosave(session)
+                    await websocket.send_json({"type": "ack", "version": version})
+                elif kind == "resync":
+                    await websocket.send_json({"type": "state", "version": session.version, **session.snapshot()})
+                elif kind == "save":
+                    version = await save_session(session)
+                    await websocket.send_json({"type": "saved", "version": version})
+                elif kind == "compile":
+                    task = asyncio.create_task(compile_session(session.version, session.snapshot()))
+                    compiles.add(task)
+                    task.add_done_callback(compiles.discard)
+                elif kind == "outline":
+                    # The editor's template picker may be ahead of the session's saved settings.
+                    template = message.get("template") or session.template
+                    result = await document_outline(OutlineRequest(markdown=session.markdown, template=template, version=message.get("version")))
+                    await websocket.send_json({"type": "outline", **result})
+                else:
+                    await websocket.send_json({"type": "error", "detail": f"Unknown message type '{kind}'"})
+            except EditConflict as e:
+                await websocket.send_json({"type": "conflict", "version": session.version, "detail": str(e)})
+            except SaveConflict as e:
+                await websocket.send_json({"type": "save_conflict", "version": session.version, "detail": str(e)})
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": e.detail})
+            except (ValueError, KeyError, TypeError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in compiles:
+            task.cancel()
+        # Without autosave, unsaved edits stay in memory (dirty sessions stay open) for the next client.
+        if session.clients == 1 and session.dirty and AUTOSAVE_DELAY > 0:
+            if session.autosave_task:
+                session.autosave_task.cancel()
+            try:
+                await save_session(session)
+            except (SaveConflict, HTTPException) as e:
+                # Kept in memory (dirty sessions stay open) for the next client to resolve.
+                print(f"Warning: could not save session of '{project_id}': {getattr(e, 'detail', e)}")
+        session_manager.close(session)
+@app.post("/api/projects/import")
+async def import_project(request: Request, project_id: Optional[str] = None, overwrite: bool = False):
+    """
+    Imports a bundle sent as the raw request body, read chunk by chunk.
+    The project keeps its exported id unless project_id is given.
+    """
+    import json
+    from ksaitex.storage.bundles import BundleImporter, BundleError
+    importer = BundleImporter(request.stream())
+    try:
+        manifest = await importer.read_manifest()
+        target = project_id_for(project_id or manifest.get("project_id") or "")
+        # The upload is received before any lock is taken; only the swap holds them.
+        await importer.stage(DATA_DIR, target, overwrite=overwrite)
+        async with project_lock(target), build_lock(target):
+            result = importer.install(DATA_DIR, target, overwrite=overwrite, build_dir=build_dir_for(target, "main"))
+            forget_fragments(target)
+            speculative_compiler.forget(target)
+            with open(DATA_DIR / target / "project.json", "r") as f:
+                await update_search_index(target, json.load(f).get("markdown") or "")
+    except BundleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    finally:
+        importer.discard()
+    print(f"DEBUG: Imported project '{target}' ({result['files']} files, {result['deduplicated']} deduplicated)")
+    return {"status": "success", **result}
 @app.post("/api/upload_image")
 async def upload_image(project_id: str = Form(...), file: UploadFile = File(...)):
+    import os
     import shutil
+    import tempfile
     project_dir = DATA_DIR / project_id
-    if not project_dir.exists():
-        raise HTTPException(status_code=404, detail="Project not found")
-    
-    images_dir = project_dir / "images"
-    images_dir.mkdir(exist_ok=True)
-    
-    file_path = images_dir / file.filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    async with project_lock(project_id):
+        if not project_dir.exists():
+            raise HTTPException(status_code=404, detail="Project not found")
+        
+        images_dir = project_dir / "images"
+        images_dir.mkdir(exist_ok=True)
+        
+        file_path = images_dir / file.filename
+        fd, tmp_name = tempfile.mkstemp(dir=str(images_dir), prefix=".upload-")
+        with os.fdopen(fd, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        os.replace(tmp_name, file_path)
         
     return {"path": f"images/{file.filename}"}
 
+@app.get("/project_files/{project_id}/images/{filename:path}")
+async def project_image(project_id: str, filename: str):
+    """Uploaded images only; the rest of DATA_DIR (builds, locks, caches, the search index) is not served."""
+    import re
+    images_dir = (DATA_DIR / project_id / "images").resolve()
+    image = (images_dir / filename).resolve()
+    hidden = any(part.startswith(".") for part in Path(filename).parts)
+    if not re.fullmatch(r"[\w-]+", project_id) or hidden or not image.is_relative_to(images_dir) or not image.is_file():
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(image)
 UI_DIR = Path("ui")
 if UI_DIR.exists():
-    app.mount("/project_files", StaticFiles(directory=DATA_DIR), name="project_files")
     app.mount("/", StaticFiles(directory=UI_DIR, html=True), name="ui")
 else:
     print("Warning: 'ui' directory not found. Frontend will not be served.")
\ No newline at end of file
@@ -0,0 +1,121 @@
+import asyncio
+from typing import Dict, Any, List, Optional
+EDITABLE_FIELDS = ("markdown", "html")
+SAVED_FIELDS = EDITABLE_FIELDS + ("template", "variables")
+class EditConflict(Exception):
+    """The client edited an older version than the one the server holds."""
+class SaveConflict(Exception):
+    """Another writer changed a field on disk that this session also changed."""
+def apply_op(text: str, offset: int, delete: int, insert: str, astral: bool) -> str:
+    """
+    Applies one splice. Offsets and lengths are UTF-16 code units, as the
+    browser counts them; they only differ from Python indices when the
+    text contains characters outside the BMP.
+    """
+    if not astral:
+        if offset < 0 or delete < 0 or offset + delete > len(text):
+            raise ValueError(f"Edit out of range: offset={offset} delete={delete} length={len(text)}")
+        return text[:offset] + insert + text[offset + delete:]
+    data = text.encode("utf-16-le")
+    start, end = offset * 2, (offset + delete) * 2
+    if offset < 0 or delete < 0 or end > len(data):
+        raise ValueError(f"Edit out of range: offset={offset} delete={delete} length={len(data) // 2}")
+    return (data[:start] + insert.encode("utf-16-le") + data[end:]).decode("utf-16-le")
+def has_astral(text: str) -> bool:
+    return any(ord(c) > 0xFFFF for c in text)
+class DocumentSession:
+    """
+    Server-held copy of an open project. Clients send splices against a
+    version number; every accepted edit bumps the version. Saving and
+    compiling work from this state, so requests carry only the edit.
+    """
+    def __init__(self, project_id: str, data: Dict[str, Any]):
+        self.project_id = project_id
+        self.title = data.get("title", project_id)
+        self.fields = {f: data.get(f) or "" for f in EDITABLE_FIELDS}
+        self.template = data.get("template", "base")
+        self.variables = data.get("variables", {}) or {}
+        self.version = 0
+        self.saved_version = 0
+        self.astral = {f: has_astral(v) for f, v in self.fields.items()}
+        # What project.json held when this session last read or wrote it.
+        self.base = {f: data.get(f) for f in SAVED_FIELDS}
+        self.clients = 0
+        self.lock = asyncio.Lock()
+        self.autosave_task: Optional[asyncio.Task] = None
+    @property
+    def markdown(self) -> str:
+        return self.fields["markdown"]
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.saved_version
+    def apply(self, base_version: int, field: str, ops: List[Dict[str, Any]]) -> int:
+        if base_version != self.version:
+            raise EditConflict(f"Edit based on version {base_version}, server is at {self.version}")
+        if field not in EDITABLE_FIELDS:
+            raise ValueError(f"Field '{field}' is not editable")
+        text = self.fields[field]
+        for op in ops:
+            insert = op.get("insert", "")
+            if insert and not self.astral[field] and has_astral(insert):
+                self.astral[field] = True
+            text = apply_op(text, int(op["offset"]), int(op.get("delete", 0)), insert, self.astral[field])
+        self.fields[field] = text
+        self.version += 1
+        return self.version
+    def set_settings(self, template: Optional[str] = None, variables: Optional[dict] = None) -> int:
+        """Bumps the version only if something changed, so resending the same settings keeps a saved session clean."""
+        changed = False
+        if template is not None and template != self.template:
+            self.template = template
+            changed = True
+        if variables is not None and variables != self.variables:
+            self.variables = variables
+            changed = True
+        if changed:
+            self.version += 1
+        return self.version
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "markdown": self.fields["markdown"],
+            "html": self.fields["html"],
+            "template": self.template,
+            "variables": self.variables
+        }
+    def changes(self, current: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The fields this session changed since it last read or wrote them,
+        to be merged into the project.json currently on disk. Raises
+        SaveConflict when another writer (an HTTP save, a PATCH, another
+        worker) changed one of them too.
+        """
+        snapshot = self.snapshot()
+        changed = {f: snapshot[f] for f in SAVED_FIELDS if snapshot[f] != self.base.get(f)}
+        clashes = [f for f, v in changed.items() if current.get(f) != self.base.get(f) and current.get(f) != v]
+        if clashes:
+            raise SaveConflict(f"Project changed elsewhere since it was opened: {', '.join(clashes)}")
+        return changed
+    def mark_saved(self, version: int, written: Dict[str, Any]):
+        # Fields changed elsewhere but not here keep their old base, so editing
+        # them later is still reported as a conflict.
+        self.saved_version = version
+        self.base.update(written)
+class SessionManager:
+    """One DocumentSession per open project, shared by every socket of this worker."""
+    def __init__(self):
+        self.sessions: Dict[str, DocumentSession] = {}
+    def open(self, project_id: str, data: Dict[str, Any]) -> DocumentSession:
+        session = self.sessions.get(project_id)
+        if session is None:
+            session = DocumentSession(project_id, data)
+            self.sessions[project_id] = session
+        session.clients += 1
+        return session
+    def close(self, session: DocumentSession):
+        session.clients -= 1
+        if session.clients <= 0 and not session.dirty:
+            self.sessions.pop(session.project_id, None)
+    def is_open(self, project_id: str) -> bool:
+        return project_id in self.sessions
+session_manager = SessionManager()
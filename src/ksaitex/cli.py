@@ -1,10 +1,8 @@
 import typer
-import asyncio
 from pathlib import Path
 from typing import Optional
-from ksaitex.parsing.markdown import parse
-from ksaitex.templating.engine import render_latex
-from ksaitex.compilation.compiler import compile_latex
+# The pipeline (markdown-it, Jinja, the compiler) is imported inside the
+# commands that need it so `ksaitex --help` and scripting stay fast.
 app = typer.Typer(help="Ksaitex Markdown to PDF Converter")
 @app.command()
 def convert(
@@ -16,19 +14,23 @@ def convert(
     """
     Convert a Markdown file to PDF.
     """
+    import asyncio
+    from ksaitex.parsing.markdown import parse
+    from ksaitex.templating.engine import render_latex
+    from ksaitex.compilation.compiler import compile_latex
     if not input_file.exists():
         typer.echo(f"Error: File {input_file} not found.", err=True)
         raise typer.Exit(code=1)
     with open(input_file, "r", encoding="utf-8") as f:
         md_content = f.read()
     typer.echo("Parsing Markdown...")
-    latex_fragment = parse(md_content)
+    latex_fragment, _ = parse(md_content)
     typer.echo("Generating LaTeX...")
     config = {
         "script": template,
         "font_file": font,
     }
-    full_latex = render_latex(latex_fragment, config)
+    full_latex, _ = render_latex(latex_fragment, config)
     typer.echo("Compiling to PDF (this may take a moment)...")
     async def run_compile():
         pdf_bytes, log = await compile_latex(full_latex, output_file)
@@ -45,13 +47,176 @@ def convert(
 def serve(
     host: str = typer.Option("0.0.0.0", help="Host to bind to"),
     port: int = typer.Option(8000, help="Port to bind to"),
-    reload: bool = typer.Option(True, help="Enable auto-reload")
+    reload: bool = typer.Option(True, help="Enable auto-reload"),
+    workers: int = typer.Option(1, help="Number of worker processes"),
+    data_dir: Optional[Path] = typer.Option(None, "--data-dir", envvar="KSAITEX_DATA_DIR", help="Project data root (shared by all workers)")
 ):
     """
     Start the web server and UI.
     """
+    import os
     import uvicorn
-    typer.echo(f"Starting server at http://{host}:{port}")
-    uvicorn.run("ksaitex.api.main:app", host=host, port=port, reload=reload)
+    if data_dir:
+        # Exported before uvicorn starts so every worker process resolves the same root.
+        os.environ["KSAITEX_DATA_DIR"] = str(data_dir.expanduser().resolve())
+    if workers > 1 and reload:
+        typer.echo("Auto-reload is not available with multiple workers; disabling it.")
+        reload = False
+    if workers > 1:
+        # Read by the farm, whose worker registry cannot be shared between processes.
+        os.environ["WEB_CONCURRENCY"] = str(workers)
+        typer.echo("The compile farm is disabled with multiple workers; builds run locally.")
+    typer.echo(f"Starting server at http://{host}:{port} with {workers} worker(s)")
+    uvicorn.run("ksaitex.api.main:app", host=host, port=port, reload=reload, workers=workers)
+@app.command()
+def worker(
+    server: str = typer.Option("http://127.0.0.1:8000", help="API server to take compile jobs from"),
+    slots: int = typer.Option(1, help="Number of concurrent compiles"),
+    name: Optional[str] = typer.Option(None, help="Worker name shown in /api/metrics (default: hostname-pid)"),
+    cache_dir: Optional[Path] = typer.Option(None, help="Where fetched assets and fonts are cached"),
+    token: Optional[str] = typer.Option(None, envvar="KSAITEX_FARM_TOKEN", help="Shared secret expected by the server")
+):
+    """
+    Run a compile farm worker that registers with the server and compiles jobs it hands out.
+    """
+    import os
+    import socket
+    from ksaitex.compilation.worker import FarmWorker
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    typer.echo(f"Worker '{name}' serving {server} with {slots} slot(s)")
+    FarmWorker(server, name, slots=slots, cache_dir=cache_dir, token=token).run()
+@app.command()
+def reindex(
+    data_dir: Optional[Path] = typer.Option(None, "--data-dir", envvar="KSAITEX_DATA_DIR", help="Project data root"),
+    full: bool = typer.Option(False, "--full", help="Drop the index and rebuild it from scratch")
+):
+    """
+    Rebuild the full-text search index from the projects in the data directory.
+    """
+    import os
+    import time
+    if data_dir:
+        os.environ["KSAITEX_DATA_DIR"] = str(data_dir.expanduser().resolve())
+    from ksaitex.config import DATA_DIR
+    from ksaitex.storage.search import search_index
+    if full:
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{search_index.path}{suffix}").unlink(missing_ok=True)
+    started = time.perf_counter()
+    stats = search_index.rebuild(DATA_DIR)
+    typer.echo(f"Indexed {stats['indexed']}, unchanged {stats['unchanged']}, removed {stats['removed']}, failed {stats['failed']} in {time.perf_counter() - started:.2f}s")
+@app.command("export")
+def export_project(
+    project_id: str = typer.Argument(..., help="Project id (its directory name under the data directory)"),
+    output_file: Optional[Path] = typer.Option(None, "--output", "-o", help="Bundle path (default: <id>.ksaitex.tar)"),
+    build: bool = typer.Option(False, "--build", help="Include the last PDF, synctex and source map"),
+    data_dir: Optional[Path] = typer.Option(None, "--data-dir", envvar="KSAITEX_DATA_DIR", help="Project data root")
+):
+    """
+    Write a project bundle that `ksaitex import` or the server can load.
+    """
+    import os
+    if data_dir:
+        os.environ["KSAITEX_DATA_DIR"] = str(data_dir.expanduser().resolve())
+    from ksaitex.config import DATA_DIR
+    from ksaitex.storage.bundles import iter_bundle
+    from ksaitex.storage.retention import build_dir
+    output_file = output_file or Path(f"{project_id}.ksaitex.tar")
+    try:
+        chunks = iter_bundle(project_id, DATA_DIR / project_id, build_dir=build_dir(project_id) if build else None)
+        with open(output_file, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except FileNotFoundError:
+        typer.echo(f"Error: Project {project_id} not found in {DATA_DIR}.", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"Exported {project_id} to {output_file}")
+@app.command("import")
+def import_project(
+    bundle_file: Path = typer.Argument(..., help="Bundle written by `ksaitex export` or the export endpoint"),
+    project_id: Optional[str] = typer.Option(None, "--as", help="Import under this id instead of the exported one"),
+    overwrite: bool = typer.Option(False, help="Replace an existing project with the same id"),
+    data_dir: Optional[Path] = typer.Option(None, "--data-dir", envvar="KSAITEX_DATA_DIR", help="Project data root")
+):
+    """
+    Load a project bundle into the data directory.
+    """
+    import os
+    import json
+    import asyncio
+    if data_dir:
+        os.environ["KSAITEX_DATA_DIR"] = str(data_dir.expanduser().resolve())
+    from ksaitex.config import DATA_DIR
+    from ksaitex.storage.bundles import BundleImporter, BundleError, file_chunks, PROJECT_ID_PATTERN
+    from ksaitex.storage.locks import project_lock, build_lock
+    from ksaitex.storage.search import search_index
+    from ksaitex.storage.retention import build_dir
+    async def run_import():
+        importer = BundleImporter(file_chunks(bundle_file))
+        manifest = await importer.read_manifest()
+        target = project_id or manifest.get("project_id", "")
+        if not PROJECT_ID_PATTERN.fullmatch(target):
+            raise BundleError(f"Invalid project id: {target}")
+        await importer.stage(DATA_DIR, target, overwrite=overwrite)
+        try:
+            async with project_lock(target), build_lock(target):
+                return importer.install(DATA_DIR, target, overwrite=overwrite, build_dir=build_dir(target))
+        finally:
+            importer.discard()
+    if not bundle_file.exists():
+        typer.echo(f"Error: File {bundle_file} not found.", err=True)
+        raise typer.Exit(code=1)
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        result = asyncio.run(run_import())
+    except (BundleError, FileExistsError) as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(code=1)
+    with open(DATA_DIR / result["project_id"] / "project.json", "r") as f:
+        search_index.index_project(result["project_id"], json.load(f).get("markdown") or "")
+    typer.echo(f"Imported {result['project_id']}: {result['files']} files, {result['bytes']} bytes, {result['deduplicated']} deduplicated")
+@app.command()
+def gc(
+    data_dir: Optional[Path] = typer.Option(None, "--data-dir", envvar="KSAITEX_DATA_DIR", help="Project data root"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only report what would be removed"),
+    legacy: bool = typer.Option(False, "--legacy", help="Also tidy build outputs that older versions left in project directories (the last PDF, synctex and source map move into .builds)"),
+    min_age: Optional[float] = typer.Option(None, help="Keep artifacts used within this many seconds (default KSAITEX_GC_MIN_AGE)")
+):
+    """
+    Evict old build artifacts to keep the build cache within its quotas.
+    """
+    import os
+    if data_dir:
+        os.environ["KSAITEX_DATA_DIR"] = str(data_dir.expanduser().resolve())
+    from ksaitex.storage.retention import RetentionManager, format_bytes
+    report = RetentionManager(min_age=min_age).run(dry_run=dry_run, legacy=legacy)
+    for item in report["evicted"]:
+        typer.echo(f"{'would evict' if dry_run else 'evicted'} {item['path']} ({format_bytes(item['size'])}, {item['reason']})")
+    typer.echo(f"{'Would free' if dry_run else 'Freed'} {format_bytes(report['freed'])}; {report['legacy_removed']} legacy files removed, {report['legacy_migrated']} migrated, {report['skipped_busy']} busy artifacts skipped; {format_bytes(report['total'])} of build artifacts remain")
+@app.command("profile-startup")
+def profile_startup(
+    module: str = typer.Option("ksaitex.cli", help="Module whose import to profile (e.g. ksaitex.api.main)"),
+    top: int = typer.Option(20, help="Number of modules to show")
+):
+    """
+    Report import time per module, measured in a fresh interpreter with -X importtime.
+    """
+    import sys
+    import subprocess
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    if result.returncode != 0:
+        typer.echo(result.stderr, err=True)
+        raise typer.Exit(code=1)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    total = next((r[0] for r in rows if r[2].strip() == module), 0)
+    typer.echo(f"Importing {module} took {total / 1000:.1f} ms")
+    typer.echo(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        typer.echo(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {name}")
 if __name__ == "__main__":
     app()
\ No newline at end of file
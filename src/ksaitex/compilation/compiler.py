@@ -1,11 +1,93 @@
+import os
+import signal
 import asyncio
 import shutil
 import tempfile
+import weakref
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict
+class CompileLimits:
+    """Resource bounds for a single lualatex run. Defaults can be overridden through the environment."""
+    def __init__(self, timeout: Optional[float] = None, cpu_seconds: Optional[int] = None, memory_mb: Optional[int] = None, max_log_bytes: Optional[int] = None, nice: int = 0):
+        self.timeout = timeout if timeout is not None else float(os.environ.get("KSAITEX_COMPILE_TIMEOUT", "120"))
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else int(os.environ.get("KSAITEX_COMPILE_CPU_SECONDS", "120"))
+        self.memory_mb = memory_mb if memory_mb is not None else int(os.environ.get("KSAITEX_COMPILE_MEMORY_MB", "2048"))
+        self.max_log_bytes = max_log_bytes if max_log_bytes is not None else int(os.environ.get("KSAITEX_COMPILE_MAX_LOG_BYTES", str(256 * 1024)))
+        self.nice = nice
+    def apply_rlimits(self, pid: int):
+        """
+        Applied from the parent to the started child: a preexec_fn is not
+        safe while other threads (the worker's slots, to_thread) are running.
+        """
+        import resource
+        try:
+            if self.cpu_seconds > 0:
+                resource.prlimit(pid, resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 5))
+            if self.memory_mb > 0:
+                limit = self.memory_mb * 1024 * 1024
+                resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+            if self.nice > 0:
+                os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + self.nice)
+        except ProcessLookupError:
+            pass
+        except (OSError, AttributeError) as e:
+            print(f"Warning: could not limit lualatex (pid {pid}): {e}")
+compile_metrics: Dict[str, int] = {
+    "started": 0,
+    "succeeded": 0,
+    "failed": 0,
+    "timed_out": 0,
+    "limit_killed": 0,
+    "log_truncated": 0,
+}
+_compile_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+def compile_slots() -> asyncio.Semaphore:
+    """
+    Caps concurrent lualatex runs per event loop so one slow document cannot
+    starve the rest. A semaphore belongs to one loop, and the farm worker
+    runs a loop per slot thread.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _compile_slots.get(loop)
+    if slots is None:
+        slots = _compile_slots[loop] = asyncio.Semaphore(int(os.environ.get("KSAITEX_MAX_CONCURRENT_COMPILES", str(os.cpu_count() or 2))))
+    return slots
+async def read_capped(stream: asyncio.StreamReader, limit: int) -> Tuple[bytes, int]:
+    """
+    Drains stream keeping at most limit bytes: the first half and the most
+    recent half, since TeX reports fatal errors at the end.
+    Returns (captured, dropped_byte_count).
+    """
+    head = bytearray()
+    tail = bytearray()
+    half = max(limit // 2, 1)
+    dropped = 0
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        if len(head) < half:
+            take = half - len(head)
+            head += chunk[:take]
+            chunk = chunk[take:]
+        tail += chunk
+        if len(tail) > half:
+            dropped += len(tail) - half
+            del tail[:len(tail) - half]
+    if dropped:
+        return bytes(head) + f"\n... [{dropped} bytes of output truncated] ...\n".encode() + bytes(tail), dropped
+    return bytes(head) + bytes(tail), 0
+def kill_process_group(process: asyncio.subprocess.Process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
 class LatexCompiler:
-    def __init__(self, build_dir: Optional[Path] = None):
+    def __init__(self, build_dir: Optional[Path] = None, limits: Optional[CompileLimits] = None, fonts_dir: Optional[Path] = None):
+        from ksaitex.config import FONTS_DIR
         self.build_dir = build_dir
+        self.limits = limits or CompileLimits()
+        self.fonts_dir = fonts_dir or FONTS_DIR
     async def compile(self, latex_content: str, output_filename: str = "main.pdf", working_dir: Optional[Path] = None) -> Tuple[Optional[bytes], str]:
         """
         Compiles LaTeX content to PDF using lualatex.
@@ -18,21 +100,51 @@ class LatexCompiler:
             with open(tex_file, "w", encoding="utf-8") as f:
                 f.write(latex_content)
             cmd = ["lualatex", "-interaction=nonstopmode", "-synctex=1", str(tex_filename)]
-            env = shutil.os.environ.copy()
-            fonts_dir = Path("fonts").resolve()
+            env = os.environ.copy()
+            fonts_dir = self.fonts_dir
             current_osfontdir = env.get("OSFONTDIR", "")
             env["OSFONTDIR"] = f"{fonts_dir}:{current_osfontdir}" if current_osfontdir else str(fonts_dir)
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                cwd=str(cwd),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=env
-            )
-            stdout, stderr = await process.communicate()
-            log_output = stdout.decode("utf-8", errors="replace") + "\n" + stderr.decode("utf-8", errors="replace")
             pdf_name = Path(tex_filename).with_suffix('.pdf').name
             pdf_file = cwd / pdf_name
+            # A stale PDF from an earlier run must not be mistaken for this run's output.
+            pdf_file.unlink(missing_ok=True)
+            async with compile_slots():
+                compile_metrics["started"] += 1
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    cwd=str(cwd),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    env=env,
+                    start_new_session=True
+                )
+                self.limits.apply_rlimits(process.pid)
+                reader = asyncio.create_task(read_capped(process.stdout, self.limits.max_log_bytes))
+                timed_out = False
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=self.limits.timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    kill_process_group(process)
+                    await process.wait()
+                except asyncio.CancelledError:
+                    kill_process_group(process)
+                    raise
+                finally:
+                    if process.returncode is None:
+                        kill_process_group(process)
+                output, dropped = await reader
+            log_output = output.decode("utf-8", errors="replace")
+            if dropped:
+                compile_metrics["log_truncated"] += 1
+            if timed_out:
+                compile_metrics["timed_out"] += 1
+                return None, log_output + f"\nError: compilation timed out after {self.limits.timeout:g}s and was killed."
+            if process.returncode < 0:
+                compile_metrics["limit_killed"] += 1
+                sig = signal.Signals(-process.returncode).name
+                return None, log_output + f"\nError: compilation was killed by {sig} (resource limit exceeded)."
             pdf_bytes = None
             if pdf_file.exists():
                 with open(pdf_file, "rb") as f:
@@ -42,6 +154,7 @@ class LatexCompiler:
                     target_pdf = self.build_dir / output_filename
                     with open(target_pdf, "wb") as f:
                         f.write(pdf_bytes)
+            compile_metrics["succeeded" if pdf_bytes else "failed"] += 1
             return pdf_bytes, log_output
         if working_dir:
             print(f"DEBUG: Compiling in specific directory: {working_dir.resolve()}")
@@ -51,8 +164,8 @@ class LatexCompiler:
             print("DEBUG: Compiling in temp directory")
             with tempfile.TemporaryDirectory() as temp_dir_str:
                 return await run_compilation(Path(temp_dir_str), "document.tex")
-async def compile_latex(latex_content: str, output_path: Optional[Path] = None, working_dir: Optional[Path] = None) -> Tuple[Optional[bytes], str]:
+async def compile_latex(latex_content: str, output_path: Optional[Path] = None, working_dir: Optional[Path] = None, limits: Optional[CompileLimits] = None, fonts_dir: Optional[Path] = None) -> Tuple[Optional[bytes], str]:
     build_dir = output_path.parent if output_path else None
     filename = output_path.name if output_path else "output.pdf"
-    compiler = LatexCompiler(build_dir)
-    return await compiler.compile(latex_content, filename, working_dir=working_dir)
\ No newline at end of file
+    compiler = LatexCompiler(build_dir, limits, fonts_dir)
+    return await compiler.compile(latex_content, filename, working_dir=working_dir)
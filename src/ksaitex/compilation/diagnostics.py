@@ -0,0 +1,71 @@
+import re
+import bisect
+from typing import List, Dict, Any, Optional
+ERROR_LINE = re.compile(r'^l\.(\d+)')
+BOX_PATTERN = re.compile(r'^Overfull \\([hv])box \(([\d.]+)pt too (wide|high)\) (?:in paragraph|in alignment|detected) at lines? (\d+)')
+MISSING_GLYPH = re.compile(r'^Missing character: There is no (.+?) \((U\+[0-9A-Fa-f]+)\) in font ([^!]+)!')
+LATEX_ERROR_LINE = re.compile(r'on input line (\d+)')
+class TexLineMapper:
+    """Maps a line of main.tex back to the markdown line that produced it, using the compile source map."""
+    def __init__(self, source_map: Optional[Dict[str, int]] = None, md_offset: int = 0):
+        tex_to_md = {}
+        for md_line_str, tex_line in (source_map or {}).items():
+            md_line = int(md_line_str)
+            if md_line < tex_to_md.get(tex_line, float('inf')):
+                tex_to_md[tex_line] = md_line
+        self.tex_lines = sorted(tex_to_md)
+        self.md_lines = [tex_to_md[t] + md_offset for t in self.tex_lines]
+    def md_line(self, tex_line: Optional[int]) -> Optional[int]:
+        if tex_line is None or not self.tex_lines:
+            return None
+        i = bisect.bisect_right(self.tex_lines, tex_line) - 1
+        if i < 0:
+            return None
+        return self.md_lines[i]
+def analyze_log(log: str, source_map: Optional[Dict[str, int]] = None, md_offset: int = 0, max_items: int = 200) -> List[Dict[str, Any]]:
+    """
+    Scans a lualatex log once and returns compact diagnostics: errors (with
+    the l.<n> line TeX reports after them), overfull boxes and missing
+    glyphs (aggregated per character and font, since luatex reports them
+    without a line). Lines are mapped back to markdown through source_map.
+    """
+    mapper = TexLineMapper(source_map, md_offset)
+    diagnostics: List[Dict[str, Any]] = []
+    glyphs: Dict[tuple, Dict[str, Any]] = {}
+    pending_error: Optional[Dict[str, Any]] = None
+    for line in log.splitlines():
+        if line.startswith("! "):
+            pending_error = {"severity": "error", "kind": "error", "message": line[2:].strip(), "tex_line": None}
+            diagnostics.append(pending_error)
+            continue
+        if pending_error is not None:
+            m = ERROR_LINE.match(line)
+            if m:
+                pending_error["tex_line"] = int(m.group(1))
+                pending_error = None
+                continue
+            m = LATEX_ERROR_LINE.search(line)
+            if m:
+                pending_error["tex_line"] = int(m.group(1))
+        if line.startswith("Overfull"):
+            m = BOX_PATTERN.match(line)
+            if m:
+                box, amount, direction, tex_line = m.groups()
+                diagnostics.append({"severity": "warning", "kind": "overfull", "message": f"Overfull \\{box}box ({amount}pt too {direction})", "tex_line": int(tex_line)})
+            continue
+        if line.startswith("Missing character"):
+            m = MISSING_GLYPH.match(line)
+            if m:
+                char, codepoint, font = m.groups()
+                key = (codepoint, font.strip())
+                if key not in glyphs:
+                    glyphs[key] = {"severity": "warning", "kind": "missing_glyph", "message": f"Missing glyph {char} ({codepoint}) in font {font.strip()}", "tex_line": None, "count": 0}
+                glyphs[key]["count"] += 1
+    diagnostics.extend(glyphs.values())
+    for d in diagnostics:
+        d["md_line"] = mapper.md_line(d["tex_line"])
+    diagnostics.sort(key=lambda d: d["severity"] != "error")
+    return diagnostics[:max_items]
+def shift_diagnostics(diagnostics: List[Dict[str, Any]], md_offset: int) -> List[Dict[str, Any]]:
+    """Moves diagnostics computed for a fragment to where the fragment sits in the document."""
+    return [{**d, "md_line": d["md_line"] + md_offset if d.get("md_line") is not None else None} for d in diagnostics]
@@ -0,0 +1,238 @@
+import os
+import time
+import uuid
+import base64
+import asyncio
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from ksaitex.config import FONTS_DIR
+from ksaitex.storage.assets import AssetStore, asset_store
+from ksaitex.storage.files import atomic_write_bytes
+POLL_TIMEOUT = float(os.environ.get("KSAITEX_FARM_POLL_TIMEOUT", "25"))
+WORKER_TIMEOUT = float(os.environ.get("KSAITEX_FARM_WORKER_TIMEOUT", "60"))
+MAX_ATTEMPTS = int(os.environ.get("KSAITEX_FARM_MAX_ATTEMPTS", "3"))
+# A worker holding a job longer than this (its result POST may have failed) loses it.
+JOB_TIMEOUT = float(os.environ.get("KSAITEX_FARM_JOB_TIMEOUT", "180"))
+# Upper bound for the whole request, queueing and retries included.
+JOB_DEADLINE = float(os.environ.get("KSAITEX_FARM_JOB_DEADLINE", "600"))
+FONT_SUFFIXES = {".ttf", ".otf", ".ttc"}
+class FarmUnavailable(Exception):
+    """No remote worker could take or finish the job; the caller compiles locally."""
+def farm_supported() -> bool:
+    """
+    The worker registry and job queue live in one process, so the farm is
+    off when the server runs several (uvicorn reads WEB_CONCURRENCY, and
+    'ksaitex serve --workers N' exports it).
+    """
+    return int(os.environ.get("WEB_CONCURRENCY", "1") or "1") <= 1
+class CompileJob:
+    def __init__(self, latex: str, assets: Dict[str, str], fonts: Dict[str, str]):
+        self.id = uuid.uuid4().hex
+        self.latex = latex
+        self.assets = assets
+        self.fonts = fonts
+        self.attempts = 0
+        self.worker_id: Optional[str] = None
+        self.assigned_at = 0.0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+    def payload(self) -> Dict[str, Any]:
+        return {"job_id": self.id, "latex": self.latex, "assets": self.assets, "fonts": self.fonts}
+class WorkerInfo:
+    def __init__(self, name: str, slots: int):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.slots = max(1, slots)
+        self.jobs: Dict[str, CompileJob] = {}
+        self.last_seen = time.monotonic()
+        self.waiter: Optional[asyncio.Future] = None
+    @property
+    def depth(self) -> int:
+        return len(self.jobs)
+class CompileFarm:
+    """
+    Dispatches compile jobs to remote 'ksaitex worker' processes. Workers
+    long-poll for jobs; a queued job goes to the waiting worker with the
+    shallowest queue. Jobs of workers that stop polling or heartbeating
+    for WORKER_TIMEOUT seconds, or that hold a job for JOB_TIMEOUT, are
+    requeued, up to MAX_ATTEMPTS times.
+    """
+    def __init__(self, store: AssetStore = asset_store, fonts_dir: Path = FONTS_DIR):
+        self.store = store
+        self.fonts_dir = fonts_dir
+        self.workers: Dict[str, WorkerInfo] = {}
+        self.queue: deque = deque()
+        self.jobs: Dict[str, CompileJob] = {}
+    @property
+    def available(self) -> bool:
+        return bool(self.workers) and farm_supported()
+    def register(self, name: str, slots: int) -> WorkerInfo:
+        worker = WorkerInfo(name, slots)
+        self.workers[worker.id] = worker
+        print(f"DEBUG: Farm worker '{name}' registered ({worker.slots} slots)")
+        return worker
+    def touch(self, worker_id: str) -> WorkerInfo:
+        worker = self.workers.get(worker_id)
+        if worker is None:
+            raise KeyError(worker_id)
+        worker.last_seen = time.monotonic()
+        return worker
+    def collect_assets(self, project_dir: Optional[Path]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        assets = {}
+        images_dir = project_dir / "images" if project_dir else None
+        if images_dir and images_dir.exists():
+            for image in sorted(images_dir.rglob("*")):
+                if image.is_file():
+                    assets[image.relative_to(project_dir).as_posix()] = self.store.add_file(image)
+        fonts = {}
+        if self.fonts_dir.exists():
+            for font in sorted(self.fonts_dir.iterdir()):
+                if font.suffix.lower() in FONT_SUFFIXES:
+                    fonts[font.name] = self.store.add_file(font)
+        return assets, fonts
+    def _dispatch(self):
+        while self.queue:
+            waiting = [w for w in self.workers.values() if w.waiter and not w.waiter.done() and w.depth < w.slots]
+            if not waiting:
+                return
+            worker = min(waiting, key=lambda w: w.depth)
+            job = self.queue.popleft()
+            if job.future.done():
+                continue
+            self._assign(job, worker)
+            worker.waiter.set_result(job)
+    def _assign(self, job: CompileJob, worker: WorkerInfo):
+        job.attempts += 1
+        job.worker_id = worker.id
+        job.assigned_at = time.monotonic()
+        worker.jobs[job.id] = job
+    async def poll(self, worker_id: str, timeout: float = POLL_TIMEOUT) -> Optional[CompileJob]:
+        worker = self.touch(worker_id)
+        if worker.depth < worker.slots:
+            while self.queue:
+                job = self.queue.popleft()
+                if not job.future.done():
+                    self._assign(job, worker)
+                    return job
+        waiter = worker.waiter = asyncio.get_running_loop().create_future()
+        self._dispatch()
+        delivered = False
+        try:
+            job = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            delivered = True
+            return job
+        except asyncio.TimeoutError:
+            # _dispatch may have handed over a job just as the timeout fired.
+            if waiter.done() and not waiter.cancelled():
+                delivered = True
+                return waiter.result()
+            return None
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            elif not delivered and not waiter.cancelled():
+                # Assigned, but the poll went away (worker disconnected) before it was sent.
+                job = waiter.result()
+                worker.jobs.pop(job.id, None)
+                job.attempts -= 1
+                self._requeue(job, f"poll of worker '{worker.name}' ended before delivery")
+            if worker.waiter is waiter:
+                worker.waiter = None
+            worker.last_seen = time.monotonic()
+    def complete(self, worker_id: str, job_id: str, result: Dict[str, Any]):
+        worker = self.touch(worker_id)
+        job = worker.jobs.pop(job_id, None)
+        if job is None or job.future.done():
+            return
+        if result.get("retry"):
+            self._requeue(job, f"worker '{worker.name}' gave up: {result.get('log', '')[-200:]}")
+            return
+        job.future.set_result(result)
+        self.jobs.pop(job.id, None)
+    def _requeue(self, job: CompileJob, reason: str):
+        job.worker_id = None
+        if job.attempts >= MAX_ATTEMPTS:
+            job.future.set_exception(FarmUnavailable(f"Job failed after {job.attempts} attempts ({reason})"))
+            self.jobs.pop(job.id, None)
+            return
+        print(f"DEBUG: Requeueing farm job {job.id[:8]}: {reason}")
+        self.queue.appendleft(job)
+        self._dispatch()
+    def reap(self):
+        """Drops workers that went silent and requeues their jobs."""
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if now - worker.last_seen > WORKER_TIMEOUT and not (worker.waiter and not worker.waiter.done()):
+                del self.workers[worker.id]
+                print(f"DEBUG: Farm worker '{worker.name}' lost")
+                for job in list(worker.jobs.values()):
+                    self._requeue(job, f"worker '{worker.name}' lost")
+                worker.jobs.clear()
+                continue
+            for job in list(worker.jobs.values()):
+                if now - job.assigned_at > JOB_TIMEOUT:
+                    del worker.jobs[job.id]
+                    self._requeue(job, f"no result from worker '{worker.name}' after {JOB_TIMEOUT:.0f}s")
+        if not self.workers:
+            while self.queue:
+                job = self.queue.popleft()
+                if not job.future.done():
+                    job.future.set_exception(FarmUnavailable("No farm workers left"))
+    async def run_reaper(self, interval: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.reap()
+    async def compile(self, latex: str, working_dir: Path) -> Tuple[Optional[bytes], str]:
+        """
+        Runs the job on a remote worker and writes main.tex/main.pdf/
+        main.synctex.gz/main.log into working_dir like a local build would.
+        """
+        if not self.available:
+            raise FarmUnavailable("No farm workers registered")
+        # Hashing and copying images and fonts is file I/O: keep it off the event loop.
+        assets, fonts = await asyncio.to_thread(self.collect_assets, working_dir)
+        job = CompileJob(latex, assets, fonts)
+        self.jobs[job.id] = job
+        self.queue.append(job)
+        self._dispatch()
+        try:
+            result = await asyncio.wait_for(asyncio.shield(job.future), JOB_DEADLINE)
+        except asyncio.TimeoutError:
+            raise FarmUnavailable(f"No result within {JOB_DEADLINE:.0f}s")
+        finally:
+            if not job.future.done():
+                job.future.cancel()
+            self.jobs.pop(job.id, None)
+            if job.worker_id and job.worker_id in self.workers:
+                self.workers[job.worker_id].jobs.pop(job.id, None)
+        working_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(working_dir / "main.tex", latex.encode("utf-8"))
+        log = result.get("log", "")
+        atomic_write_bytes(working_dir / "main.log", log.encode("utf-8"))
+        pdf_bytes = base64.b64decode(result["pdf"]) if result.get("pdf") else None
+        # A result without synctex must not leave the previous build's positions behind.
+        (working_dir / "main.pdf").unlink(missing_ok=True)
+        (working_dir / "main.synctex.gz").unlink(missing_ok=True)
+        if pdf_bytes:
+            atomic_write_bytes(working_dir / "main.pdf", pdf_bytes)
+        if result.get("synctex"):
+            atomic_write_bytes(working_dir / "main.synctex.gz", base64.b64decode(result["synctex"]))
+        return pdf_bytes, log
+    def status(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self.queue),
+            "workers": [{"id": w.id, "name": w.name, "slots": w.slots, "depth": w.depth, "idle_for": round(time.monotonic() - w.last_seen, 1)} for w in self.workers.values()]
+        }
+compile_farm = CompileFarm()
+async def compile_with_farm(latex: str, working_dir: Path, limits=None) -> Tuple[Optional[bytes], str]:
+    """
+    Uses the farm when workers are registered (and KSAITEX_FARM is not
+    'off'), else compiles locally with the given CompileLimits.
+    """
+    from ksaitex.compilation.compiler import compile_latex
+    if os.environ.get("KSAITEX_FARM", "auto") != "off" and compile_farm.available:
+        try:
+            return await compile_farm.compile(latex, working_dir)
+        except FarmUnavailable as e:
+            print(f"DEBUG: Farm unavailable, compiling locally: {e}")
+    return await compile_latex(latex, working_dir=working_dir, limits=limits)
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Optional, Callable, Awaitable
+from ksaitex.config import BUILDS_DIR
+from ksaitex.compilation.compiler import CompileLimits
+from ksaitex.storage.files import atomic_write_bytes
+from ksaitex.storage.retention import build_dir
+# Written next to the main PDF, so every server process (and a restart) sees what it was built from.
+SIGNATURE_FILE = ".source_signature"
+def source_signature(markdown: str, template: str, variables: dict) -> str:
+    """Identifies the input of a build, so a foreground request can tell whether a background one is building the same thing."""
+    payload = json.dumps([markdown, template, variables or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+class SpeculativeJob:
+    def __init__(self, project_id: str, scheduled_at: float):
+        self.project_id = project_id
+        self.scheduled_at = scheduled_at
+        self.signature: Optional[str] = None
+        self.preempted = False
+        self.task: Optional[asyncio.Task] = None
+class SpeculativeCompiler:
+    """
+    Builds the saved state of a project in the background (on open and
+    when the editor goes idle) so the PDF and synctex data are warm when
+    the user compiles. Background builds run niced, one at a time, only
+    while no interactive compile is in flight; an interactive compile
+    cancels them unless it is asking for exactly what is being built,
+    and preempted builds are retried once the foreground is quiet again,
+    unless an interactive build of the same project finished since they
+    were first queued (the retry would overwrite it with older input).
+    Queued and running builds are per process; what the main build was
+    built from is recorded on disk.
+    """
+    def __init__(self, max_concurrent: Optional[int] = None, nice: Optional[int] = None, resume_delay: float = 1.0, builds_dir: Path = BUILDS_DIR):
+        self.enabled = os.environ.get("KSAITEX_SPECULATIVE", "on") != "off"
+        self.slots = asyncio.Semaphore(max_concurrent or int(os.environ.get("KSAITEX_SPECULATIVE_CONCURRENCY", "1")))
+        self.limits = CompileLimits(nice=nice if nice is not None else int(os.environ.get("KSAITEX_SPECULATIVE_NICE", "10")))
+        self.idle_delay = float(os.environ.get("KSAITEX_SPECULATIVE_IDLE_DELAY", "3"))
+        self.resume_delay = resume_delay
+        self.builder: Optional[Callable[[SpeculativeJob], Awaitable[bool]]] = None
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.running: Dict[str, SpeculativeJob] = {}
+        self.builds_dir = builds_dir
+        self.foreground_count = 0
+        self.foreground_finished: Dict[str, float] = {}
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.metrics = {"scheduled": 0, "started": 0, "built": 0, "up_to_date": 0, "superseded": 0, "preempted": 0, "cancelled": 0, "failed": 0}
+    def schedule(self, project_id: str, delay: float = 0.0, since: Optional[float] = None):
+        """
+        Queues a background build of the project's saved state, replacing any
+        pending one. since is when the work was first asked for (retries keep it).
+        """
+        if not self.enabled or self.builder is None:
+            return
+        previous = self.pending.pop(project_id, None)
+        if previous:
+            previous.cancel()
+        self.metrics["scheduled"] += 1
+        self.pending[project_id] = asyncio.create_task(self._run(project_id, delay, time.monotonic() if since is None else since))
+    def cancel(self, project_id: str):
+        """Drops pending and running background work for the project (e.g. the user is typing again)."""
+        task = self.pending.pop(project_id, None)
+        if task:
+            task.cancel()
+        job = self.running.get(project_id)
+        if job and job.task:
+            job.task.cancel()
+    def forget(self, project_id: str):
+        """The project was renamed or deleted."""
+        self.cancel(project_id)
+        self.foreground_finished.pop(project_id, None)
+    def shutdown(self):
+        for task in list(self.pending.values()):
+            task.cancel()
+        for job in list(self.running.values()):
+            if job.task:
+                job.task.cancel()
+    def signature_path(self, project_id: str) -> Path:
+        return build_dir(project_id, "main", self.builds_dir) / SIGNATURE_FILE
+    def mark_built(self, project_id: str, signature: str):
+        path = self.signature_path(project_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(path, signature.encode("ascii"))
+    def built_signature(self, project_id: str) -> Optional[str]:
+        try:
+            return self.signature_path(project_id).read_text(encoding="ascii")
+        except (OSError, ValueError):
+            return None
+    def is_built(self, project_id: str, signature: str) -> bool:
+        return self.built_signature(project_id) == signature
+    def state(self, project_id: str) -> str:
+        if project_id in self.running:
+            return "running"
+        if project_id in self.pending:
+            return "queued"
+        return "ready" if self.built_signature(project_id) else "none"
+    def status(self) -> Dict:
+        return {"enabled": self.enabled, "pending": len(self.pending), "running": len(self.running), **self.metrics}
+    @asynccontextmanager
+    async def foreground(self, project_id: Optional[str] = None, signature: Optional[str] = None):
+        """Marks an interactive compile; background builds get out of its way."""
+        self.foreground_count += 1
+        self.idle.clear()
+        for job in list(self.running.values()):
+            if signature and job.project_id == project_id and job.signature == signature:
+                # Same input: the user waits on the project lock and gets the finished build.
+                continue
+            job.preempted = True
+            if job.task:
+                job.task.cancel()
+        try:
+            yield
+        finally:
+            if project_id:
+                self.foreground_finished[project_id] = time.monotonic()
+            self.foreground_count -= 1
+            if self.foreground_count == 0:
+                self.idle.set()
+    async def _run(self, project_id: str, delay: float, since: float):
+        job = SpeculativeJob(project_id, since)
+        job.task = asyncio.current_task()
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            async with self.slots:
+                await self.idle.wait()
+                if self.pending.get(project_id) is job.task:
+                    del self.pending[project_id]
+                if self.foreground_finished.get(project_id, 0.0) > job.scheduled_at:
+                    # The main build now holds newer (possibly unsaved) input than this job would read.
+                    self.metrics["superseded"] += 1
+                    return
+                self.running[project_id] = job
+                self.metrics["started"] += 1
+                built = await self.builder(job)
+                self.metrics["built" if built else "up_to_date"] += 1
+        except asyncio.CancelledError:
+            self.metrics["preempted" if job.preempted else "cancelled"] += 1
+            if job.preempted:
+                self.running.pop(project_id, None)
+                self.schedule(project_id, self.resume_delay, since=job.scheduled_at)
+        except Exception as e:
+            self.metrics["failed"] += 1
+            print(f"DEBUG: Speculative build of '{project_id}' failed: {e}")
+        finally:
+            if self.running.get(project_id) is job:
+                del self.running[project_id]
+            if self.pending.get(project_id) is job.task:
+                del self.pending[project_id]
+speculative_compiler = SpeculativeCompiler()
@@ -0,0 +1,134 @@
+import json
+import time
+import base64
+import asyncio
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, Any, Optional
+from ksaitex.storage.assets import AssetStore
+class FarmClient:
+    """Blocking HTTP client for the /api/farm endpoints; one per worker thread."""
+    def __init__(self, server: str, token: Optional[str] = None):
+        self.server = server.rstrip("/")
+        self.token = token
+    def request(self, method: str, path: str, payload: Optional[dict] = None, timeout: float = 60) -> Any:
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(self.server + path, data=data, method=method)
+        req.add_header("Content-Type", "application/json")
+        if self.token:
+            req.add_header("X-Farm-Token", self.token)
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            if resp.headers.get("Content-Type", "").startswith("application/json"):
+                return json.loads(body) if body else None
+            return body
+    def fetch_asset(self, digest: str, store: AssetStore):
+        req = urllib.request.Request(f"{self.server}/api/farm/assets/{digest}")
+        if self.token:
+            req.add_header("X-Farm-Token", self.token)
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            store.add_stream(iter(lambda: resp.read(1024 * 1024), b""), expected=digest)
+class FarmWorker:
+    """
+    Runs compile jobs handed out by the API server. Each slot is a thread
+    long-polling /api/farm/poll; assets and fonts are fetched by hash into
+    a local AssetStore the first time a job needs them.
+    """
+    def __init__(self, server: str, name: str, slots: int = 1, cache_dir: Optional[Path] = None, token: Optional[str] = None):
+        self.client = FarmClient(server, token)
+        self.name = name
+        self.slots = max(1, slots)
+        self.cache_dir = cache_dir or Path(tempfile.gettempdir()) / f"ksaitex-worker-{name}"
+        self.store = AssetStore(self.cache_dir / "assets")
+        self.fonts_dir = self.cache_dir / "fonts"
+        self.worker_id: Optional[str] = None
+        self.register_lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.stop = threading.Event()
+    def register(self, stale_id: Optional[str] = None) -> str:
+        with self.register_lock:
+            if self.worker_id is None or self.worker_id == stale_id:
+                self.worker_id = self.client.request("POST", "/api/farm/register", {"name": self.name, "slots": self.slots})["worker_id"]
+                print(f"DEBUG: Registered with {self.client.server} as {self.worker_id[:8]} ({self.slots} slots)")
+            return self.worker_id
+    def ensure_assets(self, job: Dict[str, Any]):
+        with self.fetch_lock:
+            for digest in list(job.get("assets", {}).values()) + list(job.get("fonts", {}).values()):
+                if not self.store.has(digest):
+                    self.client.fetch_asset(digest, self.store)
+            for name, digest in job.get("fonts", {}).items():
+                target = self.fonts_dir / name
+                if not target.exists() or self.store.hash_file(target) != digest:
+                    self.store.materialize(digest, target)
+    def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        from ksaitex.compilation.compiler import compile_latex
+        self.ensure_assets(job)
+        with tempfile.TemporaryDirectory(prefix="job-", dir=str(self.cache_dir)) as tmp:
+            work = Path(tmp)
+            for rel_path, digest in job.get("assets", {}).items():
+                target = (work / rel_path).resolve()
+                if not target.is_relative_to(work.resolve()):
+                    raise ValueError(f"Asset path escapes the job directory: {rel_path}")
+                self.store.materialize(digest, target)
+            pdf_bytes, log = asyncio.run(compile_latex(job["latex"], working_dir=work, fonts_dir=self.fonts_dir))
+            synctex = work / "main.synctex.gz"
+            return {
+                "ok": bool(pdf_bytes),
+                "pdf": base64.b64encode(pdf_bytes).decode("ascii") if pdf_bytes else None,
+                "synctex": base64.b64encode(synctex.read_bytes()).decode("ascii") if pdf_bytes and synctex.exists() else None,
+                "log": log
+            }
+    def slot_loop(self):
+        worker_id = self.register()
+        while not self.stop.is_set():
+            try:
+                job = self.client.request("POST", "/api/farm/poll", {"worker_id": worker_id}, timeout=90)
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    worker_id = self.register(stale_id=worker_id)
+                    continue
+                print(f"DEBUG: Poll failed: {e}")
+                self.stop.wait(2)
+                continue
+            except (urllib.error.URLError, OSError) as e:
+                print(f"DEBUG: Server unreachable: {e}")
+                self.stop.wait(2)
+                continue
+            if not job:
+                continue
+            print(f"DEBUG: Job {job['job_id'][:8]} started")
+            started = time.monotonic()
+            try:
+                result = self.run_job(job)
+            except Exception as e:
+                result = {"ok": False, "retry": True, "log": f"Worker error: {e}"}
+            result.update({"worker_id": worker_id, "job_id": job["job_id"]})
+            try:
+                self.client.request("POST", "/api/farm/result", result)
+            except (urllib.error.URLError, OSError) as e:
+                print(f"DEBUG: Could not deliver result of job {job['job_id'][:8]}: {e}")
+            print(f"DEBUG: Job {job['job_id'][:8]} finished in {time.monotonic() - started:.1f}s")
+    def heartbeat_loop(self, interval: float):
+        while not self.stop.wait(interval):
+            try:
+                self.client.request("POST", "/api/farm/heartbeat", {"worker_id": self.worker_id})
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    self.register(stale_id=self.worker_id)
+            except (urllib.error.URLError, OSError):
+                pass
+    def run(self, heartbeat_interval: float = 15):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.fonts_dir.mkdir(parents=True, exist_ok=True)
+        threads = [threading.Thread(target=self.slot_loop, daemon=True) for _ in range(self.slots)]
+        threads.append(threading.Thread(target=self.heartbeat_loop, args=(heartbeat_interval,), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while not self.stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop.set()
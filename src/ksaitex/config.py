@@ -0,0 +1,9 @@
+import os
+from pathlib import Path
+DATA_DIR = Path(os.environ.get("KSAITEX_DATA_DIR", "data")).expanduser().resolve()
+CACHE_DIR = DATA_DIR / ".cache"
+LOCKS_DIR = DATA_DIR / ".locks"
+FONTS_DIR = Path(os.environ.get("KSAITEX_FONTS_DIR", "fonts")).expanduser().resolve()
+ASSETS_DIR = DATA_DIR / ".assets"
+INDEX_DIR = DATA_DIR / ".index"
+BUILDS_DIR = DATA_DIR / ".builds"
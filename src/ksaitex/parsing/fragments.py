@@ -0,0 +1,64 @@
+from markdown_it import MarkdownIt
+from typing import List, Dict, Any, Optional, Tuple
+from ksaitex.parsing.magic import MAGIC_MARKER
+def find_paired_blocks(text: str, magic_commands: List[Dict[str, Any]]) -> List[Tuple[int, int, str]]:
+    """
+    Returns (start_line, end_line, group) for every closed begin/end magic pair.
+    Lines are 1-based and inclusive. Unbalanced markers are ignored here;
+    render_latex reports them properly.
+    """
+    pairing = {}
+    for cmd in magic_commands:
+        if cmd.get('pairing') and cmd.get('group'):
+            pairing[cmd['label']] = (cmd['group'], cmd['pairing'])
+    blocks = []
+    stack = []
+    for line_no, line_text in enumerate(text.splitlines(), 1):
+        for match in MAGIC_MARKER.finditer(line_text):
+            info = pairing.get(match.group(1).strip())
+            if not info:
+                continue
+            group, kind = info
+            if kind == 'begin':
+                stack.append((group, line_no))
+            elif kind == 'end':
+                for i in range(len(stack) - 1, -1, -1):
+                    if stack[i][0] == group:
+                        blocks.append((stack[i][1], line_no, group))
+                        del stack[i:]
+                        break
+    return blocks
+def find_top_level_block(text: str, line: int) -> Optional[Tuple[int, int]]:
+    """Returns the (start_line, end_line) of the top-level markdown block containing line."""
+    md = MarkdownIt().enable("table").disable("code")
+    for token in md.parse(text):
+        if token.level == 0 and token.map:
+            start, end = token.map
+            if start < line <= end:
+                return start + 1, end
+    return None
+def extract_fragment(text: str, line: int, magic_commands: Optional[List[Dict[str, Any]]] = None) -> Tuple[int, int, str]:
+    """
+    Finds the smallest self-contained markdown range around a 1-based line:
+    the innermost enclosing paired magic block if there is one, otherwise the
+    top-level block (paragraph, table, list...) under the line.
+    Returns (start_line, end_line, fragment_markdown).
+    """
+    lines = text.splitlines()
+    if line < 1 or line > len(lines):
+        raise ValueError(f"Line {line} is outside the document (1-{len(lines)}).")
+    enclosing = [b for b in find_paired_blocks(text, magic_commands or []) if b[0] <= line <= b[1]]
+    if enclosing:
+        start, end, _ = min(enclosing, key=lambda b: b[1] - b[0])
+    else:
+        block = find_top_level_block(text, line)
+        if block is None:
+            raise ValueError(f"No markdown block found at line {line}.")
+        start, end = block
+    return start, end, "\n".join(lines[start - 1:end])
+def slice_lines(text: str, start_line: int, end_line: int) -> str:
+    """Returns the 1-based inclusive line range of text."""
+    lines = text.splitlines()
+    if start_line < 1 or end_line < start_line or start_line > len(lines):
+        raise ValueError(f"Invalid line range {start_line}-{end_line}.")
+    return "\n".join(lines[start_line - 1:end_line])
@@ -0,0 +1,3 @@
+import re
+# A magic command as inserted into the markdown: group 1 is its label, group 2 the optional 'key=value;...' arguments.
+MAGIC_MARKER = re.compile(r'--\[\[--\[\[--\[\[#{7}-\[\[MAGIC:([^|\]]+)(?:\|(.*?))?\]\]-#{7}\]\]--\]\]--\]\]--')
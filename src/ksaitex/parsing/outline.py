@@ -0,0 +1,124 @@
+import re
+import json
+import hashlib
+from collections import OrderedDict
+from markdown_it import MarkdownIt
+from typing import List, Dict, Any, Optional, Tuple
+from ksaitex.parsing.magic import MAGIC_MARKER
+FENCE_PATTERN = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+HEADING_LEVELS = {"h1": 2, "h2": 3, "h3": 4, "h4": 5, "h5": 6, "h6": 6}
+def split_blocks(text: str) -> List[Tuple[int, str]]:
+    """
+    Splits markdown into blank-line separated blocks, keeping fenced code
+    intact. Returns (first_line, block_text) with 1-based line numbers.
+    """
+    blocks = []
+    current: List[str] = []
+    start = 1
+    fence = None
+    for line_no, line in enumerate(text.split("\n"), 1):
+        m = FENCE_PATTERN.match(line)
+        if m:
+            marker = m.group(1)
+            if fence is None:
+                fence = marker[0] * len(marker)
+            elif marker.startswith(fence):
+                fence = None
+        if fence is None and not line.strip():
+            if current:
+                blocks.append((start, "\n".join(current)))
+                current = []
+            continue
+        if not current:
+            start = line_no
+        current.append(line)
+    if current:
+        blocks.append((start, "\n".join(current)))
+    return blocks
+def toc_commands(magic_commands: List[Dict[str, Any]]) -> Dict[str, Tuple[int, str]]:
+    """label -> (toc_level, default title) for every magic command tagged with toc_level."""
+    result = {}
+    for cmd in magic_commands:
+        if not cmd.get("toc_level"):
+            continue
+        default_title = ""
+        for arg in cmd.get("arg_schema", []):
+            if arg["name"] == "title":
+                default_title = arg["default"]
+        result[cmd["label"]] = (int(cmd["toc_level"]), default_title)
+    return result
+def parse_magic_args(args_str: str) -> Dict[str, str]:
+    provided_args = {}
+    for pair in (args_str or "").split(';'):
+        if '=' in pair:
+            k, v = pair.split('=', 1)
+            provided_args[k.strip()] = v.strip()
+    return provided_args
+class OutlineBuilder:
+    """
+    Derives the document outline (markdown headings and toc_level magic
+    commands) from the parser's token stream. Results are cached per block
+    hash, so after an edit only the changed blocks are parsed again.
+    """
+    def __init__(self, cache_size: int = 4096, version_history: int = 256):
+        self.md = MarkdownIt().enable("table").disable("code")
+        self.block_cache: "OrderedDict[Tuple[str, str], List[Dict[str, Any]]]" = OrderedDict()
+        self.versions: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self.cache_size = cache_size
+        self.version_history = version_history
+    def block_outline(self, block: str, commands: Dict[str, Tuple[int, str]]) -> List[Dict[str, Any]]:
+        entries = []
+        tokens = self.md.parse(block)
+        for i, token in enumerate(tokens):
+            if token.type == "heading_open" and token.map:
+                title = tokens[i + 1].content if i + 1 < len(tokens) else ""
+                entries.append({"kind": "heading", "level": HEADING_LEVELS.get(token.tag, 6), "title": title.replace("**", "").strip(), "line": token.map[0]})
+            elif token.type == "inline" and token.map and "MAGIC:" in token.content:
+                for m in MAGIC_MARKER.finditer(token.content):
+                    label = m.group(1).strip()
+                    if label not in commands:
+                        continue
+                    level, default_title = commands[label]
+                    title = parse_magic_args(m.group(2)).get("title", default_title) or label
+                    line = token.map[0] + token.content.count("\n", 0, m.start())
+                    entries.append({"kind": "magic", "level": level, "title": title.replace("**", "").strip(), "label": label, "line": line})
+        return entries
+    def build(self, text: str, template_key: str, magic_commands: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        commands = toc_commands(magic_commands)
+        outline = []
+        for start, block in split_blocks(text):
+            key = (template_key, hashlib.sha1(block.encode("utf-8")).hexdigest())
+            entries = self.block_cache.get(key)
+            if entries is None:
+                if "#" not in block and "MAGIC:" not in block and "\n=" not in block and "\n-" not in block:
+                    entries = []
+                else:
+                    entries = self.block_outline(block, commands)
+                self.block_cache[key] = entries
+                while len(self.block_cache) > self.cache_size:
+                    self.block_cache.popitem(last=False)
+            else:
+                self.block_cache.move_to_end(key)
+            for entry in entries:
+                outline.append({**entry, "line": entry["line"] + start})
+        return outline
+    def remember(self, outline: List[Dict[str, Any]]) -> str:
+        version = hashlib.sha1(json.dumps(outline, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+        self.versions[version] = outline
+        self.versions.move_to_end(version)
+        while len(self.versions) > self.version_history:
+            self.versions.popitem(last=False)
+        return version
+    def previous(self, version: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        if not version:
+            return None
+        return self.versions.get(version)
+def diff_outline(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Single splice turning old into new: replace old[start:start+delete] with insert."""
+    prefix = 0
+    while prefix < len(old) and prefix < len(new) and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(old) - prefix and suffix < len(new) - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return {"start": prefix, "delete": len(old) - prefix - suffix, "insert": new[prefix:len(new) - suffix]}
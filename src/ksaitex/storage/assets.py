@@ -0,0 +1,80 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict, Tuple, Optional
+from ksaitex.config import ASSETS_DIR
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+def copy_atomic(source: Path, target: Path):
+    """
+    Copies rather than hard-links: a link would share the inode, so editing
+    the project file in place would silently corrupt the blob (and vice versa).
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=str(target.parent), prefix=".tmp-")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_name)
+        os.replace(tmp_name, target)
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+class AssetStore:
+    """
+    Content-addressed blobs (images, fonts) stored as <root>/<sha[:2]>/<sha>.
+    Hashes of source files are memoised by (size, mtime) so repeated jobs
+    do not re-read unchanged files.
+    """
+    def __init__(self, root: Path = ASSETS_DIR):
+        self.root = root
+        self._hashes: Dict[Path, Tuple[Tuple[int, int], str]] = {}
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+    def has(self, digest: str) -> bool:
+        return self.path(digest).exists()
+    def hash_file(self, path: Path) -> str:
+        stat = path.stat()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = file_sha256(path)
+        self._hashes[path] = (signature, digest)
+        return digest
+    def add_file(self, path: Path) -> str:
+        """Stores a copy of path in the CAS and returns its hash."""
+        digest = self.hash_file(path)
+        target = self.path(digest)
+        if not target.exists():
+            copy_atomic(path, target)
+        return digest
+    def add_stream(self, chunks, expected: Optional[str] = None) -> str:
+        """Stores an iterable of byte chunks, verifying the hash if one is expected."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.root), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            if expected and digest != expected:
+                raise ValueError(f"Asset hash mismatch: expected {expected}, got {digest}")
+            target = self.path(digest)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_name, target)
+            return digest
+        finally:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+    def materialize(self, digest: str, target: Path):
+        """Places a copy of the blob at target."""
+        copy_atomic(self.path(digest), target)
+asset_store = AssetStore()
@@ -0,0 +1,297 @@
+import os
+import re
+import json
+import time
+import shutil
+import tarfile
+import hashlib
+import tempfile
+from pathlib import Path, PurePosixPath
+from typing import Dict, Any, List, Tuple, Iterator, AsyncIterator, Optional
+from ksaitex.storage.assets import AssetStore, asset_store
+from ksaitex.storage.files import atomic_write_json
+BUNDLE_FORMAT = "ksaitex-bundle"
+BUNDLE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+MAX_MANIFEST_BYTES = 16 * 1024 * 1024
+BUILD_FILES = ("main.pdf", "main.synctex.gz", "source_map.json")
+PROJECT_ID_PATTERN = re.compile(r"[\w-]+")
+class BundleError(ValueError):
+    """The archive is not a ksaitex bundle or does not match its manifest."""
+def bundle_members(project_dir: Path, build_dir: Optional[Path] = None) -> List[Tuple[str, Path]]:
+    """(archive path, file) pairs for a project: project.json, images/ and, given build_dir, the last build."""
+    members = [("project.json", project_dir / "project.json")]
+    images_dir = project_dir / "images"
+    if images_dir.is_dir():
+        for image in sorted(images_dir.rglob("*")):
+            if image.is_file() and not image.name.startswith("."):
+                members.append((image.relative_to(project_dir).as_posix(), image))
+    if build_dir:
+        members.extend((name, build_dir / name) for name in BUILD_FILES if (build_dir / name).exists())
+    return members
+def tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="strict")
+def tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+def iter_bundle(project_id: str, project_dir: Path, build_dir: Optional[Path] = None, store: AssetStore = asset_store) -> Iterator[bytes]:
+    """
+    Streams a project as an uncompressed tar, CHUNK_SIZE bytes at a time.
+    manifest.json comes first and lists the sha256 of every member, so an
+    importer can skip blobs it already has.
+    """
+    if not (project_dir / "project.json").exists():
+        raise FileNotFoundError(project_dir / "project.json")
+    members = []
+    for name, path in bundle_members(project_dir, build_dir):
+        stat = path.stat()
+        members.append((name, path, stat.st_size, stat.st_mtime, store.hash_file(path)))
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "project_id": project_id,
+        "created": int(time.time()),
+        "files": [{"path": name, "size": size, "sha256": digest} for name, _, size, _, digest in members]
+    }
+    data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+    yield tar_header("manifest.json", len(data), time.time()) + data + tar_padding(len(data))
+    for name, path, size, mtime, _ in members:
+        yield tar_header(name, size, mtime)
+        sent = 0
+        with open(path, "rb") as f:
+            while sent < size:
+                chunk = f.read(min(CHUNK_SIZE, size - sent))
+                if not chunk:
+                    raise BundleError(f"{name} shrank while being exported")
+                sent += len(chunk)
+                yield chunk
+        yield tar_padding(size)
+    yield b"\0" * (tarfile.BLOCKSIZE * 2)
+class ChunkReader:
+    """Exact-size reads over an async stream of arbitrarily sized chunks."""
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks.__aiter__()
+        self.buffer = bytearray()
+        self.eof = False
+    async def fill(self, n: int):
+        while len(self.buffer) < n and not self.eof:
+            try:
+                self.buffer += await self.chunks.__anext__()
+            except StopAsyncIteration:
+                self.eof = True
+    async def read_exact(self, n: int) -> bytes:
+        await self.fill(n)
+        if len(self.buffer) < n:
+            raise BundleError("Archive is truncated")
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+    async def iter_exact(self, n: int) -> AsyncIterator[bytes]:
+        """Yields exactly n bytes without holding more than one chunk."""
+        while n > 0:
+            await self.fill(1)
+            if not self.buffer:
+                raise BundleError("Archive is truncated")
+            take = min(n, len(self.buffer), CHUNK_SIZE)
+            data = bytes(self.buffer[:take])
+            del self.buffer[:take]
+            n -= take
+            yield data
+def parse_pax(data: bytes) -> Dict[str, str]:
+    records = {}
+    pos = 0
+    try:
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            length = int(data[pos:space])
+            key, _, value = data[space + 1:pos + length - 1].partition(b"=")
+            records[key.decode("utf-8")] = value.decode("utf-8")
+            pos += length
+    except ValueError as e:
+        raise BundleError(f"Corrupt pax header: {e}")
+    return records
+def safe_member_path(name: str) -> str:
+    path = PurePosixPath(name)
+    if path.is_absolute() or ".." in path.parts or not path.parts:
+        raise BundleError(f"Unsafe path in archive: {name}")
+    return path.as_posix()
+class BundleImporter:
+    """
+    Reads a bundle from an async byte stream in one pass. Images are stored
+    in the content-addressed asset store and copied into the project, so
+    blobs the store already holds are only hashed, never stored again.
+    stage() streams into a hidden directory without any lock; install()
+    then swaps it in under the project's locks.
+    """
+    def __init__(self, chunks: AsyncIterator[bytes], store: AssetStore = asset_store):
+        self.reader = ChunkReader(chunks)
+        self.store = store
+        self.manifest: Optional[Dict[str, Any]] = None
+        self.staging: Optional[Path] = None
+        self.stats = {"files": 0, "bytes": 0, "deduplicated": 0}
+    async def next_member(self) -> Optional[Tuple[str, int]]:
+        pax: Dict[str, str] = {}
+        while True:
+            header = await self.reader.read_exact(tarfile.BLOCKSIZE)
+            if header == b"\0" * tarfile.BLOCKSIZE:
+                return None
+            try:
+                info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+            except tarfile.TarError as e:
+                raise BundleError(f"Corrupt archive header: {e}")
+            if info.type in (tarfile.XHDTYPE, tarfile.XGLTYPE):
+                data = await self.reader.read_exact(info.size + len(tar_padding(info.size)))
+                if info.type == tarfile.XHDTYPE:
+                    pax.update(parse_pax(data[:info.size]))
+                continue
+            if not info.isfile():
+                raise BundleError(f"Unsupported archive member: {info.name}")
+            return pax.get("path", info.name), int(pax.get("size", info.size))
+    async def read_manifest(self) -> Dict[str, Any]:
+        member = await self.next_member()
+        if not member or member[0] != "manifest.json" or member[1] > MAX_MANIFEST_BYTES:
+            raise BundleError("Archive does not start with a manifest")
+        data = await self.reader.read_exact(member[1] + len(tar_padding(member[1])))
+        try:
+            manifest = json.loads(data[:member[1]].decode("utf-8"))
+        except ValueError as e:
+            raise BundleError(f"Invalid manifest: {e}")
+        if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+            raise BundleError("Unsupported bundle format")
+        self.manifest = manifest
+        return manifest
+    async def receive(self, size: int, expected: str, target: Optional[Path]) -> bool:
+        """
+        Hashes the next size bytes, writing them to target (or discarding
+        them when target is None). Returns False if the hash does not match.
+        """
+        h = hashlib.sha256()
+        f = open(target, "wb") if target else None
+        try:
+            async for chunk in self.reader.iter_exact(size):
+                h.update(chunk)
+                if f:
+                    f.write(chunk)
+        finally:
+            if f:
+                f.close()
+        await self.reader.read_exact(len(tar_padding(size)))
+        return h.hexdigest() == expected
+    async def stage(self, data_dir: Path, project_id: str, overwrite: bool = False) -> Path:
+        """
+        Receives and verifies the whole bundle into data_dir/.import-*.
+        Slow uploads happen here, so no lock is needed or held.
+        """
+        if self.manifest is None:
+            await self.read_manifest()
+        if not PROJECT_ID_PATTERN.fullmatch(project_id):
+            raise BundleError(f"Invalid project id: {project_id}")
+        target_dir = data_dir / project_id
+        if target_dir.exists() and not overwrite:
+            raise FileExistsError(f"Project '{project_id}' already exists")
+        expected = {f["path"]: f for f in self.manifest.get("files", [])}
+        staging = Path(tempfile.mkdtemp(dir=str(data_dir), prefix=".import-"))
+        received = set()
+        try:
+            while True:
+                member = await self.next_member()
+                if member is None:
+                    break
+                name, size = safe_member_path(member[0]), member[1]
+                entry = expected.get(name)
+                if entry is None or entry["size"] != size or name in received:
+                    raise BundleError(f"Archive member {name} does not match the manifest")
+                digest = entry["sha256"]
+                path = staging / name
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if name.startswith("images/"):
+                    # Known blobs are verified and dropped; new ones go into the store first.
+                    if self.store.has(digest):
+                        ok = await self.receive(size, digest, None)
+                        self.stats["deduplicated"] += 1
+                    else:
+                        self.store.root.mkdir(parents=True, exist_ok=True)
+                        fd, tmp_name = tempfile.mkstemp(dir=str(self.store.root), prefix=".tmp-")
+                        os.close(fd)
+                        try:
+                            ok = await self.receive(size, digest, Path(tmp_name))
+                            if ok:
+                                os.chmod(tmp_name, 0o644)
+                                self.store.path(digest).parent.mkdir(parents=True, exist_ok=True)
+                                os.replace(tmp_name, self.store.path(digest))
+                        finally:
+                            if os.path.exists(tmp_name):
+                                os.unlink(tmp_name)
+                    if ok:
+                        self.store.materialize(digest, path)
+                else:
+                    ok = await self.receive(size, digest, path)
+                if not ok:
+                    raise BundleError(f"Checksum mismatch for {name}")
+                received.add(name)
+                self.stats["files"] += 1
+                self.stats["bytes"] += size
+            missing = set(expected) - received
+            if missing:
+                raise BundleError(f"Archive is missing {sorted(missing)}")
+            if not (staging / "project.json").exists():
+                raise BundleError("Archive has no project.json")
+            if project_id != self.manifest.get("project_id"):
+                # Saves derive the directory from the title, so it has to follow the new id.
+                with open(staging / "project.json", "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                data["title"] = project_id.replace("_", " ")
+                atomic_write_json(staging / "project.json", data)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.staging = staging
+        return staging
+    def install(self, data_dir: Path, project_id: str, overwrite: bool = False, build_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """
+        Moves the staged project to data_dir/project_id and any bundled
+        build outputs to build_dir (next to project.json without one).
+        Replacing an existing project first drops all of its old builds:
+        build_dir's siblings (fragment, targets) belong to the replaced
+        content. The caller holds the project lock and the build lock.
+        """
+        staging = self.staging
+        if staging is None:
+            raise BundleError("Nothing staged")
+        target_dir = data_dir / project_id
+        try:
+            if target_dir.exists() and not overwrite:
+                raise FileExistsError(f"Project '{project_id}' already exists")
+            if build_dir and target_dir.exists():
+                shutil.rmtree(build_dir.parent, ignore_errors=True)
+            if build_dir:
+                build_dir.mkdir(parents=True, exist_ok=True)
+                for name in BUILD_FILES:
+                    if (staging / name).exists():
+                        os.replace(staging / name, build_dir / name)
+            if target_dir.exists():
+                old = data_dir / f".replaced-{project_id}-{os.getpid()}"
+                os.rename(target_dir, old)
+                os.rename(staging, target_dir)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(staging, target_dir)
+        finally:
+            self.discard()
+        return {"project_id": project_id, **self.stats}
+    def discard(self):
+        """Drops a staged import that was not installed."""
+        if self.staging and self.staging.exists():
+            shutil.rmtree(self.staging, ignore_errors=True)
+        self.staging = None
+    async def extract(self, data_dir: Path, project_id: str, overwrite: bool = False, build_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """stage() and install() in one go, for callers that need no locking."""
+        await self.stage(data_dir, project_id, overwrite)
+        return self.install(data_dir, project_id, overwrite, build_dir)
+async def file_chunks(path: Path) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield chunk
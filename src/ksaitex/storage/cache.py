@@ -0,0 +1,55 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+from ksaitex.config import CACHE_DIR
+from ksaitex.storage.files import atomic_write_bytes
+ARTIFACTS = ("main.pdf", "main.synctex.gz", "main.tex", "main.log", "diagnostics.json")
+class CompileCache:
+    """
+    Content-addressed compile output cache on shared storage. Entries are
+    directories named by the hash of the LaTeX source plus the project's
+    images, published with an atomic rename so every worker sees either a
+    complete entry or none.
+    """
+    def __init__(self, root: Path = CACHE_DIR / "compile"):
+        self.root = root
+    def key(self, latex: str, project_dir: Optional[Path] = None) -> str:
+        h = hashlib.sha256(latex.encode("utf-8"))
+        images_dir = project_dir / "images" if project_dir else None
+        if images_dir and images_dir.exists():
+            for image in sorted(images_dir.iterdir()):
+                stat = image.stat()
+                h.update(f"\0{image.name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        return h.hexdigest()
+    def lock_path(self, key: str) -> Path:
+        return self.root / f"{key}.lock"
+    def lookup(self, key: str) -> Optional[Path]:
+        entry = self.root / key
+        return entry if (entry / "main.pdf").exists() else None
+    def restore(self, key: str, target_dir: Path) -> Optional[bytes]:
+        """Copies a cached build into target_dir (so synctex works there) and returns the PDF bytes."""
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        os.utime(entry)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for name in ARTIFACTS:
+            if (entry / name).exists():
+                atomic_write_bytes(target_dir / name, (entry / name).read_bytes())
+        return (entry / "main.pdf").read_bytes()
+    def store(self, key: str, build_dir: Path):
+        if self.lookup(key):
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=str(self.root), prefix=".tmp-"))
+        try:
+            for name in ARTIFACTS:
+                if (build_dir / name).exists():
+                    shutil.copy2(build_dir / name, tmp_dir / name)
+            os.rename(tmp_dir, self.root / key)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+compile_cache = CompileCache()
@@ -0,0 +1,19 @@
+import os
+import json
+import tempfile
+from pathlib import Path
+from typing import Any
+def atomic_write_bytes(path: Path, data: bytes):
+    """Writes via a temp file in the same directory and os.replace, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+def atomic_write_json(path: Path, data: Any, indent: int = 4):
+    atomic_write_bytes(path, json.dumps(data, indent=indent).encode("utf-8"))
@@ -0,0 +1,70 @@
+import os
+import fcntl
+import asyncio
+from pathlib import Path
+from contextlib import contextmanager, asynccontextmanager, AsyncExitStack
+from ksaitex.config import LOCKS_DIR
+LOCK_POLL_MIN = 0.005
+LOCK_POLL_MAX = 0.05
+@asynccontextmanager
+async def file_lock(lock_path: Path):
+    """
+    Exclusive advisory lock usable from the event loop. Every acquisition
+    opens its own descriptor, so it also serialises coroutines of the same
+    worker, not only separate uvicorn processes. A held lock is polled with
+    backoff rather than waited on in a thread, so contention cannot use up
+    the default executor.
+    """
+    delay = LOCK_POLL_MIN
+    while True:
+        with try_file_lock(lock_path) as locked:
+            if locked:
+                yield
+                return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LOCK_POLL_MAX)
+def project_lock_path(project_id: str, scope: str = "project") -> Path:
+    # Lock files live outside data/<project>/ so rename and delete can hold them.
+    return LOCKS_DIR / f"{project_id}.{scope}.lock"
+def project_lock(project_id: str, scope: str = "project"):
+    return file_lock(project_lock_path(project_id, scope))
+def build_lock_path(project_id: str, build: str = "main") -> Path:
+    # Builds have their own scope: the project lock only covers project.json
+    # and the project directory, so saves never wait for a lualatex run.
+    return project_lock_path(project_id, f"build-{build}")
+def build_lock(project_id: str, build: str = "main"):
+    return file_lock(build_lock_path(project_id, build))
+@asynccontextmanager
+async def projects_lock(*project_ids: str):
+    """Locks several projects in a fixed order (used by rename) to avoid deadlocks."""
+    async with AsyncExitStack() as stack:
+        for project_id in sorted(set(project_ids)):
+            await stack.enter_async_context(project_lock(project_id))
+        yield
+@asynccontextmanager
+async def builds_lock(*project_ids: str):
+    """Main build locks of several projects, in the same fixed order."""
+    async with AsyncExitStack() as stack:
+        for project_id in sorted(set(project_ids)):
+            await stack.enter_async_context(build_lock(project_id))
+        yield
+@contextmanager
+def try_file_lock(lock_path: Path):
+    """
+    Non-blocking counterpart of file_lock for background maintenance: yields
+    False instead of waiting when someone else holds the lock.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(lock_path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
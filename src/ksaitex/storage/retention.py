@@ -0,0 +1,217 @@
+import os
+import time
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+from ksaitex.config import DATA_DIR, BUILDS_DIR, CACHE_DIR
+from ksaitex.storage.locks import try_file_lock, build_lock_path
+BUILD_NAMES = ("main", "fragment")
+# Multi-target builds get one directory per template, e.g. target-base_present.
+TARGET_PREFIX = "target-"
+LAST_USED_MARKER = ".last_used"
+LEASE_MARKER = ".lease"
+# Files the old layout left inside data/<project>/ and stray TeX runs left in data/.
+LEGACY_PROJECT_FILES = ("source_map.json", "diagnostics.json")
+# Still useful for sync and downloads, so they move into the main build instead of being deleted.
+LEGACY_MIGRATED_FILES = ("main.pdf", "main.synctex.gz", "source_map.json")
+LEGACY_SUFFIXES = (".aux", ".log", ".pdf", ".synctex.gz", ".toc", ".nav", ".snm", ".vrb", ".out", ".fls", ".fdb_latexmk")
+STALE_PREFIXES = (".tmp-", ".import-", ".replaced-", ".trash-")
+def build_dir(project_id: str, build: str = "main", builds_dir: Path = BUILDS_DIR) -> Path:
+    """Build outputs live in DATA_DIR/.builds/<project>/<build>, apart from user content."""
+    return builds_dir / project_id / build
+def is_build_name(name: str) -> bool:
+    return name in BUILD_NAMES or (name.startswith(TARGET_PREFIX) and len(name) > len(TARGET_PREFIX))
+def touch_build(path: Path):
+    """Records that a build is still in use (e.g. by synctex lookups), deferring its eviction."""
+    if path.is_dir():
+        (path / LAST_USED_MARKER).touch()
+def lease_project(project_id: str, builds_dir: Path = BUILDS_DIR):
+    """
+    Marks a project as open. Unlike the in-process session list this is
+    visible to every worker and to 'ksaitex gc'; it lapses after min_age.
+    """
+    path = builds_dir / project_id
+    path.mkdir(parents=True, exist_ok=True)
+    (path / LEASE_MARKER).touch()
+def tree_usage(path: Path) -> Dict[str, float]:
+    """Size and newest mtime of everything under path, without following symlinks (the images link)."""
+    size, newest = 0, 0.0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    if not newest:
+        try:
+            newest = path.stat().st_mtime
+        except FileNotFoundError:
+            pass
+    return {"size": size, "last_used": newest}
+def remove_path(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+class RetentionManager:
+    """
+    Keeps build artifacts (DATA_DIR/.builds and the compile cache) within a
+    per-project and a global size quota by evicting the least recently used
+    ones. Builds of projects that are open, or were used in the last
+    min_age seconds, are never evicted; anything another process holds the
+    lock of is skipped until the next run.
+    """
+    def __init__(self, data_dir: Path = DATA_DIR, builds_dir: Path = BUILDS_DIR, cache_root: Path = CACHE_DIR / "compile", global_quota: Optional[int] = None, project_quota: Optional[int] = None, min_age: Optional[float] = None):
+        self.data_dir = data_dir
+        self.builds_dir = builds_dir
+        self.cache_root = cache_root
+        self.global_quota = global_quota if global_quota is not None else int(os.environ.get("KSAITEX_BUILD_QUOTA_MB", "2048")) * 1024 * 1024
+        self.project_quota = project_quota if project_quota is not None else int(os.environ.get("KSAITEX_PROJECT_BUILD_QUOTA_MB", "256")) * 1024 * 1024
+        self.min_age = min_age if min_age is not None else float(os.environ.get("KSAITEX_GC_MIN_AGE", "900"))
+        self.last_report: Optional[Dict[str, Any]] = None
+    def artifacts(self) -> List[Dict[str, Any]]:
+        items = []
+        if self.builds_dir.is_dir():
+            for project in sorted(self.builds_dir.iterdir()):
+                if not project.is_dir() or project.name.startswith("."):
+                    continue
+                for build in project.iterdir():
+                    if build.is_dir() and is_build_name(build.name):
+                        items.append({"kind": "build", "project": project.name, "path": build, "lock": build_lock_path(project.name, build.name), **tree_usage(build)})
+        if self.cache_root.is_dir():
+            for entry in self.cache_root.iterdir():
+                if entry.is_dir() and not entry.name.startswith("."):
+                    items.append({"kind": "cache", "project": None, "path": entry, "lock": self.cache_root / f"{entry.name}.lock", **tree_usage(entry)})
+        return items
+    def leased(self, project: str, now: float) -> bool:
+        try:
+            return now - (self.builds_dir / project / LEASE_MARKER).stat().st_mtime < self.min_age
+        except FileNotFoundError:
+            return False
+    def evictable(self, item: Dict[str, Any], protected: Iterable[str], now: float) -> bool:
+        if item["kind"] == "build" and (item["project"] in protected or self.leased(item["project"], now)):
+            return False
+        return now - item["last_used"] >= self.min_age
+    def evict(self, item: Dict[str, Any], dry_run: bool) -> bool:
+        if dry_run:
+            return True
+        with try_file_lock(item["lock"]) as locked:
+            if not locked:
+                return False
+            # Renaming first means readers see the whole artifact or none of it.
+            trash = item["path"].parent / f".trash-{uuid.uuid4().hex[:8]}"
+            try:
+                os.rename(item["path"], trash)
+            except FileNotFoundError:
+                return False
+        shutil.rmtree(trash, ignore_errors=True)
+        return True
+    def clean_stale(self, now: float, dry_run: bool) -> int:
+        """Temporary directories left by interrupted cache stores, imports and evictions."""
+        freed = 0
+        for parent in (self.data_dir, self.builds_dir, self.cache_root, *(p for p in self.builds_dir.glob("*") if p.is_dir())):
+            if not parent.is_dir():
+                continue
+            for entry in parent.iterdir():
+                if entry.name.startswith(STALE_PREFIXES) and now - entry.lstat().st_mtime >= self.min_age:
+                    freed += tree_usage(entry)["size"] if entry.is_dir() else entry.lstat().st_size
+                    if not dry_run:
+                        remove_path(entry)
+        # Lock files of cache entries that are gone; a lock someone holds is left alone.
+        if self.cache_root.is_dir():
+            for lock in self.cache_root.glob("*.lock"):
+                if not (self.cache_root / lock.stem).exists() and now - lock.stat().st_mtime >= self.min_age and not dry_run:
+                    with try_file_lock(lock) as locked:
+                        if locked:
+                            lock.unlink(missing_ok=True)
+        return freed
+    def clean_legacy(self, dry_run: bool = False) -> Tuple[List[Path], List[Path]]:
+        """
+        Tidies what the old layout wrote next to user content. The last PDF,
+        synctex and source map of a project move into its main build (unless
+        a newer build is already there); the other outputs are removed, and
+        at the data root only when the .tex they were built from is present.
+        Returns (removed, migrated).
+        """
+        removed, migrated = [], []
+        if not self.data_dir.is_dir():
+            return removed, migrated
+        for entry in self.data_dir.iterdir():
+            if entry.name.startswith("."):
+                continue
+            if entry.is_file():
+                stem = entry.name.split(".", 1)[0]
+                has_source = (self.data_dir / f"{stem}.tex").exists()
+                is_output = entry.name.endswith(LEGACY_SUFFIXES) and has_source
+                # A .tex at the root only counts as an artifact if it was actually compiled there.
+                compiled_tex = entry.suffix == ".tex" and any((self.data_dir / f"{stem}{s}").exists() for s in (".aux", ".log"))
+                if is_output or compiled_tex:
+                    removed.append(entry)
+            elif (entry / "project.json").exists():
+                main_build = build_dir(entry.name, "main", self.builds_dir)
+                for child in entry.iterdir():
+                    if child.name == "fragment" and child.is_dir():
+                        removed.append(child)
+                    elif child.is_file() and child.name in LEGACY_MIGRATED_FILES and not (main_build / child.name).exists():
+                        migrated.append(child)
+                    elif child.is_file() and (child.name in LEGACY_PROJECT_FILES or child.name.startswith("main.")):
+                        removed.append(child)
+        if not dry_run:
+            for path in migrated:
+                target = build_dir(path.parent.name, "main", self.builds_dir)
+                target.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target / path.name)
+            for path in removed:
+                remove_path(path)
+        return removed, migrated
+    def run(self, protected: Iterable[str] = (), dry_run: bool = False, legacy: bool = False) -> Dict[str, Any]:
+        now = time.time()
+        protected = set(protected)
+        report = {"evicted": [], "freed": 0, "skipped_busy": 0, "legacy_removed": 0, "legacy_migrated": 0, "dry_run": dry_run}
+        if legacy:
+            removed, migrated = self.clean_legacy(dry_run)
+            report["legacy_removed"] = len(removed)
+            report["legacy_migrated"] = len(migrated)
+        report["freed"] += self.clean_stale(now, dry_run)
+        items = self.artifacts()
+        evicted = set()
+        def drop(item, reason):
+            if self.evict(item, dry_run):
+                evicted.add(item["path"])
+                report["freed"] += item["size"]
+                report["evicted"].append({"path": str(item["path"].relative_to(self.data_dir) if item["path"].is_relative_to(self.data_dir) else item["path"]), "size": item["size"], "reason": reason})
+                return True
+            report["skipped_busy"] += 1
+            return False
+        by_project: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            if item["kind"] == "build":
+                by_project.setdefault(item["project"], []).append(item)
+        for project, builds in by_project.items():
+            total = sum(b["size"] for b in builds)
+            # Fragment and target builds go first: they are never needed for sync.
+            for item in sorted(builds, key=lambda b: (b["path"].name == "main", b["last_used"])):
+                if total <= self.project_quota:
+                    break
+                if self.evictable(item, protected, now) and drop(item, "project_quota"):
+                    total -= item["size"]
+        remaining = [i for i in items if i["path"] not in evicted]
+        total = sum(i["size"] for i in remaining)
+        for item in sorted(remaining, key=lambda i: i["last_used"]):
+            if total <= self.global_quota:
+                break
+            if self.evictable(item, protected, now) and drop(item, "global_quota"):
+                total -= item["size"]
+        report["total"] = total
+        report["finished"] = now
+        self.last_report = report
+        return report
+retention_manager = RetentionManager()
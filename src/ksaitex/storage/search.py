@@ -0,0 +1,198 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import unicodedata
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from ksaitex.config import DATA_DIR, INDEX_DIR
+from ksaitex.parsing.magic import MAGIC_MARKER
+# Joiners and soft hyphens change rendering, not the word, so they are dropped before tokenizing.
+IGNORED_CHARS = re.compile("[\u200c\u200d\u00ad]")
+SNIPPET_RADIUS = 60
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, digest TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS lines (project INTEGER NOT NULL, line INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (project, line)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, project INTEGER NOT NULL, line INTEGER NOT NULL, PRIMARY KEY (term, project, line)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_project ON postings (project);
+"""
+@lru_cache(maxsize=1)
+def token_pattern() -> "re.Pattern":
+    """
+    Runs of letters, digits and combining marks. \\w alone leaves out the
+    Mn/Mc marks (matras, virama, anusvara), which would split every
+    Devanagari word after its first akshara.
+    """
+    ranges = []
+    start = None
+    # Beyond plane 1 the only marks are the variation selectors supplement.
+    for cp in list(range(0x20000)) + list(range(0xE0100, 0xE01F1)):
+        is_mark = unicodedata.category(chr(cp))[0] == "M"
+        if is_mark and start is None:
+            start = cp
+        elif not is_mark and start is not None:
+            ranges.append(f"\\U{start:08x}-\\U{cp - 1:08x}")
+            start = None
+    return re.compile(r"(?:[^\W_]|[" + "".join(ranges) + r"])+")
+def normalize(text: str) -> str:
+    return IGNORED_CHARS.sub("", unicodedata.normalize("NFC", text)).casefold()
+def tokenize(text: str) -> List[str]:
+    return token_pattern().findall(normalize(text))
+def display_line(line: str) -> str:
+    """Source line as shown in results: NFC, with magic markers reduced to their argument values."""
+    def replace(m: "re.Match") -> str:
+        values = [pair.split("=", 1)[1].strip() for pair in (m.group(2) or "").split(";") if "=" in pair]
+        return " ".join(v for v in values if v)
+    return unicodedata.normalize("NFC", MAGIC_MARKER.sub(replace, line)).strip()
+def make_snippet(text: str, terms: List[str]) -> str:
+    lowered = normalize(text)
+    # Casefolding can change lengths (e.g. German sharp s); fall back to the line start then.
+    aligned = len(lowered) == len(text)
+    pos = min((p for p in (lowered.find(t) for t in terms) if p >= 0), default=0) if aligned else 0
+    start = max(pos - SNIPPET_RADIUS, 0)
+    end = min(pos + SNIPPET_RADIUS, len(text))
+    return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+def project_files(data_dir: Path) -> List[Path]:
+    """project.json of every project; dot-directories (.import-*, .replaced-*, .builds) are not projects."""
+    return sorted(p for p in data_dir.glob("*/project.json") if not p.parent.name.startswith("."))
+class SearchIndex:
+    """
+    Inverted index (term -> project, markdown line) over every project's
+    markdown, kept in SQLite so all server processes and the CLI share it.
+    Projects are re-indexed on save when their markdown hash changes.
+    """
+    def __init__(self, path: Path = INDEX_DIR / "search.sqlite3"):
+        self.path = path
+        self._ready = False
+    def connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._ready:
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+    def index_project(self, name: str, markdown: str, conn: Optional[sqlite3.Connection] = None) -> bool:
+        """
+        (Re)indexes one project. Returns False when its markdown is unchanged
+        since the last run. With conn, the caller owns the transaction.
+        """
+        if conn is None:
+            with closing(self.connect()) as db, db:
+                return self.index_project(name, markdown, conn=db)
+        digest = hashlib.sha1(markdown.encode("utf-8")).hexdigest()
+        row = conn.execute("SELECT id, digest FROM projects WHERE name = ?", (name,)).fetchone()
+        if row and row[1] == digest:
+            return False
+        if row:
+            project = row[0]
+            conn.execute("DELETE FROM postings WHERE project = ?", (project,))
+            conn.execute("DELETE FROM lines WHERE project = ?", (project,))
+            conn.execute("UPDATE projects SET digest = ? WHERE id = ?", (digest, project))
+        else:
+            project = conn.execute("INSERT INTO projects (name, digest) VALUES (?, ?)", (name, digest)).lastrowid
+        lines, postings = [], []
+        for line_no, line in enumerate(markdown.split("\n"), 1):
+            text = display_line(line)
+            terms = set(tokenize(text))
+            if not terms:
+                continue
+            lines.append((project, line_no, text))
+            postings.extend((term, project, line_no) for term in terms)
+        conn.executemany("INSERT INTO lines (project, line, text) VALUES (?, ?, ?)", lines)
+        conn.executemany("INSERT INTO postings (term, project, line) VALUES (?, ?, ?)", postings)
+        return True
+    def remove_project(self, name: str):
+        with closing(self.connect()) as db, db:
+            row = db.execute("SELECT id FROM projects WHERE name = ?", (name,)).fetchone()
+            if row:
+                db.execute("DELETE FROM postings WHERE project = ?", (row[0],))
+                db.execute("DELETE FROM lines WHERE project = ?", (row[0],))
+                db.execute("DELETE FROM projects WHERE id = ?", (row[0],))
+    def rename_project(self, old_name: str, new_name: str):
+        if old_name == new_name:
+            return
+        self.remove_project(new_name)
+        with closing(self.connect()) as db, db:
+            db.execute("UPDATE projects SET name = ? WHERE name = ?", (new_name, old_name))
+    def is_stale(self, data_dir: Path = DATA_DIR) -> bool:
+        """
+        True when the index is missing, or projects were added, removed or
+        edited (e.g. by copying data in) since it was last written.
+        """
+        stamps = [p.stat().st_mtime for p in (self.path, Path(f"{self.path}-wal")) if p.exists()]
+        if not stamps:
+            return True
+        indexed_at = max(stamps)
+        names = set()
+        for project_file in project_files(data_dir):
+            names.add(project_file.parent.name)
+            if project_file.stat().st_mtime > indexed_at:
+                return True
+        with closing(self.connect()) as db:
+            return names != {name for (name,) in db.execute("SELECT name FROM projects")}
+    def rebuild(self, data_dir: Path = DATA_DIR, progress=None) -> Dict[str, int]:
+        """Indexes every project under data_dir and drops entries for projects that no longer exist."""
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        seen = set()
+        # One transaction for the whole pass: per-project commits dominate otherwise.
+        with closing(self.connect()) as db, db:
+            for project_file in project_files(data_dir):
+                name = project_file.parent.name
+                seen.add(name)
+                try:
+                    with open(project_file, "r", encoding="utf-8") as f:
+                        markdown = json.load(f).get("markdown") or ""
+                    changed = self.index_project(name, markdown, conn=db)
+                except (OSError, ValueError) as e:
+                    print(f"DEBUG: Could not index '{name}': {e}")
+                    stats["failed"] += 1
+                    continue
+                stats["indexed" if changed else "unchanged"] += 1
+                if progress:
+                    progress(name, changed)
+            stale = [name for (name,) in db.execute("SELECT name FROM projects") if name not in seen]
+        for name in stale:
+            self.remove_project(name)
+        stats["removed"] = len(stale)
+        return stats
+    def candidates(self, db: sqlite3.Connection, exact: List[str], prefix: Optional[str]) -> Iterable[Tuple[str, int, str]]:
+        """(project, line, text) rows containing every exact term, driven by the rarest one, in result order."""
+        order = " ORDER BY p.name, l.line"
+        join = "SELECT p.name, l.line, l.text FROM postings h JOIN lines l ON l.project = h.project AND l.line = h.line JOIN projects p ON p.id = h.project"
+        if not exact:
+            return db.execute(join + " WHERE h.term >= ? AND h.term < ?" + order, (prefix, prefix + "\U0010ffff"))
+        counts = {t: db.execute("SELECT COUNT(*) FROM (SELECT 1 FROM postings WHERE term = ? LIMIT 10000)", (t,)).fetchone()[0] for t in exact}
+        rarest = min(exact, key=counts.get)
+        if counts[rarest] == 0:
+            return []
+        others = [t for t in exact if t != rarest]
+        where = " WHERE h.term = ?" + "".join(" AND EXISTS (SELECT 1 FROM postings o WHERE o.term = ? AND o.project = h.project AND o.line = h.line)" for _ in others)
+        return db.execute(join + where + order, [rarest] + others)
+    def search(self, query: str, limit: int = 50) -> Dict[str, Any]:
+        """
+        Lines containing every query term. A trailing '*' makes the last term
+        a prefix match (for search-as-you-type).
+        """
+        started = time.perf_counter()
+        terms = list(dict.fromkeys(tokenize(query)))
+        prefix = terms.pop() if terms and query.rstrip().endswith("*") else None
+        results = []
+        if terms or prefix:
+            seen = set()
+            with closing(self.connect()) as db:
+                for name, line, text in self.candidates(db, terms, prefix):
+                    if (name, line) in seen:
+                        continue
+                    seen.add((name, line))
+                    if prefix and terms and not any(t.startswith(prefix) for t in tokenize(text)):
+                        continue
+                    results.append({"project_id": name, "line": line, "snippet": make_snippet(text, terms + ([prefix] if prefix else []))})
+                    if len(results) >= limit:
+                        break
+        return {"query": query, "terms": terms + ([prefix + "*"] if prefix else []), "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
+search_index = SearchIndex()
@@ -1,12 +1,49 @@
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, TemplateNotFound, select_autoescape
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 TEMPLATE_DIR = Path(__file__).parent / "latex"
+import os
 import re
+def clean_template_source(template_text: str) -> str:
+    """Strips the metadata comments and reduces \\VAR{ name, ... } to \\VAR{name}."""
+    filtered_lines = []
+    for line in template_text.splitlines():
+        s = line.strip()
+        if s.startswith("%") and ("\\VAR{" in s or "\\MAGIC{" in s) and "," in s:
+            continue
+        filtered_lines.append(line)
+    clean_text = "\n".join(filtered_lines)
+    def strip_meta(match):
+        inner = match.group(1)
+        parts = inner.split(',', 1)
+        var_name = parts[0].strip()
+        return f"\\VAR{{{var_name}}}"
+    clean_content = re.sub(r"\\VAR\{\s*(.+?)\s*\}", strip_meta, clean_text)
+    return re.sub(r"\\MAGIC\{\s*?(.+?)\s*?\}", "", clean_content)
+class MetadataStrippingLoader(FileSystemLoader):
+    """Loads templates with the \\VAR/\\MAGIC metadata already stripped, so they go through Jinja's normal (bytecode cached) loading."""
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return clean_template_source(source), filename, uptodate
+def default_bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    """
+    Persistent compiled-template cache in the user cache dir
+    ($XDG_CACHE_HOME/ksaitex/jinja), never relative to the working directory,
+    so the CLI does not leave a data/ tree behind. Skipped if it cannot be created.
+    """
+    xdg_cache = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    cache_dir = Path(os.environ.get("KSAITEX_JINJA_CACHE_DIR") or Path(xdg_cache) / "ksaitex" / "jinja").expanduser()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(str(cache_dir))
 class TemplateEngine:
-    def __init__(self):
+    def __init__(self, template_dir: Path = TEMPLATE_DIR, bytecode_cache: Optional[FileSystemBytecodeCache] = None):
+        self.template_dir = template_dir
         self.env = Environment(
-            loader=FileSystemLoader(TEMPLATE_DIR),
+            loader=MetadataStrippingLoader(template_dir),
+            bytecode_cache=bytecode_cache if bytecode_cache is not None else default_bytecode_cache(),
             variable_start_string="\\VAR{",
             variable_end_string="}",
             block_start_string="\\BLOCK{",
@@ -23,7 +60,7 @@ class TemplateEngine:
         Returns a dictionary with 'variables' and 'magic_commands'.
         Only considers lines starting with '%' (LaTeX comments).
         """
-        template_path = TEMPLATE_DIR / template_name
+        template_path = self.template_dir / template_name
         if not template_path.exists():
             return {"variables": {}, "magic_commands": []}
         with open(template_path, "r", encoding="utf-8") as f:
@@ -76,9 +113,14 @@ class TemplateEngine:
     def get_variables(self, template_name: str) -> Dict[str, Any]:
         """Legacy support for variables only."""
         return self.get_metadata(template_name)["variables"]
-def render_latex(content: str, config: Dict[str, Any], template_name: str = "base.tex") -> str:
-    engine = TemplateEngine()
-    template_vars = engine.get_variables(template_name)
+def render_latex(content: str, config: Dict[str, Any], template_name: str = "base.tex") -> Tuple[str, int]:
+    """Returns (latex, offset), offset being the template line the content starts on."""
+    from ksaitex.templating.registry import get_registry
+    entry = get_registry().get(template_name)
+    if entry is None:
+        raise TemplateNotFound(template_name)
+    metadata = entry.metadata
+    template_vars = metadata["variables"]
     flat_defaults = { k: v["default"] for k, v in template_vars.items() }
     context = flat_defaults
     context.update({
@@ -87,7 +129,6 @@ def render_latex(content: str, config: Dict[str, Any], template_name: str = "bas
     })
     clean_config = { k: v for k, v in config.items() if v is not None and str(v).strip() != "" }
     context.update(clean_config)
-    metadata = engine.get_metadata(template_name)
     magic_commands = metadata.get("magic_commands", [])
     paired_groups = {}
     for m_cmd in magic_commands:
@@ -128,15 +169,9 @@ def render_latex(content: str, config: Dict[str, Any], template_name: str = "bas
                         k, v = pair.split('=', 1)
                         provided_args[k.strip()] = v.strip().replace(r'\n', '\n')
             final_cmd = cmd['command']
-            if 'args' in cmd:
-                schema_items = cmd['args'].split('|')
-                for item in schema_items:
-                    parts = item.split(':')
-                    if len(parts) >= 1:
-                        var_name = parts[0].strip()
-                        default_val = parts[2].strip() if len(parts) >= 3 else ""
-                        val_to_use = provided_args.get(var_name, default_val)
-                        final_cmd = final_cmd.replace(f"VAR_{var_name}", val_to_use)
+            for arg in cmd['arg_schema']:
+                val_to_use = provided_args.get(arg['name'], arg['default'])
+                final_cmd = final_cmd.replace(f"VAR_{arg['name']}", val_to_use)
             return final_cmd
         if pattern.search(context["content"]):
             print(f"Processing magic command: {label}")
@@ -152,26 +187,7 @@ def render_latex(content: str, config: Dict[str, Any], template_name: str = "bas
         end_label = labels.get('end')
         if begin_label and end_label:
             pass
-    template_path = TEMPLATE_DIR / template_name
-    if not template_path.exists():
-        return ""
-    with open(template_path, "r", encoding="utf-8") as f:
-        template_text = f.read()
-    filtered_lines = []
-    for line in template_text.splitlines():
-        s = line.strip()
-        if s.startswith("%") and ("\\VAR{" in s or "\\MAGIC{" in s) and "," in s:
-            continue
-        filtered_lines.append(line)
-    clean_text = "\n".join(filtered_lines)
-    def strip_meta(match):
-        inner = match.group(1)
-        parts = inner.split(',', 1)
-        var_name = parts[0].strip()
-        return f"\\VAR{{{var_name}}}"
-    clean_content = re.sub(r"\\VAR\{\s*(.+?)\s*\}", strip_meta, clean_text)
-    clean_content = re.sub(r"\\MAGIC\{\s*?(.+?)\s*?\}", "", clean_content)
-    template = engine.env.from_string(clean_content)
+    template = entry.template
     marker = "%%%CONTENT_MARKER%%%"
     offset_context = context.copy()
     offset_context["content"] = marker
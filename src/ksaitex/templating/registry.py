@@ -0,0 +1,155 @@
+import json
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, field_validator
+from ksaitex.templating.engine import TEMPLATE_DIR, TemplateEngine
+ARG_TYPES = {"text", "select", "number", "image"}
+class TemplateArg(BaseModel):
+    name: str
+    type: str = "text"
+    options: List[str] = []
+    default: str = ""
+    @field_validator("type")
+    @classmethod
+    def known_type(cls, v: str) -> str:
+        if v not in ARG_TYPES:
+            raise ValueError(f"Unknown argument type '{v}'")
+        return v
+class TemplateVariable(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    name: str
+    default: str = ""
+    tab: str = "General"
+    label: str = ""
+    type: str = "text"
+    options: List[str] = []
+class MagicCommand(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    name: str
+    label: str
+    command: str = ""
+    pairing: Optional[str] = None
+    group: Optional[str] = None
+    arg_schema: List[TemplateArg] = []
+    @field_validator("pairing")
+    @classmethod
+    def known_pairing(cls, v: Optional[str]) -> Optional[str]:
+        if v not in (None, "begin", "end"):
+            raise ValueError(f"Unknown pairing '{v}'")
+        return v
+class TemplateSchema(BaseModel):
+    name: str
+    variables: Dict[str, TemplateVariable]
+    magic_commands: List[MagicCommand]
+    errors: List[str] = []
+def parse_args_schema(args: str, strict: bool = True) -> List[TemplateArg]:
+    """
+    Parses the compact MAGIC args string, e.g.
+    'title:text:नयाँ खण्ड|align:select,Center,Left,Right:Center',
+    into structured arguments. With strict=False unknown types fall back
+    to text instead of raising.
+    """
+    result = []
+    for item in args.split('|'):
+        if not item.strip():
+            continue
+        parts = item.split(':', 2)
+        name = parts[0].strip()
+        type_spec = parts[1].strip() if len(parts) >= 2 else "text"
+        default = parts[2].strip() if len(parts) >= 3 else ""
+        type_parts = [p.strip() for p in type_spec.split(',')]
+        if not strict and type_parts[0] not in ARG_TYPES:
+            type_parts[0] = "text"
+        result.append(TemplateArg(name=name, type=type_parts[0] or "text", options=[o for o in type_parts[1:] if o], default=default))
+    return result
+class TemplateEntry:
+    def __init__(self, path: Path, engine: TemplateEngine):
+        stat = path.stat()
+        self.name = path.stem
+        self.filename = path.name
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        metadata = engine.get_metadata(path.name)
+        # Invalid metadata is reported, not fatal: the template must stay renderable.
+        errors = []
+        for cmd in metadata["magic_commands"]:
+            try:
+                cmd["arg_schema"] = parse_args_schema(cmd.get("args", ""))
+            except ValueError as e:
+                errors.append(f"{cmd.get('name')}: {e}")
+                cmd["arg_schema"] = parse_args_schema(cmd.get("args", ""), strict=False)
+            if cmd.get("pairing") not in (None, "begin", "end"):
+                errors.append(f"{cmd.get('name')}: Unknown pairing '{cmd['pairing']}'")
+                cmd["pairing"] = None
+        for error in errors:
+            print(f"Warning: template {path.name}: {error}")
+        self.schema = TemplateSchema(name=self.name, errors=errors, **metadata)
+        self.metadata = self.schema.model_dump()
+        self.template = engine.env.get_template(path.name)
+class TemplateRegistry:
+    """
+    Parses every template in TEMPLATE_DIR once and serves the metadata from
+    memory. refresh() only re-parses files whose mtime or size changed.
+    """
+    def __init__(self, template_dir: Path = TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self.engine = TemplateEngine(template_dir)
+        self.entries: Dict[str, TemplateEntry] = {}
+        self.etag = ""
+        self._payload: Dict[str, Any] = {}
+    def refresh(self) -> List[str]:
+        """Reloads changed templates, drops deleted ones. Returns the names that changed."""
+        changed = []
+        seen = set()
+        if self.template_dir.exists():
+            for path in sorted(self.template_dir.glob("*.tex")):
+                seen.add(path.name)
+                entry = self.entries.get(path.name)
+                stat = path.stat()
+                if entry and entry.signature == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                try:
+                    self.entries[path.name] = TemplateEntry(path, self.engine)
+                    changed.append(path.stem)
+                except Exception as e:
+                    print(f"Warning: could not load template {path.name}: {e}")
+        for filename in list(self.entries):
+            if filename not in seen:
+                del self.entries[filename]
+                changed.append(Path(filename).stem)
+        if changed or not self.etag:
+            self._payload = {"templates": {e.name: e.metadata for e in self.entries.values()}}
+            body = json.dumps(self._payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+            self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        if changed:
+            print(f"DEBUG: Template registry reloaded: {changed}")
+        return changed
+    def get(self, template_name: str) -> Optional[TemplateEntry]:
+        if template_name not in self.entries:
+            self.refresh()
+        return self.entries.get(template_name)
+    def get_metadata(self, template_name: str) -> Dict[str, Any]:
+        entry = self.get(template_name)
+        if entry is None:
+            return {"variables": {}, "magic_commands": []}
+        return entry.metadata
+    def payload(self) -> Tuple[Dict[str, Any], str]:
+        if not self.etag:
+            self.refresh()
+        return self._payload, self.etag
+    async def watch(self, interval: float = 2.0):
+        """Polls the template directory and reloads changed templates until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Warning: template refresh failed: {e}")
+_registry: Optional[TemplateRegistry] = None
+def get_registry() -> TemplateRegistry:
+    global _registry
+    if _registry is None:
+        _registry = TemplateRegistry()
+        _registry.refresh()
+    return _registry
@@ -0,0 +1,4 @@
+import os
+import tempfile
+# Point the app at a throwaway data root before anything imports ksaitex.config.
+os.environ["KSAITEX_DATA_DIR"] = tempfile.mkdtemp(prefix="ksaitex-test-")
@@ -0,0 +1,213 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from ksaitex.api.main import app
+from ksaitex.config import DATA_DIR
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+def make_project(project_id, **fields):
+    data = {"title": project_id, "markdown": "# Title\n\nText", "html": "<p>Text</p>", "template": "base", "variables": {}, **fields}
+    (DATA_DIR / project_id).mkdir(parents=True, exist_ok=True)
+    (DATA_DIR / project_id / "project.json").write_text(json.dumps(data), encoding="utf-8")
+    return data
+
+def test_project_files_serves_only_images(client):
+    make_project("Gallery")
+    (DATA_DIR / "Gallery" / "images").mkdir()
+    (DATA_DIR / "Gallery" / "images" / "a.png").write_bytes(b"png")
+    (DATA_DIR / ".index").mkdir(exist_ok=True)
+    (DATA_DIR / ".index" / "search.db").write_bytes(b"secret")
+    assert client.get("/project_files/Gallery/images/a.png").content == b"png"
+    assert client.get("/project_files/Gallery/project.json").status_code == 404
+    assert client.get("/project_files/.index/search.db").status_code == 404
+    assert client.get("/project_files/Gallery/images/../project.json").status_code == 404
+
+def test_fragment_diagnostics_follow_the_fragment(client, monkeypatch):
+    from ksaitex.api import main
+    async def fake_compile(latex, working_dir, limits=None):
+        tex_line = next(i for i, l in enumerate(latex.splitlines(), 1) if "Wide paragraph" in l)
+        log = f"Overfull \\hbox (1.0pt too wide) in paragraph at lines {tex_line}--{tex_line}\n"
+        (working_dir / "main.tex").write_text(latex, encoding="utf-8")
+        (working_dir / "main.log").write_text(log, encoding="utf-8")
+        (working_dir / "main.pdf").write_bytes(b"%PDF")
+        return b"%PDF", log
+    monkeypatch.setattr(main, "compile_with_farm", fake_compile)
+    def md_lines(markdown, line):
+        r = client.post("/api/compile/fragment", json={"markdown": markdown, "start_line": line, "end_line": line, "title": "Frag"})
+        assert r.status_code == 200
+        return [d["md_line"] for d in client.get("/api/projects/Frag/diagnostics?build=fragment").json()["diagnostics"]]
+    assert md_lines("A\n\nWide paragraph\n", 3) == [3]
+    # Same fragment further down: served from the in-memory cache.
+    assert md_lines("A\n\nB\n\nC\n\nWide paragraph\n", 7) == [7]
+    # And from the shared compile cache.
+    main.fragment_cache.clear()
+    assert md_lines("A\n\nB\n\nWide paragraph\n", 5) == [5]
+
+def test_cached_build_diagnostics_follow_the_markdown(client, monkeypatch):
+    import asyncio
+    from ksaitex.api import main
+    compiles = []
+    async def fake_compile(latex, working_dir, limits=None):
+        compiles.append(latex)
+        tex_line = next(i for i, l in enumerate(latex.splitlines(), 1) if "Wide paragraph" in l)
+        log = f"Overfull \\hbox (1.0pt too wide) in paragraph at lines {tex_line}--{tex_line}\n"
+        (working_dir / "main.tex").write_text(latex, encoding="utf-8")
+        (working_dir / "main.log").write_text(log, encoding="utf-8")
+        (working_dir / "main.pdf").write_bytes(b"%PDF")
+        return b"%PDF", log
+    monkeypatch.setattr(main, "compile_with_farm", fake_compile)
+    make_project("Cached")
+    def md_lines(markdown):
+        pdf_bytes, diagnostics, log = asyncio.run(main.compile_project("Cached", markdown, "base", {}))
+        assert pdf_bytes == b"%PDF" and "Overfull" in log
+        return [d["md_line"] for d in diagnostics]
+    assert md_lines("A\n\nWide paragraph\n") == [3]
+    # Extra blank lines render the same LaTeX: a cache hit, mapped to the new line.
+    assert md_lines("A\n\n\n\nWide paragraph\n") == [5]
+    assert len(compiles) == 1
+
+def test_get_project_fields(client):
+    data = make_project("Fields", variables={"author": "x"})
+    assert client.get("/api/projects/Fields").json() == data
+    assert client.get("/api/projects/Fields?fields=title,template").json() == {"title": "Fields", "template": "base"}
+    assert client.get("/api/projects/Fields?fields=title,secret").status_code == 400
+    assert client.get("/api/projects/Missing?fields=title").status_code == 404
+
+def test_project_field_resources(client):
+    make_project("Sub", markdown="# हेडिङ", variables={"author": "x"})
+    r = client.get("/api/projects/Sub/markdown")
+    assert r.text == "# हेडिङ" and r.headers["content-type"].startswith("text/markdown")
+    assert client.get("/api/projects/Sub/html").headers["content-type"].startswith("text/html")
+    assert client.get("/api/projects/Sub/variables").json() == {"author": "x"}
+    assert client.get("/api/projects/Sub/title").status_code == 404
+
+def test_patch_updates_only_given_fields(client):
+    make_project("Patched", markdown="old", html="<p>old</p>")
+    r = client.patch("/api/projects/Patched", json={"markdown": "new"})
+    assert r.json() == {"status": "success", "updated": ["markdown"]}
+    data = client.get("/api/projects/Patched").json()
+    assert data["markdown"] == "new" and data["html"] == "<p>old</p>" and data["title"] == "Patched"
+    assert client.patch("/api/projects/Missing", json={"markdown": "x"}).status_code == 404
+
+def compressed_app(size):
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+    from ksaitex.api.compression import CompressionMiddleware
+    app = Starlette(routes=[Route("/", lambda request: PlainTextResponse("a" * size))])
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+def test_compression_threshold_and_gzip():
+    small = compressed_app(100).get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    large = compressed_app(5000).get("/", headers={"Accept-Encoding": "gzip"})
+    assert large.headers["content-encoding"] == "gzip" and large.text == "a" * 5000
+
+def test_compression_respects_q_values(monkeypatch):
+    from ksaitex.api import compression
+    class FakeBrotli:
+        class Compressor:
+            def __init__(self, quality):
+                pass
+            def process(self, body):
+                return b"br:" + body
+            def flush(self):
+                return b""
+            def finish(self):
+                return b""
+    monkeypatch.setattr(compression, "brotli", FakeBrotli)
+    client = compressed_app(5000)
+    assert client.get("/", headers={"Accept-Encoding": "br, gzip"}).headers["content-encoding"] == "br"
+    assert client.get("/", headers={"Accept-Encoding": "br;q=0, gzip"}).headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in client.get("/", headers={"Accept-Encoding": "br;q=0, gzip;q=0"}).headers
+    assert compression.accepted_encodings("gzip;q=0.5, br;q=0") == {"gzip": 0.5, "br": 0.0}
+
+def test_session_save_keeps_concurrent_patch(client):
+    make_project("Shared", markdown="abc")
+    with client.websocket_connect("/ws/projects/Shared") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_text("not json")
+        assert ws.receive_json() == {"type": "error", "detail": "Malformed message"}
+        ws.send_json({"type": "edit", "base_version": 0, "field": "markdown", "ops": [{"offset": 3, "insert": "d"}]})
+        assert ws.receive_json()["type"] == "ack"
+        assert client.patch("/api/projects/Shared", json={"html": "<p>patched</p>"}).status_code == 200
+        ws.send_json({"type": "save"})
+        assert ws.receive_json()["type"] == "saved"
+        assert client.patch("/api/projects/Shared", json={"markdown": "elsewhere"}).status_code == 200
+        ws.send_json({"type": "edit", "base_version": 1, "field": "markdown", "ops": [{"offset": 0, "insert": "x"}]})
+        assert ws.receive_json()["type"] == "ack"
+        ws.send_json({"type": "save"})
+        assert ws.receive_json()["type"] == "save_conflict"
+    data = json.loads((DATA_DIR / "Shared" / "project.json").read_text(encoding="utf-8"))
+    assert data["markdown"] == "elsewhere" and data["html"] == "<p>patched</p>"
+
+def test_session_compile_does_not_block_edits(client, monkeypatch):
+    import asyncio
+    from ksaitex.api import main
+    async def slow_compile(project_id, markdown, template, variables):
+        await asyncio.sleep(0.3)
+        return b"%PDF", [], ""
+    monkeypatch.setattr(main, "compile_foreground", slow_compile)
+    make_project("Busy", markdown="abc")
+    with client.websocket_connect("/ws/projects/Busy") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "compile"})
+        ws.send_json({"type": "edit", "base_version": 0, "field": "markdown", "ops": [{"offset": 3, "insert": "d"}]})
+        assert ws.receive_json() == {"type": "ack", "version": 1}
+        reply = ws.receive_json()
+        assert reply["type"] == "compiled" and reply["version"] == 0
+        ws.send_json({"type": "save"})
+        assert ws.receive_json()["type"] == "saved"
+
+def test_session_outline_sends_only_the_version(client):
+    make_project("Outlined", markdown="# One\n\ntext")
+    with client.websocket_connect("/ws/projects/Outlined") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "outline", "template": "base"})
+        first = ws.receive_json()
+        assert [e["title"] for e in first["outline"]] == ["One"]
+        ws.send_json({"type": "edit", "base_version": 0, "field": "markdown", "ops": [{"offset": 11, "insert": "\n\n# Two"}]})
+        assert ws.receive_json()["type"] == "ack"
+        ws.send_json({"type": "outline", "version": first["version"], "template": "base"})
+        second = ws.receive_json()
+        assert second["base_version"] == first["version"] and [e["title"] for e in second["diff"]["insert"]] == ["Two"]
+        ws.send_json({"type": "save"})
+        assert ws.receive_json()["type"] == "saved"
+
+def test_farm_requires_token_or_loopback(monkeypatch):
+    monkeypatch.delenv("KSAITEX_FARM_TOKEN", raising=False)
+    remote = TestClient(app, client=("203.0.113.5", 50000))
+    assert remote.post("/api/farm/heartbeat", json={"worker_id": "x"}).status_code == 403
+    local = TestClient(app, client=("127.0.0.1", 50000))
+    assert local.post("/api/farm/heartbeat", json={"worker_id": "x"}).status_code != 403
+    monkeypatch.setenv("KSAITEX_FARM_TOKEN", "secret")
+    assert local.post("/api/farm/heartbeat", json={"worker_id": "x"}).status_code == 403
+    assert remote.post("/api/farm/heartbeat", json={"worker_id": "x"}, headers={"x-farm-token": "secret"}).status_code != 403
+
+def test_targets_report_failures_per_target(client, monkeypatch):
+    from ksaitex.api import main
+    async def fake_compile(latex, working_dir, limits=None):
+        if "{beamer}" in latex:
+            return None, "! Undefined control sequence.\nl.1 \\oops\n"
+        (working_dir / "main.pdf").write_bytes(b"%PDF")
+        return b"%PDF", ""
+    monkeypatch.setattr(main, "compile_with_farm", fake_compile)
+    body = {"markdown": "# Targets\n\nText", "templates": ["base", "base_present"], "title": "Targets"}
+    r = client.post("/api/compile/targets", json=body)
+    assert r.status_code == 200
+    base, slides = r.json()["targets"]
+    assert base["status"] == "success" and client.get(base["pdf_url"]).content == b"%PDF"
+    assert slides["status"] == "failed" and slides["template"] == "base_present"
+    render_latex = main.render_latex
+    def failing_render(content, config, template_name="base.tex"):
+        if template_name == "base_present.tex":
+            raise ValueError("bad variable")
+        return render_latex(content, config, template_name=template_name)
+    monkeypatch.setattr(main, "render_latex", failing_render)
+    base, slides = client.post("/api/compile/targets", json=body).json()["targets"]
+    assert base["status"] == "success"
+    assert slides == {"template": "base_present", "status": "failed", "detail": "Templating error: bad variable"}
@@ -0,0 +1,77 @@
+import asyncio
+import io
+import json
+import tarfile
+import pytest
+from ksaitex.storage.assets import AssetStore
+from ksaitex.storage.bundles import BundleImporter, BundleError, iter_bundle
+
+def make_project(root):
+    project = root / "data" / "Book"
+    (project / "images").mkdir(parents=True)
+    (project / "project.json").write_text(json.dumps({"title": "Book", "markdown": "# अध्याय"}))
+    (project / "images" / "चित्र.png").write_bytes(b"png" * 1000)
+    (root / "builds").mkdir()
+    (root / "builds" / "main.pdf").write_bytes(b"%PDF")
+    return project
+
+async def chunked(data, size=777):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+def test_bundle_is_a_tar_with_manifest_first(tmp_path):
+    project = make_project(tmp_path)
+    data = b"".join(iter_bundle("Book", project, store=AssetStore(tmp_path / "assets")))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == ["manifest.json", "project.json", "images/चित्र.png"]
+
+def test_import_roundtrip_deduplicates_images(tmp_path):
+    project = make_project(tmp_path)
+    store = AssetStore(tmp_path / "assets")
+    data = b"".join(iter_bundle("Book", project, build_dir=tmp_path / "builds", store=store))
+    target = tmp_path / "other"
+    target.mkdir()
+    first = asyncio.run(BundleImporter(chunked(data), store).extract(target, "Book", build_dir=tmp_path / "imported"))
+    assert first["deduplicated"] == 0 and first["files"] == 3
+    assert (target / "Book" / "images" / "चित्र.png").read_bytes() == b"png" * 1000
+    assert (tmp_path / "imported" / "main.pdf").read_bytes() == b"%PDF"
+    assert not (target / "Book" / "main.pdf").exists()
+    second = asyncio.run(BundleImporter(chunked(data), store).extract(target, "Copy"))
+    assert second["deduplicated"] == 1
+    assert json.loads((target / "Copy" / "project.json").read_text())["title"] == "Copy"
+    with pytest.raises(FileExistsError):
+        asyncio.run(BundleImporter(chunked(data), store).extract(target, "Copy"))
+
+def test_import_rejects_tampered_bundle(tmp_path):
+    project = make_project(tmp_path)
+    store = AssetStore(tmp_path / "assets")
+    data = b"".join(iter_bundle("Book", project, store=store)).replace(b"png" * 10, b"gif" * 10, 1)
+    with pytest.raises(BundleError):
+        asyncio.run(BundleImporter(chunked(data), store).extract(tmp_path / "data", "Evil"))
+    assert not (tmp_path / "data" / "Evil").exists()
+    assert [p.name for p in (tmp_path / "data").iterdir()] == ["Book"]
+
+def test_overwrite_drops_the_replaced_projects_builds(tmp_path):
+    project = make_project(tmp_path)
+    store = AssetStore(tmp_path / "assets")
+    data = b"".join(iter_bundle("Book", project, store=store))
+    builds = tmp_path / "data" / ".builds" / "Book"
+    for build in ("main", "fragment", "target-base"):
+        (builds / build).mkdir(parents=True)
+        (builds / build / "main.pdf").write_bytes(b"%PDF old")
+    asyncio.run(BundleImporter(chunked(data), store).extract(tmp_path / "data", "Book", overwrite=True, build_dir=builds / "main"))
+    assert [p.name for p in builds.iterdir()] == ["main"]
+    assert not (builds / "main" / "main.pdf").exists()
+
+def test_stage_then_install_rechecks_the_target(tmp_path):
+    project = make_project(tmp_path)
+    store = AssetStore(tmp_path / "assets")
+    data = b"".join(iter_bundle("Book", project, store=store))
+    importer = BundleImporter(chunked(data), store)
+    staging = asyncio.run(importer.stage(tmp_path / "data", "New"))
+    assert (staging / "project.json").exists() and not (tmp_path / "data" / "New").exists()
+    # Created by someone else while the upload was streaming.
+    (tmp_path / "data" / "New").mkdir()
+    with pytest.raises(FileExistsError):
+        importer.install(tmp_path / "data", "New")
+    assert sorted(p.name for p in (tmp_path / "data").iterdir()) == ["Book", "New"]
@@ -0,0 +1,56 @@
+import asyncio
+import stat
+import pytest
+from ksaitex.compilation.compiler import CompileLimits, compile_latex, compile_metrics
+
+def fake_lualatex(tmp_path, monkeypatch, body):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "lualatex"
+    script.write_text("#!/bin/sh\n" + body + "\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}:/usr/bin:/bin")
+
+def test_successful_compile_returns_pdf(tmp_path, monkeypatch):
+    fake_lualatex(tmp_path, monkeypatch, 'echo "This is LuaHBTeX"; printf "%%PDF-1.5" > main.pdf')
+    pdf, log = asyncio.run(compile_latex("\\relax", working_dir=tmp_path / "work"))
+    assert pdf == b"%PDF-1.5"
+    assert "LuaHBTeX" in log
+
+def test_stale_pdf_is_not_returned(tmp_path, monkeypatch):
+    fake_lualatex(tmp_path, monkeypatch, "exit 1")
+    work = tmp_path / "work"
+    work.mkdir()
+    (work / "main.pdf").write_bytes(b"old")
+    pdf, _ = asyncio.run(compile_latex("\\relax", working_dir=work))
+    assert pdf is None
+
+def test_timeout_kills_process_group(tmp_path, monkeypatch):
+    fake_lualatex(tmp_path, monkeypatch, "sleep 30 & wait")
+    before = compile_metrics["timed_out"]
+    pdf, log = asyncio.run(compile_latex("\\relax", working_dir=tmp_path / "work", limits=CompileLimits(timeout=0.5)))
+    assert pdf is None
+    assert "timed out" in log
+    assert compile_metrics["timed_out"] == before + 1
+
+def test_output_is_capped(tmp_path, monkeypatch):
+    fake_lualatex(tmp_path, monkeypatch, "head -c 200000 /dev/zero | tr '\\0' 'x'; echo; echo '! Fatal error'")
+    pdf, log = asyncio.run(compile_latex("\\relax", working_dir=tmp_path / "work", limits=CompileLimits(max_log_bytes=1000)))
+    assert len(log) < 1200
+    assert "truncated" in log
+    assert log.rstrip().endswith("! Fatal error")
+
+def test_cpu_limit_kill_is_counted(tmp_path, monkeypatch):
+    fake_lualatex(tmp_path, monkeypatch, "while :; do :; done")
+    before = compile_metrics["limit_killed"]
+    pdf, log = asyncio.run(compile_latex("\\relax", working_dir=tmp_path / "work", limits=CompileLimits(timeout=10, cpu_seconds=1)))
+    assert pdf is None
+    assert "SIGXCPU" in log or "SIGKILL" in log
+    assert compile_metrics["limit_killed"] == before + 1
+
+def test_compile_slots_are_per_event_loop():
+    from ksaitex.compilation.compiler import compile_slots
+    async def slots():
+        assert compile_slots() is compile_slots()
+        return compile_slots()
+    assert asyncio.run(slots()) is not asyncio.run(slots())
@@ -0,0 +1,37 @@
+from ksaitex.compilation.diagnostics import analyze_log, TexLineMapper
+
+LOG = r"""This is LuaHBTeX, Version 1.17.0
+Package xcolor Info: Driver file: luatex.def on input line 274.
+Missing character: There is no उ (U+0909) in font cmmi10!
+Missing character: There is no उ (U+0909) in font cmmi10!
+Missing character: There is no व (U+0935) in font cmmi10!
+Overfull \hbox (17.13042pt too wide) in paragraph at lines 62--63
+\TU/TiroDevanagariSanskrit(0)/m/n/10 विशेषोक्तिविर
+! Missing $ inserted.
+<inserted text> 
+                $
+l.71 ... गरिरहेका छौ ।[^
+                                                  1]
+I've inserted a begin-math/end-math symbol since I think
+Underfull \hbox (badness 10000) in paragraph at lines 676--677
+"""
+
+def test_analyze_log_extracts_and_maps():
+    source_map = {"1": 50, "5": 60, "9": 70}
+    diagnostics = analyze_log(LOG, source_map)
+    assert diagnostics[0] == {"severity": "error", "kind": "error", "message": "Missing $ inserted.", "tex_line": 71, "md_line": 9}
+    overfull = next(d for d in diagnostics if d["kind"] == "overfull")
+    assert overfull["tex_line"] == 62 and overfull["md_line"] == 5
+    glyphs = [d for d in diagnostics if d["kind"] == "missing_glyph"]
+    assert [g["count"] for g in glyphs] == [2, 1]
+    assert all(d["kind"] != "underfull" for d in diagnostics)
+
+def test_mapper_before_first_line_and_offset():
+    mapper = TexLineMapper({"1": 50, "4": 55}, md_offset=10)
+    assert mapper.md_line(10) is None
+    assert mapper.md_line(56) == 14
+    assert TexLineMapper().md_line(5) is None
+
+def test_max_items():
+    log = "\n".join(f"Overfull \\hbox (1.0pt too wide) in paragraph at lines {i}--{i}" for i in range(1, 50))
+    assert len(analyze_log(log, max_items=10)) == 10
@@ -0,0 +1,136 @@
+import asyncio
+import base64
+from ksaitex.compilation import farm as farm_module
+from ksaitex.compilation.farm import CompileFarm, FarmUnavailable
+from ksaitex.storage.assets import AssetStore
+import pytest
+
+def make_farm(tmp_path):
+    return CompileFarm(AssetStore(tmp_path / "assets"), fonts_dir=tmp_path / "fonts")
+
+def test_job_goes_to_shallowest_worker(tmp_path):
+    async def scenario():
+        farm = make_farm(tmp_path)
+        busy = farm.register("busy", 2)
+        idle = farm.register("idle", 2)
+        busy_poll = asyncio.create_task(farm.poll(busy.id, timeout=5))
+        await asyncio.sleep(0)
+        first = asyncio.create_task(farm.compile("\\relax", tmp_path / "a"))
+        job_a = await busy_poll
+        busy_poll = asyncio.create_task(farm.poll(busy.id, timeout=5))
+        idle_poll = asyncio.create_task(farm.poll(idle.id, timeout=5))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(farm.compile("\\relax", tmp_path / "b"))
+        job_b = await idle_poll
+        assert job_b.worker_id == idle.id
+        for worker, job in ((busy, job_a), (idle, job_b)):
+            farm.complete(worker.id, job.id, {"ok": True, "pdf": base64.b64encode(b"%PDF").decode(), "log": "done"})
+        assert (await first)[0] == b"%PDF"
+        assert (await second)[1] == "done"
+        assert (tmp_path / "b" / "main.pdf").read_bytes() == b"%PDF"
+        busy_poll.cancel()
+    asyncio.run(scenario())
+
+def test_lost_worker_job_is_requeued(tmp_path, monkeypatch):
+    async def scenario():
+        farm = make_farm(tmp_path)
+        lost = farm.register("lost", 1)
+        poll = asyncio.create_task(farm.poll(lost.id, timeout=5))
+        await asyncio.sleep(0)
+        result = asyncio.create_task(farm.compile("\\relax", tmp_path / "a"))
+        job = await poll
+        survivor = farm.register("survivor", 1)
+        monkeypatch.setattr(farm_module, "WORKER_TIMEOUT", 0)
+        lost.last_seen -= 1
+        survivor.last_seen += 1
+        farm.reap()
+        assert lost.id not in farm.workers
+        retried = await farm.poll(survivor.id, timeout=5)
+        assert retried.id == job.id and retried.attempts == 2
+        farm.complete(survivor.id, job.id, {"ok": True, "pdf": base64.b64encode(b"%PDF").decode(), "log": ""})
+        assert (await result)[0] == b"%PDF"
+    asyncio.run(scenario())
+
+def test_compile_without_workers_is_unavailable(tmp_path):
+    with pytest.raises(FarmUnavailable):
+        asyncio.run(make_farm(tmp_path).compile("\\relax", tmp_path / "a"))
+
+def test_assets_are_content_addressed(tmp_path):
+    (tmp_path / "proj" / "images").mkdir(parents=True)
+    (tmp_path / "proj" / "images" / "a.png").write_bytes(b"png")
+    (tmp_path / "proj" / "images" / "b.png").write_bytes(b"png")
+    farm = make_farm(tmp_path)
+    assets, fonts = farm.collect_assets(tmp_path / "proj")
+    assert set(assets) == {"images/a.png", "images/b.png"}
+    assert len(set(assets.values())) == 1
+    assert farm.store.path(assets["images/a.png"]).read_bytes() == b"png"
+    assert fonts == {}
+
+def test_assets_are_copies_not_links(tmp_path):
+    source = tmp_path / "a.png"
+    source.write_bytes(b"png")
+    store = AssetStore(tmp_path / "assets")
+    digest = store.add_file(source)
+    with open(source, "r+b") as f:
+        f.write(b"PNG")
+    assert store.path(digest).read_bytes() == b"png"
+    store.materialize(digest, tmp_path / "out" / "a.png")
+    with open(tmp_path / "out" / "a.png", "r+b") as f:
+        f.write(b"PNG")
+    assert store.path(digest).read_bytes() == b"png"
+
+def test_result_without_synctex_drops_the_old_one(tmp_path):
+    async def scenario():
+        farm = make_farm(tmp_path)
+        worker = farm.register("w", 1)
+        (tmp_path / "a").mkdir()
+        (tmp_path / "a" / "main.synctex.gz").write_bytes(b"stale")
+        poll = asyncio.create_task(farm.poll(worker.id, timeout=5))
+        await asyncio.sleep(0)
+        result = asyncio.create_task(farm.compile("\\relax", tmp_path / "a"))
+        job = await poll
+        farm.complete(worker.id, job.id, {"ok": True, "pdf": base64.b64encode(b"%PDF").decode(), "log": ""})
+        await result
+        assert not (tmp_path / "a" / "main.synctex.gz").exists()
+    asyncio.run(scenario())
+
+def test_job_handed_over_at_poll_timeout_is_not_lost(tmp_path):
+    async def scenario():
+        farm = make_farm(tmp_path)
+        worker = farm.register("w", 1)
+        poll = asyncio.create_task(farm.poll(worker.id, timeout=5))
+        await asyncio.sleep(0)
+        poll.cancel()
+        job = farm_module.CompileJob("\\relax", {}, {})
+        farm.jobs[job.id] = job
+        farm.queue.append(job)
+        farm._dispatch()
+        with pytest.raises(asyncio.CancelledError):
+            await poll
+        assert not worker.jobs and list(farm.queue) == [job] and job.attempts == 0
+        assert (await farm.poll(worker.id, timeout=5)) is job
+    asyncio.run(scenario())
+
+def test_stuck_job_is_requeued_then_failed(tmp_path, monkeypatch):
+    async def scenario():
+        farm = make_farm(tmp_path)
+        worker = farm.register("w", 1)
+        monkeypatch.setattr(farm_module, "JOB_TIMEOUT", 0)
+        monkeypatch.setattr(farm_module, "MAX_ATTEMPTS", 2)
+        result = asyncio.create_task(farm.compile("\\relax", tmp_path / "a"))
+        job = await farm.poll(worker.id, timeout=5)
+        job.assigned_at -= 1
+        farm.reap()
+        assert not worker.jobs and (await farm.poll(worker.id, timeout=5)) is job
+        job.assigned_at -= 1
+        farm.reap()
+        with pytest.raises(FarmUnavailable):
+            await result
+    asyncio.run(scenario())
+
+def test_farm_refuses_multiple_server_processes(tmp_path, monkeypatch):
+    farm = make_farm(tmp_path)
+    farm.register("w", 1)
+    assert farm.available
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert not farm.available
@@ -0,0 +1,58 @@
+import pytest
+from ksaitex.parsing.fragments import extract_fragment, slice_lines
+from ksaitex.templating.engine import TemplateEngine
+
+def marker(label, args=""):
+    inner = f"{label}|{args}" if args else label
+    return f"--[[--[[--[[#######-[[MAGIC:{inner}]]-#######]]--]]--]]--"
+
+@pytest.fixture
+def magic_commands():
+    return TemplateEngine().get_metadata("base.tex")["magic_commands"]
+
+def test_enclosing_shloka_block(magic_commands):
+    md = "\n".join([
+        "Intro paragraph.",
+        "",
+        marker("श्लोक सुरु", "align=left"),
+        "",
+        "धर्मक्षेत्रे कुरुक्षेत्रे",
+        "",
+        marker("श्लोक अन्त्य"),
+        "",
+        "Outro paragraph.",
+    ])
+    start, end, fragment = extract_fragment(md, 5, magic_commands)
+    assert (start, end) == (3, 7)
+    assert fragment.startswith(marker("श्लोक सुरु", "align=left"))
+    assert fragment.endswith(marker("श्लोक अन्त्य"))
+
+def test_innermost_pair_wins(magic_commands):
+    md = "\n".join([
+        marker("बक्स सुरु", "title=x"),
+        "",
+        marker("श्लोक सुरु"),
+        "",
+        "text",
+        "",
+        marker("श्लोक अन्त्य"),
+        "",
+        marker("बक्स अन्त्य"),
+    ])
+    start, end, _ = extract_fragment(md, 5, magic_commands)
+    assert (start, end) == (3, 7)
+
+def test_top_level_table_block(magic_commands):
+    md = "Para.\n\n| A | B |\n|---|---|\n| 1 | 2 |\n\nAfter."
+    start, end, fragment = extract_fragment(md, 5, magic_commands)
+    assert (start, end) == (3, 5)
+    assert fragment.startswith("| A | B |")
+
+def test_blank_line_has_no_block(magic_commands):
+    with pytest.raises(ValueError):
+        extract_fragment("One.\n\nTwo.", 2, magic_commands)
+
+def test_slice_lines():
+    assert slice_lines("a\nb\nc\nd", 2, 3) == "b\nc"
+    with pytest.raises(ValueError):
+        slice_lines("a\nb", 3, 4)
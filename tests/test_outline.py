@@ -0,0 +1,63 @@
+import pytest
+from ksaitex.parsing.outline import OutlineBuilder, split_blocks, diff_outline
+from ksaitex.templating.registry import TemplateRegistry
+
+def marker(label, args=""):
+    inner = f"{label}|{args}" if args else label
+    return f"--[[--[[--[[#######-[[MAGIC:{inner}]]-#######]]--]]--]]--"
+
+@pytest.fixture(scope="module")
+def magic_commands():
+    registry = TemplateRegistry()
+    registry.refresh()
+    return registry.get_metadata("base.tex")["magic_commands"]
+
+DOC = "\n".join([
+    marker("महाखण्ड (अध्याय)", "title=पहिलो अध्याय"),
+    "",
+    "Some text.",
+    "",
+    "## A **bold** heading",
+    "",
+    "```",
+    "# not a heading",
+    "",
+    "```",
+    "",
+    marker("खण्ड"),
+    "",
+    marker("नयाँ पृष्ठ"),
+])
+
+def test_outline_entries(magic_commands):
+    outline = OutlineBuilder().build(DOC, "base", magic_commands)
+    assert outline == [
+        {"kind": "magic", "level": 1, "title": "पहिलो अध्याय", "label": "महाखण्ड (अध्याय)", "line": 1},
+        {"kind": "heading", "level": 3, "title": "A bold heading", "line": 5},
+        {"kind": "magic", "level": 2, "title": "नयाँ खण्ड", "label": "खण्ड", "line": 12},
+    ]
+
+def test_split_blocks_keeps_fences():
+    blocks = split_blocks(DOC)
+    assert (7, "```\n# not a heading\n\n```") in blocks
+
+def test_only_changed_blocks_are_parsed(magic_commands):
+    builder = OutlineBuilder()
+    builder.build(DOC, "base", magic_commands)
+    calls = []
+    original = builder.block_outline
+    builder.block_outline = lambda block, commands: calls.append(block) or original(block, commands)
+    edited = DOC.replace("## A **bold** heading", "## Renamed")
+    outline = builder.build(edited, "base", magic_commands)
+    assert calls == ["## Renamed"]
+    assert outline[1]["title"] == "Renamed"
+
+def test_version_diff(magic_commands):
+    builder = OutlineBuilder()
+    first = builder.build(DOC, "base", magic_commands)
+    version = builder.remember(first)
+    second = builder.build(DOC.replace("## A **bold** heading", "## Renamed"), "base", magic_commands)
+    assert builder.previous(version) == first
+    diff = diff_outline(builder.previous(version), second)
+    assert diff == {"start": 1, "delete": 1, "insert": [second[1]]}
+    assert builder.previous("unknown") is None
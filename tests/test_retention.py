@@ -0,0 +1,68 @@
+import os
+import time
+from ksaitex.storage.retention import RetentionManager, touch_build
+
+def make_build(root, project, build, size, age):
+    path = root / ".builds" / project / build
+    path.mkdir(parents=True)
+    (path / "main.pdf").write_bytes(b"x" * size)
+    old = time.time() - age
+    os.utime(path / "main.pdf", (old, old))
+    return path
+
+def manager(root, **kwargs):
+    return RetentionManager(data_dir=root, builds_dir=root / ".builds", cache_root=root / ".cache" / "compile", **kwargs)
+
+def test_global_quota_evicts_least_recently_used(tmp_path):
+    oldest = make_build(tmp_path, "a", "main", 1000, age=3000)
+    newer = make_build(tmp_path, "b", "main", 1000, age=2000)
+    fresh = make_build(tmp_path, "c", "main", 1000, age=0)
+    report = manager(tmp_path, global_quota=1500, project_quota=10**9, min_age=600).run()
+    assert not oldest.exists() and not newer.exists()
+    assert fresh.exists()
+    assert report["freed"] == 2000
+
+def test_open_and_recently_synced_projects_are_kept(tmp_path):
+    open_build = make_build(tmp_path, "open", "main", 1000, age=3000)
+    synced = make_build(tmp_path, "synced", "main", 1000, age=3000)
+    touch_build(synced)
+    manager(tmp_path, global_quota=0, project_quota=10**9, min_age=600).run(protected={"open"})
+    assert open_build.exists() and synced.exists()
+
+def test_project_quota_drops_fragment_first(tmp_path):
+    main = make_build(tmp_path, "p", "main", 1000, age=3000)
+    fragment = make_build(tmp_path, "p", "fragment", 1000, age=1000)
+    manager(tmp_path, global_quota=10**9, project_quota=1500, min_age=600).run()
+    assert main.exists() and not fragment.exists()
+
+def test_target_builds_are_counted_and_evicted_before_main(tmp_path):
+    main = make_build(tmp_path, "p", "main", 1000, age=3000)
+    slides = make_build(tmp_path, "p", "target-base_present", 1000, age=1000)
+    unknown = make_build(tmp_path, "p", "scratch", 1000, age=5000)
+    manager(tmp_path, global_quota=10**9, project_quota=1500, min_age=600).run()
+    assert main.exists() and not slides.exists()
+    assert unknown.exists()
+
+def test_legacy_cleanup_is_opt_in_and_migrates_the_last_build(tmp_path):
+    project = tmp_path / "Book"
+    (project / "images").mkdir(parents=True)
+    for name in ("project.json", "images/a.png", "main.pdf", "main.aux", "source_map.json"):
+        (project / name).write_text("x")
+    for name in ("tmp_test.tex", "tmp_test.log", "tmp_test.pdf", "notes.tex", "report.pdf"):
+        (tmp_path / name).write_text("x")
+    manager(tmp_path).run()
+    assert (project / "main.pdf").exists() and (tmp_path / "tmp_test.pdf").exists()
+    report = manager(tmp_path).run(legacy=True)
+    assert report["legacy_migrated"] == 2
+    assert sorted(p.name for p in project.iterdir()) == ["images", "project.json"]
+    assert sorted(p.name for p in (tmp_path / ".builds" / "Book" / "main").iterdir()) == ["main.pdf", "source_map.json"]
+    # Only outputs whose .tex is present count as TeX leftovers.
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ["notes.tex", "report.pdf"]
+
+def test_leased_project_builds_are_kept(tmp_path):
+    from ksaitex.storage.retention import lease_project
+    leased = make_build(tmp_path, "leased", "fragment", 1000, age=3000)
+    lease_project("leased", tmp_path / ".builds")
+    other = make_build(tmp_path, "other", "main", 1000, age=3000)
+    manager(tmp_path, global_quota=0, project_quota=10**9, min_age=600).run()
+    assert leased.exists() and not other.exists()
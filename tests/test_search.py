@@ -0,0 +1,67 @@
+import unicodedata
+from ksaitex.storage.search import SearchIndex, tokenize
+
+def test_tokenize_keeps_matras_and_normalizes():
+    decomposed = unicodedata.normalize("NFD", "क़लम")
+    assert tokenize("धर्मक्षेत्रे कुरुक्षेत्रे। Gita") == ["धर्मक्षेत्रे", "कुरुक्षेत्रे", "gita"]
+    assert tokenize(decomposed) == tokenize("क़लम")
+    assert tokenize("क्‍ष") == ["क्ष"]
+
+def test_search_finds_line_and_updates_incrementally(tmp_path):
+    index = SearchIndex(tmp_path / "search.sqlite3")
+    index.index_project("gita", "# अध्याय\n\nधर्मक्षेत्रे कुरुक्षेत्रे समवेता युयुत्सवः।\nमामकाः पाण्डवाश्चैव")
+    index.index_project("other", "कुरुक्षेत्रे only")
+    hits = index.search("कुरुक्षेत्रे धर्मक्षेत्रे")["results"]
+    assert [(h["project_id"], h["line"]) for h in hits] == [("gita", 3)]
+    assert "समवेता" in hits[0]["snippet"]
+    assert len(index.search("कुरुक्षेत्रे")["results"]) == 2
+    assert index.index_project("gita", "नया पाठ") is True
+    assert index.index_project("gita", "नया पाठ") is False
+    assert [h["project_id"] for h in index.search("कुरुक्षेत्रे")["results"]] == ["other"]
+    index.rename_project("other", "renamed")
+    assert index.search("only")["results"][0]["project_id"] == "renamed"
+
+def test_prefix_search_and_magic_markers(tmp_path):
+    index = SearchIndex(tmp_path / "search.sqlite3")
+    index.index_project("book", "--[[--[[--[[#######-[[MAGIC:अध्याय|title=प्रथमोऽध्यायः]]-#######]]--]]--]]--\nअर्जुनविषादयोग")
+    assert index.search("magic")["results"] == []
+    assert index.search("प्रथमोऽध्यायः")["results"][0]["snippet"] == "प्रथमोऽध्यायः"
+    assert index.search("अर्जुन*")["results"][0]["line"] == 2
+
+def test_rebuild_from_data_dir(tmp_path):
+    import json
+    (tmp_path / "data" / "p1").mkdir(parents=True)
+    (tmp_path / "data" / "p1" / "project.json").write_text(json.dumps({"markdown": "श्लोक"}))
+    index = SearchIndex(tmp_path / "search.sqlite3")
+    index.index_project("gone", "श्लोक")
+    stats = index.rebuild(tmp_path / "data")
+    assert stats == {"indexed": 1, "unchanged": 0, "removed": 1, "failed": 0}
+    assert [h["project_id"] for h in index.search("श्लोक")["results"]] == ["p1"]
+
+def test_index_is_stale_until_rebuilt(tmp_path):
+    import json
+    import os
+    (tmp_path / "data" / "p1").mkdir(parents=True)
+    (tmp_path / "data" / "p1" / "project.json").write_text(json.dumps({"markdown": "श्लोक"}))
+    index = SearchIndex(tmp_path / "search.sqlite3")
+    assert index.is_stale(tmp_path / "data")
+    index.rebuild(tmp_path / "data")
+    assert not index.is_stale(tmp_path / "data")
+    (tmp_path / "data" / "p2").mkdir()
+    (tmp_path / "data" / "p2" / "project.json").write_text(json.dumps({"markdown": "मन्त्र"}))
+    os.utime(tmp_path / "data" / "p2" / "project.json", (0, 0))
+    # Copied in with an old mtime: caught by the project list instead.
+    assert index.is_stale(tmp_path / "data")
+
+def test_limit_keeps_the_first_results_in_order(tmp_path):
+    import json
+    index = SearchIndex(tmp_path / "search.sqlite3")
+    for name in ("zeta", "alpha", "mid"):
+        index.index_project(name, "श्लोक\nश्लोक")
+    hits = index.search("श्लोक", limit=3)["results"]
+    assert [(h["project_id"], h["line"]) for h in hits] == [("alpha", 1), ("alpha", 2), ("mid", 1)]
+    (tmp_path / "data" / ".import-x").mkdir(parents=True)
+    (tmp_path / "data" / ".import-x" / "project.json").write_text(json.dumps({"markdown": "श्लोक"}))
+    index.rebuild(tmp_path / "data")
+    assert index.search("श्लोक")["results"] == []
+    assert not index.is_stale(tmp_path / "data")
@@ -0,0 +1,60 @@
+import pytest
+from ksaitex.api.sessions import DocumentSession, EditConflict, SaveConflict, SessionManager, apply_op
+
+def test_apply_op_bmp():
+    assert apply_op("नमस्ते world", 7, 5, "दुनिया", False) == "नमस्ते दुनिया"
+
+def test_apply_op_counts_utf16_units():
+    # 😀 is two UTF-16 code units, as the browser counts offsets.
+    assert apply_op("a😀bc", 3, 1, "X", True) == "a😀Xc"
+    with pytest.raises(ValueError):
+        apply_op("abc", 2, 5, "", False)
+
+def test_session_versions_and_conflicts():
+    session = DocumentSession("p", {"title": "P", "markdown": "line one\nline two\n"})
+    assert session.apply(0, "markdown", [{"offset": 9, "delete": 4, "insert": "LINE"}]) == 1
+    assert session.markdown == "line one\nLINE two\n"
+    assert session.dirty
+    with pytest.raises(EditConflict):
+        session.apply(0, "markdown", [])
+    session.apply(1, "markdown", [{"offset": 0, "insert": "new\n"}])
+    assert session.markdown == "new\nline one\nLINE two\n"
+    with pytest.raises(ValueError):
+        session.apply(2, "title", [])
+
+def test_astral_insert_switches_offset_mode():
+    session = DocumentSession("p", {"markdown": "ab"})
+    session.apply(0, "markdown", [{"offset": 1, "insert": "😀"}, {"offset": 3, "delete": 1, "insert": "c"}])
+    assert session.markdown == "a😀c"
+
+def test_manager_keeps_dirty_sessions():
+    manager = SessionManager()
+    session = manager.open("p", {"markdown": ""})
+    assert manager.open("p", {}) is session
+    session.apply(0, "markdown", [{"offset": 0, "insert": "x"}])
+    manager.close(session)
+    manager.close(session)
+    assert manager.is_open("p")
+    session.saved_version = session.version
+    manager.close(session)
+    assert not manager.is_open("p")
+
+def test_save_merges_only_changed_fields():
+    on_disk = {"title": "P", "markdown": "a", "html": "<p>a</p>", "template": "base", "variables": {}}
+    session = DocumentSession("p", on_disk)
+    session.apply(0, "markdown", [{"offset": 1, "insert": "b"}])
+    patched = {**on_disk, "html": "<p>patched</p>"}
+    assert session.changes(patched) == {"markdown": "ab"}
+    with pytest.raises(SaveConflict):
+        session.changes({**on_disk, "markdown": "other"})
+    session.mark_saved(session.version, {"markdown": "ab"})
+    assert not session.dirty and session.changes({**patched, "markdown": "ab"}) == {}
+    # The patched html was never seen by this session: editing it now conflicts.
+    session.apply(1, "html", [{"offset": 0, "insert": "x"}])
+    with pytest.raises(SaveConflict):
+        session.changes({**patched, "markdown": "ab"})
+
+def test_unchanged_settings_keep_the_version():
+    session = DocumentSession("p", {"markdown": "", "template": "base", "variables": {"a": 1}})
+    assert session.set_settings("base", {"a": 1}) == 0 and not session.dirty
+    assert session.set_settings(None, {"a": 2}) == 1
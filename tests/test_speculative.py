@@ -0,0 +1,113 @@
+import asyncio
+import tempfile
+from pathlib import Path
+from ksaitex.compilation.speculative import SpeculativeCompiler, source_signature
+
+def make_compiler(builds, gate=None):
+    compiler = SpeculativeCompiler(max_concurrent=1, nice=5, resume_delay=0.01, builds_dir=Path(tempfile.mkdtemp()))
+    compiler.enabled = True
+    async def builder(job):
+        job.signature = "saved"
+        builds.append(job.project_id)
+        if gate:
+            await gate.wait()
+        compiler.mark_built(job.project_id, job.signature)
+        return True
+    compiler.builder = builder
+    return compiler
+
+def test_schedule_is_debounced_per_project():
+    async def scenario():
+        builds = []
+        compiler = make_compiler(builds)
+        for _ in range(5):
+            compiler.schedule("a", 0.05)
+        compiler.schedule("b", 0.05)
+        await asyncio.sleep(0.2)
+        assert sorted(builds) == ["a", "b"]
+        assert compiler.state("a") == "ready"
+        assert compiler.limits.nice == 5
+    asyncio.run(scenario())
+
+def test_foreground_preempts_and_background_resumes():
+    async def scenario():
+        builds = []
+        gate = asyncio.Event()
+        compiler = make_compiler(builds, gate)
+        compiler.schedule("a")
+        await asyncio.sleep(0.01)
+        assert compiler.state("a") == "running"
+        async with compiler.foreground("b", "other"):
+            await asyncio.sleep(0.05)
+            # Preempted and waiting for the interactive compile to finish.
+            assert compiler.metrics["preempted"] == 1
+            assert "a" not in compiler.running
+        gate.set()
+        await asyncio.sleep(0.1)
+        assert builds == ["a", "a"]
+        assert compiler.is_built("a", "saved")
+    asyncio.run(scenario())
+
+def test_preempted_build_is_dropped_after_a_newer_foreground_build():
+    async def scenario():
+        builds = []
+        gate = asyncio.Event()
+        compiler = make_compiler(builds, gate)
+        compiler.schedule("a")
+        await asyncio.sleep(0.01)
+        async with compiler.foreground("a", "unsaved editor text"):
+            await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.sleep(0.1)
+        assert builds == ["a"]
+        assert compiler.metrics["preempted"] == 1 and compiler.metrics["superseded"] == 1
+        assert compiler.state("a") == "none"
+        # Work asked for after the interactive build still runs.
+        compiler.schedule("a")
+        await asyncio.sleep(0.05)
+        assert builds == ["a", "a"]
+    asyncio.run(scenario())
+
+def test_foreground_for_the_same_build_waits_instead_of_preempting():
+    async def scenario():
+        builds = []
+        gate = asyncio.Event()
+        compiler = make_compiler(builds, gate)
+        compiler.schedule("a")
+        await asyncio.sleep(0.01)
+        async with compiler.foreground("a", "saved"):
+            assert compiler.state("a") == "running"
+        gate.set()
+        await asyncio.sleep(0.01)
+        assert compiler.metrics["preempted"] == 0
+        assert builds == ["a"]
+    asyncio.run(scenario())
+
+def test_cancel_drops_work_without_rescheduling():
+    async def scenario():
+        builds = []
+        gate = asyncio.Event()
+        compiler = make_compiler(builds, gate)
+        compiler.schedule("a")
+        compiler.schedule("b", 0.05)
+        await asyncio.sleep(0.01)
+        compiler.cancel("a")
+        compiler.cancel("b")
+        await asyncio.sleep(0.1)
+        assert builds == ["a"]
+        assert compiler.state("a") == "none" and compiler.state("b") == "none"
+        assert compiler.metrics["cancelled"] == 2
+    asyncio.run(scenario())
+
+def test_signature_covers_template_and_variables():
+    base = source_signature("# x", "base", {"a": 1})
+    assert base == source_signature("# x", "base", {"a": 1})
+    assert base != source_signature("# x", "other", {"a": 1})
+    assert base != source_signature("# x", "base", {"a": 2})
+
+def test_built_signature_is_shared_through_the_build_dir(tmp_path):
+    first = SpeculativeCompiler(builds_dir=tmp_path)
+    first.mark_built("a", source_signature("# A", "base", {}))
+    other_process = SpeculativeCompiler(builds_dir=tmp_path)
+    assert other_process.is_built("a", source_signature("# A", "base", {}))
+    assert other_process.state("a") == "ready" and other_process.state("b") == "none"
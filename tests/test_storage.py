@@ -0,0 +1,65 @@
+import asyncio
+from ksaitex.storage.cache import CompileCache
+from ksaitex.storage.files import atomic_write_json
+from ksaitex.storage.locks import file_lock
+
+def test_compile_cache_roundtrip(tmp_path):
+    cache = CompileCache(tmp_path / "cache")
+    build = tmp_path / "build"
+    build.mkdir()
+    (build / "main.pdf").write_bytes(b"%PDF-1.5 test")
+    (build / "main.tex").write_text("\\relax")
+    key = cache.key("\\relax", build)
+    assert cache.restore(key, tmp_path / "out") is None
+    cache.store(key, build)
+    cache.store(key, build)
+    assert cache.restore(key, tmp_path / "out") == b"%PDF-1.5 test"
+    assert (tmp_path / "out" / "main.tex").read_text() == "\\relax"
+
+def test_compile_cache_key_tracks_images(tmp_path):
+    cache = CompileCache(tmp_path / "cache")
+    key = cache.key("doc", tmp_path)
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "a.png").write_bytes(b"1")
+    assert cache.key("doc", tmp_path) != key
+
+def test_atomic_write_json(tmp_path):
+    target = tmp_path / "p" / "project.json"
+    atomic_write_json(target, {"title": "x"})
+    assert target.read_text() == '{\n    "title": "x"\n}'
+    assert [p.name for p in target.parent.iterdir()] == ["project.json"]
+
+def test_file_lock_serialises_coroutines(tmp_path):
+    order = []
+    async def worker(name):
+        async with file_lock(tmp_path / "x.lock"):
+            order.append(f"{name}-in")
+            await asyncio.sleep(0.05)
+            order.append(f"{name}-out")
+    async def main():
+        await asyncio.gather(worker("a"), worker("b"))
+    asyncio.run(main())
+    assert order in (["a-in", "a-out", "b-in", "b-out"], ["b-in", "b-out", "a-in", "a-out"])
+
+def test_file_lock_waits_without_executor_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    class NoThreads(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            raise AssertionError("lock waiters must not occupy executor threads")
+    async def worker():
+        async with file_lock(tmp_path / "x.lock"):
+            await asyncio.sleep(0.01)
+    async def main():
+        asyncio.get_running_loop().set_default_executor(NoThreads())
+        await asyncio.gather(*(worker() for _ in range(8)))
+    asyncio.run(main())
+
+def test_build_lock_does_not_block_project_lock():
+    from ksaitex.storage.locks import build_lock, project_lock
+    async def scenario():
+        async def save():
+            async with project_lock("LockedBuild"):
+                return True
+        async with build_lock("LockedBuild"):
+            assert await asyncio.wait_for(save(), 0.5)
+    asyncio.run(scenario())
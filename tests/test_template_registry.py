@@ -0,0 +1,80 @@
+import shutil
+import pytest
+from ksaitex.templating.engine import TEMPLATE_DIR
+from ksaitex.templating.registry import TemplateRegistry, parse_args_schema
+
+def test_parse_args_schema():
+    args = parse_args_schema("title:text:नयाँ खण्ड|align:select,Center,Left,Right:Center|count:number:3|file:image")
+    assert [a.name for a in args] == ["title", "align", "count", "file"]
+    assert args[0].type == "text" and args[0].default == "नयाँ खण्ड"
+    assert args[1].type == "select" and args[1].options == ["Center", "Left", "Right"] and args[1].default == "Center"
+    assert args[2].default == "3"
+    assert args[3].default == ""
+
+def test_parse_args_schema_keeps_colons_in_default():
+    args = parse_args_schema("date:text:\\today:late")
+    assert args[0].default == "\\today:late"
+
+def test_parse_args_schema_rejects_unknown_type():
+    with pytest.raises(ValueError):
+        parse_args_schema("x:colour:red")
+
+def test_registry_metadata_and_args_compat():
+    registry = TemplateRegistry()
+    registry.refresh()
+    metadata = registry.get_metadata("base.tex")
+    khanda = next(c for c in metadata["magic_commands"] if c["name"] == "khanda")
+    assert khanda["args"] == "title:text:नयाँ खण्ड"
+    assert khanda["arg_schema"] == [{"name": "title", "type": "text", "options": [], "default": "नयाँ खण्ड"}]
+    assert khanda["toc_level"] == "2"
+    assert metadata["variables"]["page_size"]["type"] == "select"
+
+def test_registry_reloads_only_changed(tmp_path):
+    shutil.copy(TEMPLATE_DIR / "base.tex", tmp_path / "base.tex")
+    shutil.copy(TEMPLATE_DIR / "base_present.tex", tmp_path / "base_present.tex")
+    registry = TemplateRegistry(tmp_path)
+    assert sorted(registry.refresh()) == ["base", "base_present"]
+    etag = registry.etag
+    assert registry.refresh() == []
+    assert registry.etag == etag
+    with open(tmp_path / "base_present.tex", "a", encoding="utf-8") as f:
+        f.write("\n% \\MAGIC{ extra, label='Extra', command='\\relax' }\n")
+    assert registry.refresh() == ["base_present"]
+    assert registry.etag != etag
+    (tmp_path / "base_present.tex").unlink()
+    assert registry.refresh() == ["base_present"]
+    assert registry.get_metadata("base_present.tex") == {"variables": {}, "magic_commands": []}
+
+def test_engine_strips_metadata_and_uses_bytecode_cache(tmp_path):
+    from jinja2 import FileSystemBytecodeCache
+    from ksaitex.templating.engine import TemplateEngine
+    (tmp_path / "tpl").mkdir()
+    (tmp_path / "tpl" / "mini.tex").write_text("% \\VAR{ size, default='12pt', type='select', options='10pt|12pt' }\n\\documentclass[\\VAR{ size, default='12pt' }]{article}\n\\VAR{content}\n")
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    engine = TemplateEngine(tmp_path / "tpl", FileSystemBytecodeCache(str(cache_dir)))
+    assert engine.render("mini.tex", {"size": "10pt", "content": "x"}) == "\\documentclass[10pt]{article}\nx"
+    assert len(list(cache_dir.iterdir())) == 1
+
+def test_default_bytecode_cache_uses_xdg_cache_home(tmp_path, monkeypatch):
+    from ksaitex.templating.engine import default_bytecode_cache
+    monkeypatch.delenv("KSAITEX_JINJA_CACHE_DIR", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    assert default_bytecode_cache().directory == str(tmp_path / "ksaitex" / "jinja")
+    assert not (tmp_path / "data").exists()
+
+def test_invalid_arg_type_is_reported_but_template_kept(tmp_path):
+    (tmp_path / "odd.tex").write_text("% \\MAGIC{ box, label='Box', command='\\fbox{VAR_c}', args='c:colour:red' }\n\\VAR{content}\n")
+    registry = TemplateRegistry(tmp_path)
+    assert registry.refresh() == ["odd"]
+    metadata = registry.get_metadata("odd.tex")
+    assert metadata["errors"] and "colour" in metadata["errors"][0]
+    assert metadata["magic_commands"][0]["arg_schema"][0]["type"] == "text"
+    assert registry.get("odd.tex").template.render(content="x") == "x"
+
+def test_render_latex_raises_for_missing_template():
+    from jinja2 import TemplateNotFound
+    from ksaitex.templating.engine import render_latex
+    with pytest.raises(TemplateNotFound):
+        render_latex("x", {}, template_name="missing.tex")
@@ -2,6 +2,7 @@ console.error("DIAGNOSTIC: app.js loaded at " + new Date().toLocaleTimeString())
 import * as api from './modules/api.js';
 import * as ui from './modules/ui.js';
 import * as editor from './modules/editor.js';
+import { ProjectSession } from './modules/session.js';
 console.error("DIAGNOSTIC: Modules imported");
 const convertBtn = document.getElementById('convertBtn');
 const markdownEditor = document.getElementById('markdownEditor');
@@ -41,6 +42,8 @@ let availableTemplates = {};
 let projectsListCache = [];
 let currentProjectId = null;
 let isDirty = false;
+let session = null;
+let sessionPushTimer = null;
 async function init() {
     console.error("DIAGNOSTIC: init() started");
     try {
@@ -50,7 +53,9 @@ async function init() {
         editor.initEditor(markdownEditor);
         // Auto-save disabled per user request to avoid UI blocking.
         // Projects are now saved manually when the 'Generate' button is clicked.
-        markdownEditor.addEventListener('input', () => { isDirty = true; });
+        // Edits still stream to the server session, which only writes project.json
+        // on its own when the server sets KSAITEX_AUTOSAVE_DELAY.
+        markdownEditor.addEventListener('input', () => { isDirty = true; scheduleSessionPush(); });
         tabsContent.addEventListener('input', (e) => {
             if (e.target.classList.contains('dynamic-input')) isDirty = true;
         });
@@ -907,6 +912,7 @@ function refreshWelcomeList() {
         delBtn.onclick = async (e) => {
             e.stopPropagation();
             if (confirm(`Delete project "${p.title}" permanently?`)) {
+                if (p.id === currentProjectId) closeSession();
                 await api.deleteProject(p.id);
                 await refreshProjects();
                 refreshWelcomeList();
@@ -980,20 +986,26 @@ async function handleRenameProject() {
         return;
     }
     try {
+        // The session is bound to the old id: save through it and close it first.
+        await autoSave();
+        closeSession();
         const renamed = await api.renameProject(currentProjectId, newTitle);
         currentProjectId = renamed.new_id;
+        openSession(renamed.new_id);
         projectTitleInput.value = newTitle;
         await refreshProjects();
         saveStatus.textContent = "Renamed and Saved";
         hideRenameModal();
         isDirty = false;
     } catch (e) {
+        if (!session && currentProjectId) openSession(currentProjectId);
         renameTitleError.textContent = e.message;
         renameTitleError.classList.remove('hidden');
     }
 }
 function resetProject(newTitle = "Untitled Project", initialContent = "") {
     console.error("DIAGNOSTIC: Resetting project to", newTitle);
+    closeSession();
     projectTitleInput.value = newTitle;
     editor.loadContent(initialContent, markdownEditor);
     saveStatus.textContent = "New Project";
@@ -1012,7 +1024,10 @@ function resetProject(newTitle = "Untitled Project", initialContent = "") {
     api.saveProject(newTitle, initialContent, "base", {}).then(res => {
         refreshProjects().then(() => {
             const p = projectsListCache.find(x => x.title === newTitle);
-            if (p) currentProjectId = p.id;
+            if (p) {
+                currentProjectId = p.id;
+                openSession(p.id);
+            }
             isDirty = false;
         });
     });
@@ -1053,9 +1068,17 @@ async function compile() {
         });
         const title = projectTitleInput.value || "Untitled";
         console.log("DEBUG: Compiling with title:", title);
-        const blob = await api.compileLatex(markdown, templateSelect.value, variables, title);
-        const blobUrl = URL.createObjectURL(blob);
-        let finalSrc = blobUrl;
+        let finalSrc;
+        if (sessionActive()) {
+            // The server already holds the text; only pending splices are sent.
+            pushToSession();
+            const reply = await session.compile();
+            if (reply.type !== 'compiled') throw new Error(api.formatErrorDetail(reply.detail) || "Compilation failed");
+            finalSrc = reply.pdf_url;
+        } else {
+            const blob = await api.compileLatex(markdown, templateSelect.value, variables, title);
+            finalSrc = URL.createObjectURL(blob);
+        }
         if (currentProjectId) {
             const lineIndex = editor.getCursorLine(markdownEditor);
             try {
@@ -1089,25 +1112,70 @@ async function autoSave() {
     saveStatus.classList.add('saving');
 
     try {
-        const markdown = editor.getMarkdownContent(markdownEditor);
-        const html = editor.getHTMLContent(markdownEditor);
-
         const template = templateSelect.value;
         const variables = {};
         document.querySelectorAll('.dynamic-input').forEach(input => {
             if (input.value.trim()) variables[input.id] = input.id.includes('projectTitle') ? "" : input.value.trim();
         });
 
-        await api.saveProject(title, markdown, template, variables, html);
+        if (sessionActive()) {
+            pushToSession();
+            session.settings(template, variables);
+            const reply = await session.save();
+            if (reply.type !== 'saved') throw new Error(reply.detail);
+        } else {
+            const markdown = editor.getMarkdownContent(markdownEditor);
+            const html = editor.getHTMLContent(markdownEditor);
+            await api.saveProject(title, markdown, template, variables, html);
+        }
 
         saveStatus.textContent = "Saved at " + new Date().toLocaleTimeString();
         saveStatus.classList.remove('saving');
         isDirty = false;
     } catch (e) {
-        saveStatus.textContent = "Save Failed";
+        console.error("Save failed:", e);
+        saveStatus.textContent = e.message ? "Save Failed: " + e.message : "Save Failed";
         saveStatus.classList.remove('saving');
     }
 }
+function sessionActive() {
+    return session !== null && session.open && session.projectId === currentProjectId;
+}
+async function openSession(id) {
+    // Edits, saves and compiles go over the session; HTTP stays the fallback.
+    closeSession();
+    const opened = new ProjectSession(id);
+    try {
+        await opened.connect();
+    } catch (e) {
+        console.error("Edit session unavailable, using HTTP:", e);
+        return;
+    }
+    if (currentProjectId !== id) {
+        opened.close();
+        return;
+    }
+    session = opened;
+    if (isDirty) pushToSession();
+}
+function closeSession() {
+    if (!session) return;
+    pushToSession();
+    session.close();
+    session = null;
+}
+function pushToSession() {
+    if (sessionPushTimer) clearTimeout(sessionPushTimer);
+    sessionPushTimer = null;
+    if (!sessionActive()) return;
+    session.update('markdown', editor.getMarkdownContent(markdownEditor));
+    session.update('html', editor.getHTMLContent(markdownEditor));
+}
+function scheduleSessionPush() {
+    if (!sessionActive()) return;
+    if (sessionPushTimer) clearTimeout(sessionPushTimer);
+    sessionPushTimer = setTimeout(pushToSession, 500);
+}
 async function refreshProjects() {
     try {
         const projects = await api.fetchProjects();
@@ -1118,7 +1186,9 @@ async function refreshProjects() {
 }
 async function loadProject(id) {
     try {
-        const data = await api.fetchProject(id);
+        // The editor only needs the markdown when no HTML snapshot was saved.
+        const data = await api.fetchProject(id, ['title', 'template', 'variables', 'html']);
+        closeSession();
         currentProjectId = id;
         projectTitleInput.value = data.title;
         if (data.template) {
@@ -1130,7 +1200,7 @@ async function loadProject(id) {
         if (data.html) {
             editor.setHTMLContent(data.html, markdownEditor);
         } else {
-            editor.loadContent(data.markdown, markdownEditor);
+            editor.loadContent(await api.fetchProjectMarkdown(id), markdownEditor);
         }
         if (data.template) {
             await ui.renderTabs(data.template, availableTemplates, {
@@ -1149,70 +1219,94 @@ async function loadProject(id) {
         saveStatus.textContent = "Project Loaded";
         isDirty = false;
         if (tocSidebar && !tocSidebar.classList.contains('hidden')) updateToC();
+        openSession(id);
+        showSpeculativeBuild(id);
     } catch (e) {
         ui.showError("Load Failed: " + e.message, errorLog, errorOverlay);
     }
 }
-const SECTIONING_COMMANDS = {
-    'महाखण्ड': 1,
-    'विशेष महाखण्ड': 1,
-    'खण्ड': 2,
-    'शीर्षक स्लाइड': 1,
-    'खण्ड शीर्षक स्लाइड': 1,
-    'विशेष खण्ड': 2,
-    'उपखण्ड': 3,
-    'विशेष उपखण्ड': 3,
-    'उप-उपखण्ड': 4,
-    'विशेष उप-उपखण्ड': 4,
-    'अनुच्छेद शीर्षक': 5,
-    'Section': 2,
-    'Subsection': 3,
-    'Subsubsection': 4,
-    'Chapter': 1
-};
-
+async function showSpeculativeBuild(id, attempts = 40) {
+    // Opening a project starts a background build; show its PDF unless the user compiled first.
+    const shownSrc = pdfPreview.src;
+    for (let i = 0; i < attempts; i++) {
+        if (currentProjectId !== id || pdfPreview.src !== shownSrc) return;
+        let status;
+        try {
+            status = await api.fetchSpeculativeStatus(id);
+        } catch (ignore) {
+            return;
+        }
+        if (status.ready) {
+            pdfPreview.src = status.pdf_url;
+            pdfPreview.classList.remove('hidden');
+            emptyState.classList.add('hidden');
+            return;
+        }
+        if (status.state === 'none') return;
+        await new Promise(resolve => setTimeout(resolve, 1500));
+    }
+}
 let tocUpdateTimeout = null;
+let tocOutline = [];
+let tocVersion = null;
 function debouncedUpdateToC() {
     if (tocUpdateTimeout) clearTimeout(tocUpdateTimeout);
     tocUpdateTimeout = setTimeout(updateToC, 1000);
 }
 
-function updateToC() {
+async function updateToC() {
     if (!tocContent) return;
-    
-    const blocks = markdownEditor.querySelectorAll('.magic-block');
-    tocContent.innerHTML = '';
-    
-    let found = false;
-    const templateMagicCommands = availableTemplates[templateSelect.value]?.magic_commands || [];
-    
-    blocks.forEach((block, index) => {
-        const label = block.dataset.label;
-        const cmd = templateMagicCommands.find(c => c.label === label);
-        const level = block.dataset.tocLevel || (cmd && cmd.toc_level) || SECTIONING_COMMANDS[label];
-        
-        if (level) {
-            found = true;
-            const titleBtn = block.querySelector('.magic-arg-btn[data-name="title"]');
-            const title = titleBtn ? (titleBtn.dataset.fullValue || "Untitled") : label;
-            
-            const item = document.createElement('div');
-            item.className = `toc-item toc-level-${level}`;
-            item.textContent = title.replace(/\*\*/g, ''); 
-            item.title = title;
-            item.onclick = () => {
-                block.scrollIntoView({ behavior: 'smooth', block: 'center' });
-                const originalBorder = block.style.borderColor;
-                block.style.borderColor = 'var(--yellow)';
-                setTimeout(() => { block.style.borderColor = ''; }, 2000);
-                document.querySelectorAll('.toc-item').forEach(el => el.classList.remove('active'));
-                item.classList.add('active');
-            };
-            tocContent.appendChild(item);
+    // The server parses the outline incrementally and, given the version we hold, returns only the changed slice.
+    // With a session open it already has the text, so only pending splices travel.
+    const baseVersion = tocVersion;
+    let res;
+    try {
+        if (sessionActive()) {
+            pushToSession();
+            res = await session.outline(baseVersion, templateSelect.value);
+            if (res.type !== 'outline') throw new Error(res.detail || "Outline failed");
+        } else {
+            res = await api.fetchOutline(editor.getMarkdownContent(markdownEditor), templateSelect.value, baseVersion);
         }
-    });
-    
-    if (!found) {
+    } catch (e) {
+        console.error("Outline update failed:", e);
+        return;
+    }
+    if (res.diff) {
+        if (tocVersion !== baseVersion) {
+            // Another update landed first; the diff no longer applies.
+            tocVersion = null;
+            return updateToC();
+        }
+        tocOutline.splice(res.diff.start, res.diff.delete, ...res.diff.insert);
+    } else {
+        tocOutline = res.outline || [];
+    }
+    tocVersion = res.version;
+    renderToC();
+}
+
+function renderToC() {
+    tocContent.innerHTML = '';
+    if (!tocOutline.length) {
         tocContent.innerHTML = '<div class="toc-empty">No sectioning commands found.</div>';
+        return;
     }
+    tocOutline.forEach(entry => {
+        const item = document.createElement('div');
+        item.className = `toc-item toc-level-${entry.level}`;
+        item.textContent = entry.title;
+        item.title = entry.title;
+        item.onclick = () => {
+            let node = editor.findNodeAtLine(markdownEditor, entry.line);
+            if (node && node.nodeType !== Node.ELEMENT_NODE) node = node.parentElement;
+            if (!node || node === markdownEditor) return;
+            node.scrollIntoView({ behavior: 'smooth', block: 'center' });
+            node.style.borderColor = 'var(--yellow)';
+            setTimeout(() => { node.style.borderColor = ''; }, 2000);
+            document.querySelectorAll('.toc-item').forEach(el => el.classList.remove('active'));
+            item.classList.add('active');
+        };
+        tocContent.appendChild(item);
+    });
 }
@@ -22,10 +22,21 @@ export async function compileLatex(markdown, template, variables, title) {
     });
     if (!response.ok) {
         const errorData = await response.json();
-        throw new Error(errorData.detail || "Compilation failed");
+        throw new Error(formatErrorDetail(errorData.detail) || "Compilation failed");
     }
     return await response.blob();
 }
+export function formatErrorDetail(detail) {
+    if (!detail || typeof detail === 'string') return detail;
+    const lines = [detail.message];
+    (detail.diagnostics || []).forEach(d => {
+        const where = d.md_line ? `Line ${d.md_line}` : (d.tex_line ? `TeX line ${d.tex_line}` : '');
+        const count = d.count > 1 ? ` (x${d.count})` : '';
+        lines.push(`[${d.severity}] ${where ? where + ': ' : ''}${d.message}${count}`);
+    });
+    if (detail.log_url) lines.push(`Full log: ${detail.log_url}`);
+    return lines.join('\n');
+}
 export async function saveProject(title, markdown, template, variables, html = "") {
     const res = await fetch('/api/save', {
         method: 'POST',
@@ -58,11 +69,17 @@ export async function fetchProjects() {
     const data = await res.json();
     return data.projects;
 }
-export async function fetchProject(id) {
-    const res = await fetch(`/api/projects/${id}`);
+export async function fetchProject(id, fields = null) {
+    const query = fields ? `?fields=${fields.join(',')}` : '';
+    const res = await fetch(`/api/projects/${id}${query}`);
     if (!res.ok) throw new Error("Project not found");
     return await res.json();
 }
+export async function fetchProjectMarkdown(id) {
+    const res = await fetch(`/api/projects/${id}/markdown`);
+    if (!res.ok) throw new Error("Project not found");
+    return await res.text();
+}
 export async function syncPosition(project_id, line) {
     const res = await fetch('/api/sync', {
         method: 'POST',
@@ -98,4 +115,18 @@ export async function uploadImage(project_id, file) {
         throw new Error(err.detail || "Upload failed");
     }
     return await res.json();
-}
\ No newline at end of file
+}
+export async function fetchOutline(markdown, template, version = null) {
+    const res = await fetch('/api/outline', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ markdown, template, version })
+    });
+    if (!res.ok) throw new Error(formatErrorDetail((await res.json()).detail) || "Outline failed");
+    return await res.json();
+}
+export async function fetchSpeculativeStatus(id) {
+    const res = await fetch(`/api/projects/${encodeURIComponent(id)}/speculative`);
+    if (!res.ok) throw new Error("Project not found");
+    return await res.json();
+}
@@ -429,6 +429,24 @@ export function getCursorLine(editor) {
     const linesBefore = textBefore === "" ? 0 : textBefore.split('\n').length;
     return linesBefore;
 }
+export function findNodeAtLine(editor, line) {
+    // Top-level node holding a 1-based markdown line (as reported by /api/outline).
+    // Start lines grow with the node index, so a binary search keeps this to a few walks.
+    const nodes = Array.from(editor.childNodes);
+    let lo = 0, hi = nodes.length - 1, found = null;
+    while (lo <= hi) {
+        const mid = (lo + hi) >> 1;
+        const before = getMarkdownContent(editor, nodes[mid]);
+        const startLine = before === "" ? 1 : before.split('\n').length + 2;
+        if (startLine <= line) {
+            found = nodes[mid];
+            lo = mid + 1;
+        } else {
+            hi = mid - 1;
+        }
+    }
+    return found;
+}
 export function findUnmatchedBegin(editor, targetGroup) {
     let range = null;
     const sel = window.getSelection();
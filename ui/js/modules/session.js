@@ -0,0 +1,129 @@
+// Diff-based edit session over /ws/projects/{id}.
+// The server holds the document; we only send splices against its version.
+export function computeSplice(oldText, newText) {
+    let start = 0;
+    const minLen = Math.min(oldText.length, newText.length);
+    while (start < minLen && oldText.charCodeAt(start) === newText.charCodeAt(start)) start++;
+    let oldEnd = oldText.length;
+    let newEnd = newText.length;
+    while (oldEnd > start && newEnd > start && oldText.charCodeAt(oldEnd - 1) === newText.charCodeAt(newEnd - 1)) {
+        oldEnd--;
+        newEnd--;
+    }
+    if (start === oldEnd && start === newEnd) return null;
+    return { offset: start, delete: oldEnd - start, insert: newText.slice(start, newEnd) };
+}
+export class ProjectSession {
+    constructor(projectId, { onMessage = () => {} } = {}) {
+        this.projectId = projectId;
+        this.onMessage = onMessage;
+        this.version = 0;
+        this.synced = { markdown: "", html: "" };
+        this.inFlight = false;
+        this.pending = {};
+        this.pendingSettings = null;
+        this.latest = {};
+        this.idleWaiters = [];
+        this.replyWaiters = [];
+        this.open = false;
+        this.ws = null;
+    }
+    connect() {
+        const proto = location.protocol === 'https:' ? 'wss' : 'ws';
+        return new Promise((resolve, reject) => {
+            this.ws = new WebSocket(`${proto}://${location.host}/ws/projects/${this.projectId}`);
+            this.ws.onerror = reject;
+            this.ws.onclose = () => {
+                this.open = false;
+                reject(new Error("Session closed"));
+                this.settle({ type: 'error', detail: "Session closed" });
+            };
+            this.ws.onmessage = (event) => {
+                const msg = JSON.parse(event.data);
+                if (msg.type === 'ready') {
+                    // Fetch the server's copy first: it may hold unsaved edits from another tab.
+                    this.open = true;
+                    this.version = msg.version;
+                    this.inFlight = true;
+                    this.send({ type: 'resync' });
+                    resolve(this);
+                } else if (msg.type === 'state') {
+                    this.version = msg.version;
+                    this.synced = { markdown: msg.markdown || "", html: msg.html || "" };
+                    this.inFlight = false;
+                    // Re-apply our local text on top of the server's copy.
+                    Object.assign(this.pending, this.latest);
+                    this.flush();
+                } else if (msg.type === 'ack') {
+                    this.version = msg.version;
+                    this.inFlight = false;
+                    this.flush();
+                } else if (msg.type === 'conflict' || (msg.type === 'error' && this.inFlight)) {
+                    this.send({ type: 'resync' });
+                } else {
+                    this.answer(msg);
+                }
+                this.onMessage(msg);
+            };
+        });
+    }
+    send(msg) {
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) this.ws.send(JSON.stringify(msg));
+    }
+    update(field, text) {
+        this.latest[field] = text;
+        this.pending[field] = text;
+        this.flush();
+    }
+    flush() {
+        if (this.inFlight) return;
+        for (const field of Object.keys(this.pending)) {
+            const text = this.pending[field];
+            delete this.pending[field];
+            const splice = computeSplice(this.synced[field] ?? "", text);
+            if (!splice) continue;
+            this.synced[field] = text;
+            this.inFlight = true;
+            this.send({ type: 'edit', base_version: this.version, field, ops: [splice] });
+            return;
+        }
+        if (this.pendingSettings) {
+            this.inFlight = true;
+            this.send({ type: 'settings', ...this.pendingSettings });
+            this.pendingSettings = null;
+            return;
+        }
+        this.idleWaiters.splice(0).forEach(resolve => resolve());
+    }
+    whenIdle() {
+        if (!this.inFlight && !Object.keys(this.pending).length && !this.pendingSettings) return Promise.resolve();
+        return new Promise(resolve => this.idleWaiters.push(resolve));
+    }
+    request(msg, replyTypes) {
+        // Edits go first, so the server answers for the text the user sees.
+        return this.whenIdle().then(() => new Promise(resolve => {
+            if (!this.open) return resolve({ type: 'error', detail: "Session closed" });
+            this.replyWaiters.push({ replyTypes: [...replyTypes, 'error'], resolve });
+            this.send(msg);
+        }));
+    }
+    answer(msg) {
+        const i = this.replyWaiters.findIndex(w => w.replyTypes.includes(msg.type));
+        if (i >= 0) this.replyWaiters.splice(i, 1)[0].resolve(msg);
+    }
+    settle(msg) {
+        this.replyWaiters.splice(0).forEach(w => w.resolve(msg));
+        this.idleWaiters.splice(0).forEach(resolve => resolve());
+    }
+    settings(template, variables) {
+        this.pendingSettings = { template, variables };
+        this.flush();
+    }
+    save() { return this.request({ type: 'save' }, ['saved', 'save_conflict']); }
+    compile() { return this.request({ type: 'compile' }, ['compiled', 'compile_failed']); }
+    outline(version = null, template = null) { return this.request({ type: 'outline', version, template }, ['outline']); }
+    close() {
+        this.open = false;
+        if (this.ws) this.ws.close();
+    }
+}